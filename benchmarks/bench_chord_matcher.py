@@ -0,0 +1,94 @@
+"""
+Chord Template Matcher Benchmark - PhinAccords
+Heavenkeys Ltd
+
+Compares python-service's vectorized recognize_chords with a per-frame
+reference loop on synthetic chroma for tracks from 30 seconds to 60 minutes,
+and checks that both produce the same segments.
+
+Usage:
+    python benchmarks/bench_chord_matcher.py [--loop-limit SECONDS]
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python-service"))
+from pipeline import recognize_chords  # noqa: E402
+from chord_templates import CHORD_NAMES, CHORD_TEMPLATES, MIN_SIMILARITY  # noqa: E402
+
+SR = 22050
+HOP_LENGTH = 512
+DURATIONS = [30, 60, 240, 600, 1800, 3600]
+
+def loop_recognize_chords(chroma: np.ndarray, hop_length: int, sr: int) -> list:
+    """Frame-by-frame reference, scoring each frame by cosine similarity like chord_templates.match_chords"""
+    chords = []
+    chord_templates = dict(zip(CHORD_NAMES, CHORD_TEMPLATES.tolist()))
+    frame_time = hop_length / sr
+    num_frames = chroma.shape[1]
+    current_chord = None
+    chord_start = 0.0
+    
+    for frame_idx in range(num_frames):
+        frame_chroma = chroma[:, frame_idx]
+        frame_chroma_norm = frame_chroma / (np.linalg.norm(frame_chroma) + 1e-10)
+        best_match = None
+        best_score = 0.0
+        for chord_name, template in chord_templates.items():
+            similarity = np.dot(frame_chroma_norm, template)
+            if similarity > best_score:
+                best_score = similarity
+                best_match = chord_name
+        if best_match and best_score >= MIN_SIMILARITY:
+            if best_match != current_chord:
+                if current_chord:
+                    chords.append({'chord': current_chord, 'startTime': chord_start,
+                                   'endTime': frame_idx * frame_time, 'confidence': 0.85})
+                current_chord = best_match
+                chord_start = frame_idx * frame_time
+    if current_chord:
+        chords.append({'chord': current_chord, 'startTime': chord_start,
+                       'endTime': num_frames * frame_time, 'confidence': 0.85})
+    return chords
+
+def synthetic_chroma(seconds: float, seed: int = 0) -> np.ndarray:
+    """Chroma for a progression changing every two seconds, with noise"""
+    rng = np.random.default_rng(seed)
+    num_frames = int(seconds * SR / HOP_LENGTH)
+    frames_per_chord = int(2 * SR / HOP_LENGTH)
+    progression = rng.integers(0, len(CHORD_NAMES), size=num_frames // frames_per_chord + 1)
+    chroma = CHORD_TEMPLATES[np.repeat(progression, frames_per_chord)[:num_frames]].T
+    return chroma + 0.03 * rng.random(chroma.shape)
+
+def timed(func, *args) -> tuple:
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loop-limit", type=float, default=3600,
+                        help="skip the slow reference loop for tracks longer than this many seconds")
+    args = parser.parse_args()
+    
+    print(f"{'duration':>10} {'frames':>8} {'segments':>9} {'loop (s)':>10} {'vectorized (s)':>15} {'speedup':>8}")
+    for seconds in DURATIONS:
+        chroma = synthetic_chroma(seconds)
+        fast, fast_time = timed(recognize_chords, chroma, HOP_LENGTH, SR)
+        
+        if seconds <= args.loop_limit:
+            slow, slow_time = timed(loop_recognize_chords, chroma, HOP_LENGTH, SR)
+            if slow != fast:
+                raise SystemExit(f"Output mismatch for {seconds}s track")
+            loop_column, speedup = f"{slow_time:10.3f}", f"{slow_time / fast_time:7.0f}x"
+        else:
+            loop_column, speedup = f"{'skipped':>10}", f"{'-':>8}"
+        
+        print(f"{seconds:>9}s {chroma.shape[1]:>8} {len(fast):>9} {loop_column} {fast_time:15.4f} {speedup}")
+
+if __name__ == "__main__":
+    main()
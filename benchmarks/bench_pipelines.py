@@ -0,0 +1,479 @@
+"""
+Analysis Pipeline Benchmarks - PhinAccords
+Heavenkeys Ltd
+
+Runs both services' analysis stages and endpoints on deterministic synthetic
+tracks (a chord progression of additive tones with a click on every beat, in
+a known key and tempo) and reports throughput, p50/p95 latency, peak memory
+and accuracy against the known labels. Results are written as JSON and can
+be checked against a stored baseline.
+
+Each service runs in its own process with ANALYSIS_WORKERS=0, so its models,
+stages and endpoints (called in-process through a test client) all run in
+that process and its peak RSS covers them.
+
+Usage:
+    python benchmarks/bench_pipelines.py [--durations 10,60,300,3600] [--repeat 3]
+        [--service all|dechord|python] [--output results.json]
+        [--baseline benchmarks/baseline.json] [--threshold 0.25]
+
+Record a baseline by running once with --output benchmarks/baseline.json; later
+runs given --baseline exit with status 1 when a case got slower or used more
+memory by more than --threshold, or lost more than --accuracy-drop accuracy.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import soundfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVICE_DIRS = {
+    "dechord": os.path.join(ROOT, "dechord-service"),
+    "python": os.path.join(ROOT, "python-service"),
+}
+
+DURATIONS = [10, 60, 300, 3600]
+SYNTH_SAMPLE_RATE = 44100
+BEATS_PER_BAR = 4
+PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+FLATS = {'Db': 'C#', 'Eb': 'D#', 'Gb': 'F#', 'Ab': 'G#', 'Bb': 'A#'}
+# One chord per bar: I-V-vi-IV in major keys, i-VI-III-VII in minor keys
+PROGRESSIONS = {
+    "major": [(0, "maj"), (7, "maj"), (9, "min"), (5, "maj")],
+    "minor": [(0, "min"), (8, "maj"), (3, "maj"), (10, "maj")],
+}
+# Fingerprint benchmark: the near-duplicate upload is cut by up to this much and attenuated
+VARIANT_TRIM_SECONDS = 5.0
+VARIANT_GAIN = 0.7
+# Scoring: chord labels are compared every CHORD_SAMPLE_STEP seconds
+CHORD_SAMPLE_STEP = 0.1
+BEAT_TOLERANCE = 0.07
+TEMPO_TOLERANCE = 0.04
+# How long a service may take to load its models before the run is abandoned
+READY_TIMEOUT_SECONDS = 600
+
+# --- Synthetic tracks -------------------------------------------------------
+
+def track_spec(seconds: float, seed: int) -> dict:
+    """Key, tempo and ground-truth labels of the synthetic track for a duration"""
+    rng = np.random.default_rng(seed)
+    tonic = int(rng.integers(12))
+    mode = str(rng.choice(["major", "minor"]))
+    tempo = float(rng.integers(80, 161))
+    
+    bar = 60.0 / tempo * BEATS_PER_BAR
+    chords = []
+    for i in range(int(np.ceil(seconds / bar))):
+        degree, quality = PROGRESSIONS[mode][i % len(PROGRESSIONS[mode])]
+        root = (tonic + degree) % 12
+        chords.append([i * bar, min((i + 1) * bar, seconds), root, quality])
+    
+    return {
+        "seconds": seconds,
+        "seed": seed,
+        "key": f"{PITCH_CLASSES[tonic]} {mode}",
+        "tempo": tempo,
+        "beats": np.arange(0, seconds, 60.0 / tempo).tolist(),
+        "chords": chords,
+    }
+
+def midi_frequency(note: int) -> float:
+    return 440.0 * 2 ** ((note - 69) / 12.0)
+
+def render_track(path: str, spec: dict) -> None:
+    """Write a track bar by bar, so even hour-long tracks never sit in memory whole"""
+    sr = SYNTH_SAMPLE_RATE
+    total = int(spec["seconds"] * sr)
+    beat_samples = 60.0 / spec["tempo"] * sr
+    # A 30 ms noise burst decaying over 5 ms
+    click_length = int(0.03 * sr)
+    click = np.random.default_rng(spec["seed"]).standard_normal(click_length)
+    click *= np.exp(-np.arange(click_length) / (0.005 * sr))
+    fade = int(0.01 * sr)
+    
+    with soundfile.SoundFile(path, "w", samplerate=sr, channels=1, subtype="PCM_16") as out:
+        for start_time, end_time, root, quality in spec["chords"]:
+            start, stop = int(round(start_time * sr)), min(total, int(round(end_time * sr)))
+            t = np.arange(start, stop) / sr
+            third = 3 if quality == "min" else 4
+            # Bass root plus the triad an octave up, each with three overtones
+            notes = [48 + root, 60 + root, 60 + root + third, 60 + root + 7]
+            bar = sum(
+                0.06 / harmonic * np.sin(2 * np.pi * harmonic * midi_frequency(note) * t)
+                for note in notes for harmonic in range(1, 5)
+            )
+            envelope = np.ones(len(t))
+            envelope[:fade] = np.linspace(0, 1, min(fade, len(t)))
+            envelope[-fade:] = np.linspace(1, 0, min(fade, len(t)))
+            bar *= envelope
+            
+            # Clicks on every beat, louder on the downbeat
+            for number in range(BEATS_PER_BAR):
+                offset = int(round(start + number * beat_samples)) - start
+                if offset >= len(bar):
+                    break
+                burst = click[:len(bar) - offset] * (0.5 if number == 0 else 0.3)
+                bar[offset:offset + len(burst)] += burst
+            
+            out.write(np.clip(bar, -1.0, 1.0).astype(np.float32))
+
+def render_variant(path: str, spec: dict, trim: float, variant_path: str) -> tuple:
+    """
+    Another "rip" of a track: the first trim seconds cut, at a lower level and
+    in another format. Returns (variant_path, spec with the labels re-timed)
+    """
+    with soundfile.SoundFile(path) as source, \
+            soundfile.SoundFile(variant_path, "w", samplerate=source.samplerate, channels=1) as out:
+        source.seek(int(trim * source.samplerate))
+        for block in source.blocks(blocksize=source.samplerate * 60):
+            out.write(VARIANT_GAIN * block)
+    
+    seconds = spec["seconds"] - trim
+    chords = [
+        [max(start - trim, 0.0), end - trim, root, quality]
+        for start, end, root, quality in spec["chords"] if end > trim
+    ]
+    beats = [beat - trim for beat in spec["beats"] if beat >= trim]
+    return variant_path, {**spec, "seconds": seconds, "chords": chords, "beats": beats}
+
+def prepare_tracks(audio_dir: str, durations: list) -> dict:
+    """Render (or reuse) one track per duration; returns {seconds: (path, spec)}"""
+    os.makedirs(audio_dir, exist_ok=True)
+    tracks = {}
+    for seconds in durations:
+        path = os.path.join(audio_dir, f"track-{seconds}s.wav")
+        spec = track_spec(seconds, seed=seconds)
+        if not os.path.exists(path):
+            started = time.perf_counter()
+            render_track(path, spec)
+            print(f"Rendered {seconds}s track ({spec['key']}, {spec['tempo']:.0f} BPM) "
+                  f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        tracks[seconds] = (path, spec)
+    return tracks
+
+# --- Scoring ----------------------------------------------------------------
+
+def parse_chord(label: str):
+    """(pitch class, "maj" or "min") of a label such as C, C#m, Dbm or A:min; None for no chord"""
+    label = label.replace(":maj", "").replace(":min", "m")
+    if not label or label == "N":
+        return None
+    quality = "min" if label.endswith("m") else "maj"
+    root = label[:-1] if quality == "min" else label
+    root = FLATS.get(root, root)
+    return (PITCH_CLASSES.index(root), quality) if root in PITCH_CLASSES else None
+
+def chord_segments(result) -> list:
+    """(start, end, label) segments from either service's chord format"""
+    return [
+        (c["startTime"], c["endTime"], c["chord"]) if isinstance(c, dict) else tuple(c)
+        for c in result
+    ]
+
+def chord_accuracy(result, spec: dict) -> float:
+    """Fraction of sample points whose recognized chord matches the known chord"""
+    times = np.arange(0, spec["seconds"], CHORD_SAMPLE_STEP)
+    truth_starts = np.array([c[0] for c in spec["chords"]])
+    truth = [(c[2], c[3]) for c in spec["chords"]]
+    segments = chord_segments(result)
+    if not segments:
+        return 0.0
+    
+    starts = np.array([s[0] for s in segments])
+    ends = np.array([s[1] for s in segments])
+    labels = [parse_chord(s[2]) for s in segments]
+    predicted = np.searchsorted(starts, times, side="right") - 1
+    expected = np.searchsorted(truth_starts, times, side="right") - 1
+    hits = sum(
+        p >= 0 and t < ends[p] and labels[p] == truth[e]
+        for t, p, e in zip(times, predicted.tolist(), expected.tolist())
+    )
+    return hits / len(times)
+
+def key_accuracy(key: str, spec: dict) -> float:
+    """1.0 when tonic and mode match (a bare tonic counts as major)"""
+    tonic, _, mode = key.partition(" ")
+    truth_tonic, _, truth_mode = spec["key"].partition(" ")
+    if tonic.endswith("m") and not mode:
+        tonic, mode = tonic[:-1], "minor"
+    tonic = FLATS.get(tonic, tonic)
+    return float(tonic == truth_tonic and (mode or "major") == truth_mode)
+
+def tempo_accuracy(tempo: float, spec: dict) -> float:
+    return float(abs(tempo - spec["tempo"]) <= TEMPO_TOLERANCE * spec["tempo"])
+
+def beat_f_measure(beat_times, spec: dict) -> float:
+    """F-measure of detected beats against the known beats, each matched at most once"""
+    detected = np.asarray(beat_times, dtype=float)
+    truth = np.asarray(spec["beats"])
+    if not len(detected) or not len(truth):
+        return 0.0
+    
+    nearest = np.clip(np.searchsorted(truth, detected), 1, len(truth) - 1)
+    nearest = np.where(
+        np.abs(truth[nearest - 1] - detected) <= np.abs(truth[nearest] - detected), nearest - 1, nearest
+    )
+    matched = len(np.unique(nearest[np.abs(truth[nearest] - detected) <= BEAT_TOLERANCE]))
+    if not matched:
+        return 0.0
+    precision, recall = matched / len(detected), matched / len(truth)
+    return 2 * precision * recall / (precision + recall)
+
+# --- Measurement ------------------------------------------------------------
+
+def measure(func, repeat: int, before=None) -> tuple:
+    """Run func repeat times; returns (last result, latencies, peak RSS in bytes)"""
+    import metrics
+    
+    latencies, peak = [], 0
+    result = None
+    for _ in range(repeat):
+        if before:
+            before()
+        metrics.reset_peak_rss()
+        started = time.perf_counter()
+        result = func()
+        latencies.append(time.perf_counter() - started)
+        peak = max(peak, metrics.peak_rss_bytes())
+    return result, latencies, peak
+
+def case_result(seconds: float, latencies: list, peak: int, accuracy: dict) -> dict:
+    p50 = float(np.percentile(latencies, 50))
+    return {
+        "audio_seconds": seconds,
+        "latencies": latencies,
+        "p50_seconds": p50,
+        "p95_seconds": float(np.percentile(latencies, 95)),
+        "realtime_factor": seconds / p50 if p50 else None,
+        "peak_rss_bytes": peak,
+        "accuracy": accuracy,
+    }
+
+def upload(client, endpoint: str, path: str, **data):
+    with open(path, "rb") as f:
+        response = client.post(endpoint, files={"file": (os.path.basename(path), f, "audio/wav")}, data=data)
+    response.raise_for_status()
+    return response.json()
+
+def wait_until_ready(client) -> None:
+    """Wait for /ready: models load in the background once the app has started"""
+    deadline = time.monotonic() + READY_TIMEOUT_SECONDS
+    while client.get("/ready").status_code != 200:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Service not ready after {READY_TIMEOUT_SECONDS}s")
+        time.sleep(0.1)
+
+def bench_dechord(tracks: dict, repeat: int) -> dict:
+    import pipeline
+    import main
+    from fastapi.testclient import TestClient
+    
+    results = {}
+    with TestClient(main.app) as client:
+        wait_until_ready(client)
+        for seconds, (path, spec) in tracks.items():
+            signal = pipeline.decode_audio(path)
+            with pipeline.borrow_processors() as processors:
+                chords, latencies, peak = measure(lambda: pipeline.recognize_chords(signal, processors), repeat)
+                results[f"dechord/recognize_chords/{seconds}s"] = case_result(
+                    seconds, latencies, peak, {"chords": chord_accuracy(chords, spec)})
+                
+                key, latencies, peak = measure(lambda: pipeline.recognize_key(signal, processors), repeat)
+                results[f"dechord/recognize_key/{seconds}s"] = case_result(
+                    seconds, latencies, peak, {"key": key_accuracy(key, spec)})
+                
+                tempo, latencies, peak = measure(lambda: pipeline.detect_tempo(signal, processors), repeat)
+                results[f"dechord/detect_tempo/{seconds}s"] = case_result(
+                    seconds, latencies, peak, {"tempo": tempo_accuracy(tempo, spec)})
+            del signal
+            
+            # Every run must analyse the track, not read it back from the analysis cache
+            response, latencies, peak = measure(
+                lambda: upload(client, "/analyze", path), repeat,
+                before=main.analysis_store.clear
+            )
+            results[f"dechord/POST /analyze/{seconds}s"] = case_result(seconds, latencies, peak, {
+                "chords": chord_accuracy(response["chords"], spec),
+                "key": key_accuracy(response["key"], spec),
+                "tempo": tempo_accuracy(response["tempo"], spec),
+            })
+            
+            # A trimmed, quieter FLAC rip of the track just analysed should reuse its analysis
+            trim = min(VARIANT_TRIM_SECONDS, 0.1 * seconds)
+            variant_path, variant_spec = render_variant(path, spec, trim, "variant.flac")
+            response, latencies, peak = measure(lambda: upload(client, "/analyze", variant_path), repeat)
+            results[f"dechord/POST /analyze fingerprint hit/{seconds}s"] = case_result(
+                variant_spec["seconds"], latencies, peak, {
+                    "fingerprint_hit": float(response.get("match") is not None),
+                    "chords": chord_accuracy(response["chords"], variant_spec),
+                })
+            os.unlink(variant_path)
+    return results
+
+def bench_python(tracks: dict, repeat: int) -> dict:
+    import pipeline
+    import main
+    from fastapi.testclient import TestClient
+    
+    results = {}
+    with TestClient(main.app) as client:
+        wait_until_ready(client)
+        # Without the downbeat network track_beats quietly falls back to librosa
+        if pipeline.downbeat_processor is None:
+            raise RuntimeError("madmom downbeat processor failed to load; beat timings would be librosa's")
+        for seconds, (path, spec) in tracks.items():
+            y, sr = pipeline.decode_audio(path)
+            
+            chroma, latencies, peak = measure(lambda: pipeline.extract_chroma_features(y, sr), repeat)
+            results[f"python/extract_chroma_features/{seconds}s"] = case_result(seconds, latencies, peak, {})
+            
+            chords, latencies, peak = measure(
+                lambda: pipeline.recognize_chords(chroma, pipeline.HOP_LENGTH, sr), repeat)
+            results[f"python/recognize_chords/{seconds}s"] = case_result(
+                seconds, latencies, peak, {"chords": chord_accuracy(chords, spec)})
+            
+            beats, latencies, peak = measure(lambda: pipeline.track_beats(y, sr), repeat)
+            beat_positions, tempo, _ = beats
+            results[f"python/track_beats/{seconds}s"] = case_result(seconds, latencies, peak, {
+                "beats": beat_f_measure([b["time"] for b in beat_positions], spec),
+                "tempo": tempo_accuracy(tempo, spec),
+            })
+            
+            key, latencies, peak = measure(lambda: pipeline.estimate_key(pipeline.SpectralFeatures(y, sr)), repeat)
+            results[f"python/estimate_key/{seconds}s"] = case_result(
+                seconds, latencies, peak, {"key": key_accuracy(key, spec)})
+            del y, chroma
+            
+            for segmentation in ("frame", "beat"):
+                response, latencies, peak = measure(
+                    lambda: upload(client, "/extract-chords", path, segmentation=segmentation), repeat)
+                results[f"python/POST /extract-chords?segmentation={segmentation}/{seconds}s"] = case_result(
+                    seconds, latencies, peak, {
+                        "chords": chord_accuracy(response["chords"], spec),
+                        "beats": beat_f_measure([b["time"] for b in response["beats"]], spec),
+                        "key": key_accuracy(response["key"], spec),
+                        "tempo": tempo_accuracy(response["tempo"], spec),
+                    })
+    return results
+
+BENCHMARKS = {"dechord": bench_dechord, "python": bench_python}
+
+def run_service(service: str, tracks: dict, repeat: int) -> dict:
+    """Benchmark one service inside this process, with its state kept in a scratch directory"""
+    work_dir = tempfile.mkdtemp(prefix=f"bench-{service}-")
+    os.environ.update({
+        "ANALYSIS_WORKERS": "0",
+        "DECHORD_CACHE_DIR": os.path.join(work_dir, "cache"),
+        "YOUTUBE_CACHE_DIR": os.path.join(work_dir, "youtube"),
+        "JOBS_DIR": os.path.join(work_dir, "jobs"),
+    })
+    sys.path.insert(0, SERVICE_DIRS[service])
+    os.chdir(work_dir)
+    try:
+        return BENCHMARKS[service](tracks, repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+# --- Reporting --------------------------------------------------------------
+
+def environment() -> dict:
+    versions = {"python": platform.python_version(), "numpy": np.__version__}
+    for module in ("librosa", "madmom", "soundfile"):
+        try:
+            versions[module] = getattr(__import__(module), "__version__", "unknown")
+        except ImportError:
+            versions[module] = None
+    return {"platform": platform.platform(), "cpus": os.cpu_count(), "versions": versions,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+def print_table(results: dict) -> None:
+    print(f"{'case':<58} {'p50 (s)':>9} {'p95 (s)':>9} {'x realtime':>11} {'peak MB':>8}  accuracy")
+    for name, case in results.items():
+        accuracy = " ".join(f"{metric}={value:.2f}" for metric, value in case["accuracy"].items())
+        realtime = f"{case['realtime_factor']:11.1f}" if case["realtime_factor"] else f"{'-':>11}"
+        print(f"{name:<58} {case['p50_seconds']:9.3f} {case['p95_seconds']:9.3f} {realtime} "
+              f"{case['peak_rss_bytes'] / 1e6:8.0f}  {accuracy}")
+
+def compare(results: dict, baseline: dict, threshold: float, accuracy_drop: float) -> list:
+    """Regressions of results against a baseline, as readable lines"""
+    regressions = []
+    for name, case in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        if case["p50_seconds"] > base["p50_seconds"] * (1 + threshold):
+            regressions.append(f"{name}: p50 {case['p50_seconds']:.3f}s vs baseline {base['p50_seconds']:.3f}s")
+        if case["peak_rss_bytes"] > base["peak_rss_bytes"] * (1 + threshold):
+            regressions.append(f"{name}: peak RSS {case['peak_rss_bytes'] / 1e6:.0f} MB "
+                               f"vs baseline {base['peak_rss_bytes'] / 1e6:.0f} MB")
+        for metric, value in case["accuracy"].items():
+            if metric in base["accuracy"] and value < base["accuracy"][metric] - accuracy_drop:
+                regressions.append(f"{name}: {metric} accuracy {value:.2f} vs baseline {base['accuracy'][metric]:.2f}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", default=",".join(map(str, DURATIONS)),
+                        help="comma-separated track lengths in seconds")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case")
+    parser.add_argument("--service", choices=["all", *SERVICE_DIRS], default="all")
+    parser.add_argument("--audio-dir", help="where to render and reuse the synthetic tracks")
+    parser.add_argument("--output", default="bench_results.json", help="results file to write")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed relative increase of p50 latency and peak RSS")
+    parser.add_argument("--accuracy-drop", type=float, default=0.02, help="allowed absolute accuracy loss")
+    parser.add_argument("--part", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    durations = [int(d) for d in args.durations.split(",")]
+    audio_dir = os.path.abspath(args.audio_dir or os.path.join(tempfile.gettempdir(), "phinaccords-bench-audio"))
+    output = os.path.abspath(args.output)
+    tracks = prepare_tracks(audio_dir, durations)
+    
+    if args.service != "all":
+        results = run_service(args.service, tracks, args.repeat)
+    else:
+        # One process per service: both have modules named main and pipeline, and
+        # each process's peak RSS must only cover its own service
+        results = {}
+        for service in SERVICE_DIRS:
+            part = f"{output}.{service}.part"
+            subprocess.run([
+                sys.executable, os.path.abspath(__file__), "--service", service, "--part",
+                "--durations", args.durations, "--repeat", str(args.repeat),
+                "--audio-dir", audio_dir, "--output", part,
+            ], check=True)
+            with open(part) as f:
+                results.update(json.load(f)["results"])
+            os.unlink(part)
+    
+    report = {"environment": environment(), "durations": durations, "repeat": args.repeat, "results": results}
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.part:
+        return
+    
+    print_table(results)
+    print(f"\nWrote {output}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.accuracy_drop)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Admission Control - PhinAccords
+Heavenkeys Ltd
+
+Bounds the analysis requests a service works on at once. Up to max_active
+run, up to max_queued more wait their turn in arrival order, and the rest
+are turned away at once with 429 and a Retry-After estimated from how long
+recent requests took, before their upload is read. Optionally no client may
+hold more than max_per_client of the running and waiting places, so one
+client's burst cannot starve the others.
+"""
+
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Iterable, Optional
+from starlette.responses import JSONResponse
+
+import metrics
+
+# Weight of the newest request time in the moving average
+SERVICE_TIME_SMOOTHING = 0.2
+# Assumed request time until one has been measured
+DEFAULT_SERVICE_SECONDS = 30.0
+MAX_RETRY_AFTER_SECONDS = 600
+
+REJECTIONS = metrics.REGISTRY.add(metrics.Counter(
+    "admission_rejections_total", "Analysis requests rejected with 429, by reason"))
+QUEUE_WAIT = metrics.REGISTRY.add(metrics.Histogram(
+    "admission_queue_wait_seconds", "Time admitted analysis requests waited for a place", metrics.DURATION_BUCKETS))
+
+class Rejected(Exception):
+    """No place for the request; retry_after is the suggested wait in seconds"""
+    
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason, self.retry_after = reason, retry_after
+
+class AdmissionController:
+    def __init__(self, max_active: int, max_queued: int, max_per_client: int = 0):
+        self.max_active, self.max_queued, self.max_per_client = max_active, max_queued, max_per_client
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        # Running and waiting requests by client
+        self.clients: Dict[str, int] = {}
+        # Moving average of admitted requests' handling time
+        self.service_seconds: Optional[float] = None
+    
+    @property
+    def queued(self) -> int:
+        return len(self.waiters)
+    
+    def estimated_service_seconds(self) -> float:
+        return self.service_seconds if self.service_seconds is not None else DEFAULT_SERVICE_SECONDS
+    
+    def retry_after(self, ahead: int) -> int:
+        """Seconds until ahead more requests are likely to have finished, spread over the places"""
+        seconds = ahead * self.estimated_service_seconds() / max(self.max_active, 1)
+        return min(MAX_RETRY_AFTER_SECONDS, max(1, math.ceil(seconds)))
+    
+    def _check(self, client: str) -> None:
+        if self.max_per_client and self.clients.get(client, 0) >= self.max_per_client:
+            # A place frees up for this client once its oldest request finishes
+            raise Rejected("client_limit", self.retry_after(self.max_active))
+        if self.active >= self.max_active and self.queued >= self.max_queued:
+            raise Rejected("queue_full", self.retry_after(self.queued + 1))
+    
+    def _release(self) -> None:
+        # Hand the place straight to the longest waiting request still there
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+    
+    def _observe(self, seconds: float) -> None:
+        if self.service_seconds is None:
+            self.service_seconds = seconds
+        else:
+            self.service_seconds += SERVICE_TIME_SMOOTHING * (seconds - self.service_seconds)
+    
+    @asynccontextmanager
+    async def admit(self, client: str):
+        """
+        Hold a place for the duration of the block, waiting for one if the
+        queue has room; raises Rejected when it does not
+        """
+        try:
+            self._check(client)
+        except Rejected as e:
+            REJECTIONS.inc(reason=e.reason)
+            raise
+        
+        self.clients[client] = self.clients.get(client, 0) + 1
+        try:
+            if self.active < self.max_active and not self.waiters:
+                self.active += 1
+            else:
+                waiter = asyncio.get_running_loop().create_future()
+                self.waiters.append(waiter)
+                queued_at = time.perf_counter()
+                try:
+                    await waiter
+                except asyncio.CancelledError:
+                    if waiter.done() and not waiter.cancelled():
+                        # Handed a place just as the request went away
+                        self._release()
+                    else:
+                        self.waiters.remove(waiter)
+                    raise
+                QUEUE_WAIT.observe(time.perf_counter() - queued_at)
+            
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                self._observe(time.perf_counter() - started)
+                self._release()
+        finally:
+            self.clients[client] -= 1
+            if not self.clients[client]:
+                del self.clients[client]
+
+def client_id(scope) -> str:
+    """The requesting client: the first X-Forwarded-For address behind a proxy, else the peer address"""
+    forwarded = dict(scope["headers"]).get(b"x-forwarded-for")
+    if forwarded:
+        return forwarded.split(b",")[0].strip().decode("latin-1")
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+class AdmissionMiddleware:
+    """ASGI middleware passing POST requests to paths through an AdmissionController"""
+    
+    def __init__(self, app, controller: AdmissionController, paths: Iterable[str]):
+        self.app, self.controller, self.paths = app, controller, frozenset(paths)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        
+        try:
+            async with self.controller.admit(client_id(scope)):
+                await self.app(scope, receive, send)
+        except Rejected as e:
+            detail = "Too many requests from this client" if e.reason == "client_limit" else "Analysis queue is full"
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": f"{detail}, retry in {e.retry_after}s"},
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
@@ -0,0 +1,256 @@
+"""
+Audio Fingerprint Index - PhinAccords
+Heavenkeys Ltd
+
+Chroma fingerprints for spotting the same recording in a different rip,
+bitrate or trim. Each analysed track stores a coarse chroma sequence plus
+landmarks (pairs of consecutive chord-like chroma codes and the time
+between them) in SQLite. A query, made from the first seconds of an upload,
+votes for (track, time offset) pairs through its landmarks; the best
+candidate is accepted when its chroma agrees at that offset.
+"""
+
+import os
+import math
+import time
+import sqlite3
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Sequence, Tuple
+import numpy as np
+from loguru import logger
+
+from lazy_imports import lazy_import
+
+ndimage = lazy_import("scipy.ndimage")
+
+# Chroma frame rate of fingerprints (see pipeline.fingerprint_chroma)
+FINGERPRINT_FPS = 10
+# Seconds decoded from an upload to look it up (0 disables lookups)
+FINGERPRINT_QUERY_SECONDS = float(os.getenv("FINGERPRINT_QUERY_SECONDS", "30"))
+# Excerpts this long from the middle and end of an upload must match too, so a
+# recording that only shares its opening with a stored track is not taken for it
+FINGERPRINT_PROBE_SECONDS = float(os.getenv("FINGERPRINT_PROBE_SECONDS", "10"))
+# Mean chroma cosine similarity needed to reuse a matched track's analysis
+FINGERPRINT_THRESHOLD = float(os.getenv("FINGERPRINT_THRESHOLD", "0.9"))
+FINGERPRINT_MAX_TRACKS = int(os.getenv("FINGERPRINT_MAX_TRACKS", "50000"))
+# Landmark votes the best offset needs before its chroma is compared
+MIN_VOTES = 5
+# Each chroma change is paired with this many following changes within MAX_PAIR_FRAMES
+FAN_OUT = 3
+MAX_PAIR_FRAMES = 10 * FINGERPRINT_FPS
+# A match may start this much before the stored track, or run this much past its end
+COVERAGE_TOLERANCE_SECONDS = 2.0
+NUM_CODES = 12 * 12
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    chroma BLOB NOT NULL,
+    duration REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS landmarks (
+    hash INTEGER NOT NULL,
+    track_id INTEGER NOT NULL,
+    frame INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS landmarks_hash ON landmarks (hash);
+CREATE INDEX IF NOT EXISTS landmarks_track ON landmarks (track_id);
+CREATE INDEX IF NOT EXISTS fingerprints_accessed_at ON fingerprints (accessed_at);
+"""
+
+def chroma_codes(chroma: np.ndarray) -> np.ndarray:
+    """
+    One code per frame from its two strongest pitch classes (in order), after
+    smoothing over a second so codes follow chords rather than single notes;
+    -1 for silent frames
+    """
+    smoothed = ndimage.uniform_filter1d(chroma.astype(np.float32), FINGERPRINT_FPS, axis=1)
+    strongest = np.argsort(smoothed, axis=0)[::-1][:2]
+    codes = strongest[0] * 12 + strongest[1]
+    codes[~chroma.any(axis=0)] = -1
+    return codes
+
+def landmarks(chroma: np.ndarray) -> List[tuple]:
+    """(hash, frame) pairs: every code change paired with the next FAN_OUT changes"""
+    codes = chroma_codes(chroma)
+    changes = np.flatnonzero(np.diff(codes, prepend=-2) != 0)
+    changes = changes[codes[changes] >= 0]
+    
+    pairs = []
+    for i, first in enumerate(changes.tolist()):
+        for second in changes[i + 1:i + 1 + FAN_OUT].tolist():
+            gap = second - first
+            if gap > MAX_PAIR_FRAMES:
+                break
+            pairs.append(((int(codes[first]) * NUM_CODES + int(codes[second])) * (MAX_PAIR_FRAMES + 1) + gap, first))
+    return pairs
+
+def chroma_similarity(query: np.ndarray, reference: np.ndarray, offset: int) -> float:
+    """Mean cosine similarity of unit-norm chroma frames where query frame 0 sits at reference frame offset"""
+    start = max(0, -offset)
+    stop = min(query.shape[1], reference.shape[1] - offset)
+    if stop - start < MIN_VOTES:
+        return 0.0
+    q = query[:, start:stop].astype(np.float32)
+    r = reference[:, start + offset:stop + offset].astype(np.float32)
+    voiced = q.any(axis=0) & r.any(axis=0)
+    if not voiced.any():
+        return 0.0
+    return float(np.mean(np.sum(q[:, voiced] * r[:, voiced], axis=0)))
+
+def probe_starts(duration: float) -> List[float]:
+    """
+    Start times of the middle and end excerpts checked besides an upload's
+    opening, on the frame grid; none for uploads the opening already covers
+    """
+    if not FINGERPRINT_PROBE_SECONDS or duration <= FINGERPRINT_QUERY_SECONDS:
+        return []
+    starts = ((duration - FINGERPRINT_PROBE_SECONDS) / 2, duration - FINGERPRINT_PROBE_SECONDS)
+    return [
+        math.floor(start * FINGERPRINT_FPS) / FINGERPRINT_FPS
+        for start in starts if start + FINGERPRINT_PROBE_SECONDS > FINGERPRINT_QUERY_SECONDS
+    ]
+
+def shift_record(record: Dict[str, Any], offset: float, duration: float) -> Dict[str, Any]:
+    """A stored analysis re-timed for a recording that starts offset seconds into it and lasts duration"""
+    chords = []
+    for start, end, label in record["chords"]:
+        start, end = start - offset, end - offset
+        if end <= 0 or start >= duration:
+            continue
+        chords.append([round(max(start, 0.0), 3), round(min(end, duration), 3), label])
+    return {
+        "chords": chords,
+        "key": record["key"],
+        "tempo": record["tempo"],
+        "duration": duration,
+        "title": record.get("title"),
+    }
+
+class FingerprintIndex:
+    """Fingerprints of analysed tracks by analysis cache key"""
+    
+    def __init__(self, db_path: str, max_tracks: int = FINGERPRINT_MAX_TRACKS):
+        self.db_path = db_path
+        self.max_tracks = max_tracks
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+    
+    @contextmanager
+    def _connect(self):
+        """Connection that commits on success and is always closed"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def add(self, key: str, chroma: np.ndarray, duration: float) -> None:
+        """Index the fingerprint of the track whose analysis is cached under key"""
+        pairs = landmarks(chroma)
+        now = time.time()
+        with self._connect() as conn:
+            self._delete(conn, "key = ?", (key,))
+            track_id = conn.execute(
+                "INSERT INTO fingerprints (key, chroma, duration, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, chroma.astype(np.float16).tobytes(), duration, now)
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO landmarks (hash, track_id, frame) VALUES (?, ?, ?)",
+                [(landmark_hash, track_id, frame) for landmark_hash, frame in pairs]
+            )
+            
+            count = conn.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+            if self.max_tracks and count > self.max_tracks:
+                self._delete(
+                    conn, "id IN (SELECT id FROM fingerprints ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_tracks,)
+                )
+    
+    def remove(self, key: str) -> None:
+        with self._connect() as conn:
+            self._delete(conn, "key = ?", (key,))
+    
+    def _delete(self, conn, where: str, params: tuple) -> None:
+        ids = [row[0] for row in conn.execute(f"SELECT id FROM fingerprints WHERE {where}", params)]
+        if ids:
+            conn.executemany("DELETE FROM landmarks WHERE track_id = ?", [(i,) for i in ids])
+            conn.executemany("DELETE FROM fingerprints WHERE id = ?", [(i,) for i in ids])
+    
+    def match(self, chroma: np.ndarray, duration: Optional[float],
+              probes: Sequence[Tuple[float, np.ndarray]] = ()) -> Optional[Dict[str, Any]]:
+        """
+        Best indexed track containing the queried recording, given chroma of its
+        first seconds, its full duration and (start, chroma) excerpts from later
+        in it (see probe_starts), which must each match at the same offset
+        Returns {"key", "offset", "similarity"} (offset in seconds into the stored
+        track where the recording starts; similarity of the worst-matching part)
+        or None
+        """
+        pairs = landmarks(chroma)
+        if not pairs or duration is None:
+            return None
+        
+        query_frames: Dict[int, List[int]] = {}
+        for landmark_hash, frame in pairs:
+            query_frames.setdefault(landmark_hash, []).append(frame)
+        
+        votes = Counter()
+        with self._connect() as conn:
+            hashes = list(query_frames)
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT hash, track_id, frame FROM landmarks WHERE hash IN ({','.join('?' * len(batch))})", batch
+                )
+                for landmark_hash, track_id, frame in rows:
+                    for query_frame in query_frames[landmark_hash]:
+                        votes[(track_id, frame - query_frame)] += 1
+            if not votes:
+                return None
+            
+            # Neighbouring offsets also count, since frames of two rips rarely line up exactly
+            scores = Counter({
+                (track_id, offset): sum(votes.get((track_id, offset + d), 0) for d in (-1, 0, 1))
+                for track_id, offset in votes
+            })
+            best = None
+            for (track_id, offset), score in scores.most_common(3):
+                if score < MIN_VOTES:
+                    break
+                row = conn.execute(
+                    "SELECT key, chroma, duration FROM fingerprints WHERE id = ?", (track_id,)
+                ).fetchone()
+                if row is None:
+                    continue
+                key, reference, reference_duration = row
+                reference = np.frombuffer(reference, dtype=np.float16).reshape(12, -1)
+                
+                offset_seconds = round(offset / FINGERPRINT_FPS, 3)
+                # The stored analysis must cover the whole recording
+                if offset_seconds < -COVERAGE_TOLERANCE_SECONDS:
+                    continue
+                if offset_seconds + duration > reference_duration + COVERAGE_TOLERANCE_SECONDS:
+                    continue
+                
+                similarity = chroma_similarity(chroma, reference, offset)
+                for start, probe in probes:
+                    if similarity < FINGERPRINT_THRESHOLD:
+                        break
+                    probe_offset = offset + int(round(start * FINGERPRINT_FPS))
+                    similarity = min(similarity, chroma_similarity(probe, reference, probe_offset))
+                if similarity >= FINGERPRINT_THRESHOLD and (best is None or similarity > best["similarity"]):
+                    best = {"key": key, "offset": offset_seconds, "similarity": similarity, "track_id": track_id}
+            
+            if best is None:
+                return None
+            conn.execute("UPDATE fingerprints SET accessed_at = ? WHERE id = ?", (time.time(), best.pop("track_id")))
+        
+        logger.info(f"Fingerprint match: {best['key']} at {best['offset']:.1f}s (similarity {best['similarity']:.3f})")
+        return best
@@ -6,32 +6,60 @@ Web API version of DeChord for real-time chord and key recognition
 Based on: https://github.com/chinmaykrishnroy/DeChord
 """
 
+import time
+# Boot timing starts before the imports below; see warm_up()
+BOOT_STARTED = time.perf_counter()
+
 import os
+import json
+import uuid
+import shutil
+import asyncio
 import hashlib
+import sqlite3
 import tempfile
 import logging
+import multiprocessing
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Optional, List, Dict, Any
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import madmom
-import librosa
-import numpy as np
 from loguru import logger
-import yt_dlp
-import subprocess
+
+import admission
+import chord_views
+import fingerprint
+import metrics
+import pipeline
+import result_store
+import singleflight
+import youtube_cache
+
+IMPORT_SECONDS = time.perf_counter() - BOOT_STARTED
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 os.makedirs("logs", exist_ok=True)
 logger.add("logs/dechord_service.log", rotation="500 MB")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup_event()
+    yield
+    await shutdown_event()
+
 app = FastAPI(
     title="DeChord Web API - PhinAccords",
     description="Real-time chord and key recognition from audio files",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -40,13 +68,67 @@ ALLOWED_ORIGINS = os.getenv(
     "https://phin-accords-kzhmbuv20-jackmichaels-projects.vercel.app,http://localhost:3000"
 ).split(",")
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=ALLOWED_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Analysis cache: one combined record per track, keyed by audio content
+CACHE_DIR = os.getenv("DECHORD_CACHE_DIR", "cache")
+analysis_store = result_store.ResultStore(os.path.join(CACHE_DIR, "results.db"))
+# Fingerprints of analysed tracks, so other rips and trims of them reuse their analysis
+fingerprint_index = fingerprint.FingerprintIndex(os.path.join(CACHE_DIR, "fingerprints.db"))
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Analysis worker processes (0 runs analyses in this process's thread pool instead;
+# stages then only overlap if PROCESSOR_POOL_SIZE allows more than one borrower)
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(os.cpu_count() or 1)))
+# Upper bound on a single chord, key or tempo stage
+STAGE_TIMEOUT_SECONDS = float(os.getenv("STAGE_TIMEOUT_SECONDS", "300"))
+# Largest number of files + URLs accepted by /analyze-batch
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "50"))
+# Upload limits (0 disables): bytes per uploaded file and seconds of audio
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "3600"))
+
+def max_body_bytes(path: str) -> int:
+    """Largest request body accepted for a path (0 means unlimited)"""
+    if path == "/analyze-batch":
+        return MAX_UPLOAD_BYTES * MAX_BATCH_ITEMS
+    return MAX_UPLOAD_BYTES
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject request bodies over the upload limit while they are still arriving,
+    before the multipart parser has spooled all of them to disk
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        limit = max_body_bytes(scope["path"]) if scope["type"] == "http" else 0
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+        
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse(status_code=413, content={"detail": f"Upload exceeds {limit} bytes"})
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside body parsing, so FastAPI turns it into the response
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {limit} bytes")
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(UploadSizeLimitMiddleware)
+app.add_middleware(metrics.RequestsInFlightMiddleware)
 
 # Models
 class ChordSegment(BaseModel):
@@ -54,217 +136,803 @@ class ChordSegment(BaseModel):
     endTime: float
     chord: str
 
+class AnalysisMatch(BaseModel):
+    type: str = "fingerprint"
+    offset: float
+    similarity: float
+
 class AnalysisResult(BaseModel):
     chords: List[ChordSegment]
     key: str
     tempo: float
     duration: float
     title: Optional[str] = None
+    match: Optional[AnalysisMatch] = None
+    # "preview" results are replaced by a full analysis; poll /analyses/{analysisId}
+    quality: str = "full"
+    # Also names the analysis for derived views: /analyses/{analysisId}/chart
+    analysisId: Optional[str] = None
+
+class AnalysisStatus(BaseModel):
+    analysisId: str
+    # "pending" (result is the preview), "completed" or "failed"
+    status: str
+    result: Optional[AnalysisResult] = None
+    error: Optional[str] = None
+
+class ChordChart(BaseModel):
+    analysisId: str
+    key: str
+    transpose: int
+    capo: int
+    simplify: str
+    quantize: str
+    chords: List[ChordSegment]
+
+class BatchItemResult(BaseModel):
+    source: str
+    status: str
+    result: Optional[AnalysisResult] = None
+    error: Optional[str] = None
 
-def format_chord_label(chord_label: str) -> str:
-    """Format chord label (remove :maj, replace :min with m)"""
-    if ":maj" in chord_label:
-        return chord_label.replace(":maj", "")
-    elif ":min" in chord_label:
-        return chord_label.replace(":min", "m")
-    return chord_label
+class BatchAnalysisResult(BaseModel):
+    items: List[BatchItemResult]
 
-def adjust_tempo(tempo: float) -> float:
-    """Adjust tempo to reasonable range (matching DeChord logic)"""
-    while tempo < 70:
-        tempo *= 2
-    while tempo > 190:
-        tempo /= 2
-    return tempo
+# Fork the workers from a server process that has loaded and warmed the models
+# once, so they share them copy-on-write (0 spawns workers that each load their own)
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "1") != "0"
 
-def recognize_chords(audio_path: str) -> List[tuple]:
+# Process pool for CPU-bound analysis
+executor: Optional[ProcessPoolExecutor] = None
+# Calls submitted to the pool (or thread pool) that have not finished yet
+pool_tasks = 0
+# Set once the pool is up (or the models are loaded here); calls wait for it
+pool_started = asyncio.Event()
+# Whether the workers have loaded and warmed their models, for /ready
+ready = False
+warm_up_task: Optional[asyncio.Task] = None
+
+def start_executor() -> list:
+    """
+    Start the analysis workers; returns one future per worker that resolves to
+    its pid and memory once its models are loaded
+    With PRELOAD_MODELS the first start blocks until the fork server has loaded them
+    """
+    global executor
+    
+    if PRELOAD_MODELS and "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # Imported by the fork server before it forks any worker
+        context.set_forkserver_preload(["worker_preload"])
+    else:
+        context = multiprocessing.get_context("spawn")
+    
+    pool = ProcessPoolExecutor(
+        max_workers=ANALYSIS_WORKERS,
+        mp_context=context,
+        initializer=pipeline.init_worker,
+    )
+    # Workers are started on demand; submitting one task per worker brings them all up
+    boots = [pool.submit(pipeline.worker_status) for _ in range(ANALYSIS_WORKERS)]
+    executor = pool
+    logger.info(f"Started {ANALYSIS_WORKERS} analysis worker(s) ({context.get_start_method()})")
+    return boots
+
+async def warm_up() -> None:
     """
-    Recognize chords from audio file using madmom
-    Returns list of (start_time, end_time, chord_label) tuples
+    Bring up the analysis workers (or load the models in this process without
+    any), then log each one's memory and the time since boot, and report ready
     """
+    global ready
+    
     try:
-        cache_dir = "cache/chord/"
-        os.makedirs(cache_dir, exist_ok=True)
-        
-        # Create cache key from file path
-        hash_object = hashlib.md5(audio_path.encode())
-        hashed_filename = hash_object.hexdigest() + ".txt"
-        cache_file = os.path.join(cache_dir, hashed_filename)
-        
-        # Check cache
-        if os.path.exists(cache_file):
-            logger.info(f"Loading chords from cache: {cache_file}")
-            chords = []
-            with open(cache_file, "r") as f:
-                for line in f:
-                    parts = line.strip().split(",")
-                    if len(parts) == 3:
-                        start, end, label = parts
-                        chords.append((float(start), float(end), label))
-            return chords
-        
-        # Process audio
-        logger.info(f"Processing chords for: {audio_path}")
-        feat_processor = madmom.features.chords.CNNChordFeatureProcessor()
-        recog_processor = madmom.features.chords.CRFChordRecognitionProcessor()
-        
-        feats = feat_processor(audio_path)
-        chords = recog_processor(feats)
-        
-        # Format and cache results
-        formatted_chords = []
-        with open(cache_file, "w") as f:
-            for chord in chords:
-                start_time, end_time, chord_label = chord
-                formatted_label = format_chord_label(chord_label)
-                formatted_chords.append((start_time, end_time, formatted_label))
-                f.write(f"{start_time},{end_time},{formatted_label}\n")
-        
-        logger.info(f"Recognized {len(formatted_chords)} chords")
-        return formatted_chords
-        
+        if ANALYSIS_WORKERS <= 0:
+            await run_in_threadpool(pipeline.load_models)
+            statuses = [pipeline.worker_status()]
+        else:
+            boots = await run_in_threadpool(start_executor)
+            pool_started.set()
+            statuses = await asyncio.gather(*(asyncio.wrap_future(boot) for boot in boots))
     except Exception as e:
-        logger.error(f"Error recognizing chords: {e}")
-        raise HTTPException(status_code=500, detail=f"Chord recognition failed: {str(e)}")
+        logger.error(f"Warm-up failed: {e}")
+        return
+    finally:
+        pool_started.set()
+    
+    # One boot task per worker is not guaranteed to reach every worker; log those that answered
+    for status in {status["pid"]: status for status in statuses}.values():
+        logger.info(
+            f"Worker {status['pid']}: RSS {status['rss'] / 2**20:.0f} MB"
+            + (f", PSS {status['pss'] / 2**20:.0f} MB, private {status['private'] / 2**20:.0f} MB" if "pss" in status else "")
+        )
+    ready = True
+    logger.info(f"Ready {time.perf_counter() - BOOT_STARTED:.2f}s after boot")
 
-def recognize_key(audio_path: str) -> str:
+async def run_in_pool(func, *args):
     """
-    Recognize musical key from audio file using madmom
-    Returns key as string (e.g., "C major", "A minor")
+    Run a CPU-bound function in the analysis pool and await its result
+    Stage metrics recorded by the worker come back with the result
     """
+    global executor, pool_tasks
+    
+    pool_tasks += 1
     try:
-        cache_dir = "cache/key/"
-        os.makedirs(cache_dir, exist_ok=True)
-        
-        # Create cache key
-        hash_object = hashlib.md5(audio_path.encode())
-        hashed_filename = hash_object.hexdigest() + ".txt"
-        cache_file = os.path.join(cache_dir, hashed_filename)
-        
-        # Check cache
-        if os.path.exists(cache_file):
-            logger.info(f"Loading key from cache: {cache_file}")
-            with open(cache_file, "r") as f:
-                return f.read().strip()
-        
-        # Process audio
-        logger.info(f"Processing key for: {audio_path}")
-        key_processor = madmom.features.key.CNNKeyRecognitionProcessor()
-        key_prediction = key_processor(audio_path)
-        key = madmom.features.key.key_prediction_to_label(key_prediction)
-        
-        # Cache result
-        with open(cache_file, "w") as f:
-            f.write(key)
+        # Until the workers are up, calls queue here rather than run in this process
+        await pool_started.wait()
+        if executor is None:
+            result, observations = await run_in_threadpool(metrics.collect_call, func, *args)
+        else:
+            pool = executor
+            loop = asyncio.get_running_loop()
+            try:
+                result, observations = await loop.run_in_executor(pool, metrics.collect_call, func, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM); replace the pool once so later requests still run
+                if executor is pool:
+                    logger.error("Analysis worker pool broke, restarting it")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    # The fork server is already up, so this does not wait on the models
+                    start_executor()
+                raise
+    finally:
+        pool_tasks -= 1
+    
+    metrics.replay(observations)
+    return result
+
+def pool_capacity() -> int:
+    return ANALYSIS_WORKERS if ANALYSIS_WORKERS > 0 else pipeline.PROCESSOR_POOL_SIZE
+
+metrics.add_gauge(
+    "analysis_tasks_running", "Pool calls currently executing",
+    lambda: min(pool_tasks, pool_capacity())
+)
+metrics.add_gauge(
+    "analysis_tasks_queued", "Pool calls waiting for a free worker",
+    lambda: max(0, pool_tasks - pool_capacity())
+)
+metrics.add_gauge(
+    "coalesced_requests_waiting", "Requests waiting on a shared in-flight analysis",
+    lambda: sum(analysis_flights.waiter_counts().values())
+)
+
+# Admission control for the analysis endpoints: requests handled at once (0
+# disables), requests waiting for a place beyond those, and places any one
+# client may hold (0 for no per-client limit)
+MAX_ACTIVE_ANALYSES = int(os.getenv("MAX_ACTIVE_ANALYSES", str(max(ANALYSIS_WORKERS, 1))))
+MAX_QUEUED_ANALYSES = int(os.getenv("MAX_QUEUED_ANALYSES", str(4 * max(ANALYSIS_WORKERS, 1))))
+MAX_ANALYSES_PER_CLIENT = int(os.getenv("MAX_ANALYSES_PER_CLIENT", "0"))
+ADMITTED_PATHS = ("/analyze", "/analyze-youtube", "/analyze-batch", "/chords", "/key", "/tempo")
+
+admission_control = admission.AdmissionController(MAX_ACTIVE_ANALYSES, MAX_QUEUED_ANALYSES, MAX_ANALYSES_PER_CLIENT)
+if MAX_ACTIVE_ANALYSES > 0:
+    app.add_middleware(admission.AdmissionMiddleware, controller=admission_control, paths=ADMITTED_PATHS)
+
+# Added after the other middleware so it is outermost (Starlette wraps each new
+# middleware around the ones before it) and their error responses, such as 413
+# and 429, carry CORS headers; Retry-After is exposed so clients can back off
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=ALLOWED_ORIGINS,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["Retry-After"],
+)
+
+metrics.add_gauge(
+    "admission_requests_active", "Analysis requests holding a place",
+    lambda: admission_control.active
+)
+metrics.add_gauge(
+    "admission_requests_queued", "Analysis requests waiting for a place",
+    lambda: admission_control.queued
+)
+metrics.add_gauge(
+    "admission_service_seconds", "Moving average of an admitted analysis request's handling time",
+    admission_control.estimated_service_seconds
+)
+
+async def startup_event():
+    global warm_up_task
+    
+    logger.info(f"Imported in {IMPORT_SECONDS:.2f}s")
+    # Models load in the background: /health answers at once, /ready once they are warm
+    warm_up_task = asyncio.create_task(warm_up())
+    # Records cached as files by earlier versions move into the result store
+    await run_in_threadpool(result_store.migrate_file_caches, CACHE_DIR, analysis_store)
+
+async def shutdown_event():
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+@metrics.timed("hash")
+def hash_audio_file(audio_path: str) -> str:
+    """Content hash of an audio file, read in fixed-size chunks"""
+    digest = hashlib.sha256()
+    with open(audio_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return f"sha256-{digest.hexdigest()}"
+
+def load_cached_analysis(cache_key: str) -> Optional[Dict[str, Any]]:
+    """Return the cached analysis record for a track, or None on a miss"""
+    try:
+        record = analysis_store.get(cache_key)
+    except sqlite3.Error as e:
+        logger.warning(f"Ignoring unreadable cache entry {cache_key}: {e}")
+        record = None
+    
+    metrics.count_cache("analysis", hit=record is not None)
+    if record is None:
+        return None
+    logger.info(f"Loaded analysis from cache: {cache_key}")
+    return record
+
+def save_cached_analysis(cache_key: str, record: Dict[str, Any]) -> None:
+    """Store the combined analysis record for a track"""
+    analysis_store.put(cache_key, record)
+
+async def run_stage_with_timeout(stage: str, handle: Dict[str, Any]) -> tuple:
+    """
+    Run one stage in the worker pool, giving up after STAGE_TIMEOUT_SECONDS.
+    A stage that times out keeps its worker busy until it finishes, but the
+    request no longer waits for it.
+    """
+    return await asyncio.wait_for(run_in_pool(pipeline.run_stage, stage, handle), STAGE_TIMEOUT_SECONDS)
+
+async def timed_pool_call(func, *args) -> tuple:
+    """run_in_pool() with the stage timeout; returns (result, elapsed_seconds) like run_stage"""
+    started = time.perf_counter()
+    result = await asyncio.wait_for(run_in_pool(func, *args), STAGE_TIMEOUT_SECONDS)
+    return result, time.perf_counter() - started
+
+async def run_windowed_stages(handle: Dict[str, Any]) -> tuple:
+    """
+    Stage outcomes of a long track, analysed as windows spread over the whole pool
+    Every window's chord features, beat activations, key prediction and
+    fingerprint are computed in parallel; chords and tempo are then decoded
+    once over the stitched track, and the key comes from the window
+    predictions averaged by length. Returns (stages, outcomes) like the
+    per-stage path.
+    """
+    windows = pipeline.plan_windows(
+        handle["shape"][0], pipeline.ANALYSIS_WINDOW_SECONDS, pipeline.BEAT_CONTEXT_SECONDS
+    )
+    started = time.perf_counter()
+    # Any failed window fails the chords, so there is no partial result to keep
+    parts = await asyncio.gather(*(run_in_pool(pipeline.analyze_window, handle, window) for window in windows))
+    window_time = time.perf_counter() - started
+    logger.info(f"Analysed {len(windows)} windows in {window_time:.2f}s")
+    
+    # All on the pool: even labelling the key needs madmom, which this process never imports
+    chords, key, tempo = await asyncio.gather(
+        timed_pool_call(pipeline.decode_chord_features, [part["chord_features"] for part in parts]),
+        timed_pool_call(
+            pipeline.key_from_probabilities,
+            [part["key_prediction"] for part in parts], [part["seconds"] for part in parts]
+        ),
+        timed_pool_call(pipeline.tempo_from_activations, [part["beat_activations"] for part in parts]),
+        return_exceptions=True
+    )
+    try:
+        chroma = (pipeline.stitch_fingerprints([part["fingerprint"] for part in parts]), window_time)
+    except Exception as e:
+        chroma = e
+    
+    return ["chords", "key", "tempo", "fingerprint"], [chords, key, tempo, chroma]
+
+class AudioDecodeError(Exception):
+    """The file could not be decoded as audio"""
+
+def error_message(e: BaseException) -> str:
+    """The reason to report for a failure; some exceptions (timeouts, decoder errors) carry no message"""
+    if isinstance(e, HTTPException):
+        return e.detail
+    if isinstance(e, asyncio.TimeoutError):
+        return "Analysis timed out"
+    return str(e) or type(e).__name__
+
+async def decode_shared(audio_path: str) -> Dict[str, Any]:
+    """Decode a track into shared memory on the pool; raises AudioDecodeError if it is not audio"""
+    try:
+        return await run_in_pool(pipeline.decode_to_shared_memory, audio_path)
+    except BrokenProcessPool:
+        raise
+    except Exception as e:
+        raise AudioDecodeError(f"Could not decode audio: {error_message(e)}") from e
+
+async def analyze_path(audio_path: str) -> Dict[str, Any]:
+    """
+    Decode a track once, then run chord, key and tempo recognition in parallel
+    (as parallel windows for tracks over pipeline.LONG_INPUT_SECONDS).
+    Returns the combined record plus a "complete" flag that is False when key
+    or tempo fell back to defaults, and the track's "fingerprint" chroma (None
+    if it could not be computed).
+    """
+    logger.info(f"Starting audio analysis for: {audio_path}")
+    with metrics.analysis() as analysis:
+        handle = await decode_shared(audio_path)
         
-        logger.info(f"Recognized key: {key}")
-        return key
+        try:
+            duration = handle["shape"][0] / float(handle["sample_rate"])
+            logger.info(f"Decoded {duration:.1f}s of audio in {handle['decode_time']:.2f}s")
+            
+            started = time.perf_counter()
+            if pipeline.LONG_INPUT_SECONDS and duration > pipeline.LONG_INPUT_SECONDS:
+                stages, outcomes = await run_windowed_stages(handle)
+            else:
+                stages = list(pipeline.STAGES)
+                outcomes = await asyncio.gather(
+                    *(run_stage_with_timeout(stage, handle) for stage in stages),
+                    return_exceptions=True
+                )
+            wall_time = time.perf_counter() - started
+            analysis.audio_seconds = duration
+        finally:
+            pipeline.release_shared_signal(handle)
+    
+    # Chords are required; key and tempo fall back to defaults on failure
+    results, stage_times = {}, {}
+    for stage, outcome in zip(stages, outcomes):
+        if isinstance(outcome, BaseException):
+            reason = "timed out" if isinstance(outcome, asyncio.TimeoutError) else str(outcome)
+            logger.error(f"Stage {stage} failed: {reason}")
+            results[stage] = outcome
+        else:
+            results[stage], stage_times[stage] = outcome
+    
+    if isinstance(results["chords"], BaseException):
+        raise RuntimeError(f"Chord recognition failed: {results['chords']}")
+    
+    complete = True
+    key, tempo = results["key"], results["tempo"]
+    if isinstance(key, BaseException):
+        key, complete = "Unknown", False
+    if isinstance(tempo, BaseException):
+        tempo, complete = pipeline.DEFAULT_TEMPO, False
+    
+    # The measured decode ran once; the stages read its shared signal instead of decoding
+    logger.info(
+        f"Decode={handle['decode_time']:.2f}s, shared by {', '.join(stages)}; stage times: "
+        + ", ".join(f"{stage}={elapsed:.2f}s" for stage, elapsed in stage_times.items())
+        + f"; wall={wall_time:.2f}s"
+    )
+    
+    return {
+        "chords": [list(chord) for chord in results["chords"]],
+        "key": key,
+        "tempo": tempo,
+        "duration": duration,
+        "complete": complete,
+        "fingerprint": None if isinstance(results["fingerprint"], BaseException) else results["fingerprint"],
+    }
+
+# Analyses currently running, by cache key; identical concurrent requests share one
+analysis_flights = singleflight.SingleFlight()
+
+def link_audio_file(audio_path: str) -> str:
+    """Second directory entry for an audio file, so it outlives its owner deleting the original"""
+    directory, name = os.path.split(audio_path)
+    stem, suffix = os.path.splitext(name)
+    link_path = os.path.join(directory, f".{stem}.{uuid.uuid4().hex}{suffix}")
+    try:
+        os.link(audio_path, link_path)
+    except OSError:
+        shutil.copyfile(audio_path, link_path)
+    return link_path
+
+async def get_analysis(audio_path: str, cache_key: str, title: Optional[str] = None,
+                       request: Optional[Request] = None) -> Dict[str, Any]:
+    """
+    Return the combined analysis record (chords, key, tempo, duration) for a track.
+    Served from the cache when this content has been analysed before; otherwise
+    the pipeline runs once in the worker pool and the record is stored under
+    cache_key, unless key or tempo fell back to defaults ("stored" is then False).
+    Concurrent calls for the same cache_key wait on a single analysis; given the
+    request, a client that disconnects stops waiting (and the analysis is
+    cancelled once no request is waiting on it).
+    """
+    record = load_cached_analysis(cache_key)
+    if record is not None:
+        return record
+    
+    async def analyze() -> Dict[str, Any]:
+        # The analysis can outlive the request that started it, which deletes its upload
+        flight_path = link_audio_file(audio_path)
+        try:
+            record = await find_fingerprint_match(flight_path)
+            if record is not None:
+                # Also kept under this upload's key, so repeat uploads skip the lookup
+                save_cached_analysis(cache_key, record)
+                return record
+            record = await analyze_path(flight_path)
+        finally:
+            os.unlink(flight_path)
+        record["title"] = title
+        chroma = record.pop("fingerprint")
         
+        # Don't pin fallback values in the cache; a later request retries the failed stage
+        if record.pop("complete"):
+            save_cached_analysis(cache_key, record)
+            if chroma is not None:
+                await run_in_threadpool(fingerprint_index.add, cache_key, chroma, record["duration"])
+        else:
+            # Nothing is stored under cache_key, so responses must not name it as the analysis
+            record["stored"] = False
+        return record
+    
+    return await analysis_flights.run(cache_key, analyze, request)
+
+async def find_fingerprint_match(audio_path: str) -> Optional[Dict[str, Any]]:
+    """
+    The stored analysis of an already-analysed recording of this audio (another
+    rip, bitrate or trim), re-timed to it and with a "match" entry, or None
+    """
+    if not fingerprint.FINGERPRINT_QUERY_SECONDS:
+        return None
+    
+    try:
+        chroma, duration, probes = await run_in_pool(pipeline.fingerprint_file, audio_path)
+        match = await run_in_threadpool(fingerprint_index.match, chroma, duration, probes)
+        record = analysis_store.get(match["key"]) if match else None
     except Exception as e:
-        logger.error(f"Error recognizing key: {e}")
-        return "Unknown"
+        logger.warning(f"Fingerprint lookup failed: {e}")
+        return None
+    
+    metrics.count_cache("fingerprint", hit=record is not None)
+    if record is None:
+        if match:
+            # The matched analysis has been evicted from the result store
+            await run_in_threadpool(fingerprint_index.remove, match["key"])
+        return None
+    
+    record = fingerprint.shift_record(record, match["offset"], duration)
+    record["match"] = {"type": "fingerprint", "offset": match["offset"], "similarity": match["similarity"]}
+    return record
+
+# Full analyses queued behind preview responses, by analysis ID (the cache key):
+# {"preview", "result", "error", "task"}; finished ones are kept for polling
+refinements: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+MAX_TRACKED_REFINEMENTS = int(os.getenv("MAX_TRACKED_REFINEMENTS", "1000"))
+QUALITIES = ("full", "preview")
+
+def validate_quality(quality: str) -> None:
+    if quality not in QUALITIES:
+        raise HTTPException(status_code=400, detail=f"quality must be one of: {', '.join(QUALITIES)}")
+
+def schedule_refinement(audio_path: str, cache_key: str, title: Optional[str]) -> Dict[str, Any]:
+    """
+    Queue the full analysis of a track in the background unless it is already
+    queued or done, and return its registry entry. The analysis is shared with
+    any request for the same content and stored like every full analysis.
+    """
+    entry = refinements.get(cache_key)
+    if entry is not None and entry["error"] is None:
+        return entry
+    
+    entry = {"preview": None, "result": None, "error": None}
+    # The analysis outlives the request, which deletes its upload
+    flight_path = link_audio_file(audio_path)
+    
+    async def refine() -> None:
+        try:
+            entry["result"] = await get_analysis(flight_path, cache_key, title)
+            entry["preview"] = None
+            logger.info(f"Full analysis replaced the preview of {cache_key}")
+        except Exception as e:
+            logger.error(f"Full analysis of {cache_key} failed: {e}")
+            entry["error"] = error_message(e)
+        finally:
+            os.unlink(flight_path)
+    
+    entry["task"] = asyncio.create_task(refine())
+    refinements[cache_key] = entry
+    refinements.move_to_end(cache_key)
+    while len(refinements) > MAX_TRACKED_REFINEMENTS:
+        # Dropped entries still finish and are stored; they can no longer be polled while pending
+        refinements.popitem(last=False)
+    return entry
 
-def detect_tempo(audio_path: str) -> float:
+async def get_preview(audio_path: str, cache_key: str, title: Optional[str]) -> Dict[str, Any]:
+    """
+    The best record available right away: the full analysis if this content
+    has one, otherwise a quick preview analysis, with the full analysis queued
+    to replace it
     """
-    Detect tempo (BPM) from audio file using madmom (matching DeChord implementation)
-    Returns tempo as float
+    record = load_cached_analysis(cache_key)
+    if record is not None:
+        return record
+    
+    entry = schedule_refinement(audio_path, cache_key, title)
+    if entry["result"] is not None:
+        return entry["result"]
+    if entry["preview"] is None:
+        preview = await run_in_pool(pipeline.preview_analysis, audio_path)
+        preview["title"] = title
+        if entry["result"] is not None:
+            return entry["result"]
+        entry["preview"] = preview
+    return entry["preview"]
+
+def analysis_status(analysis_id: str) -> Optional[AnalysisStatus]:
+    """Status of a previewed analysis, or None if this process knows nothing of it"""
+    entry = refinements.get(analysis_id)
+    if entry is None:
+        # Finished before this process started, or by another process
+        try:
+            record = analysis_store.get(analysis_id)
+        except sqlite3.Error:
+            record = None
+        if record is None:
+            return None
+        return AnalysisStatus(
+            analysisId=analysis_id, status="completed",
+            result=result_from_record(record, record.get("title"), analysis_id)
+        )
+    
+    if entry["result"] is not None:
+        status, record = "completed", entry["result"]
+    else:
+        status, record = ("failed" if entry["error"] else "pending"), entry["preview"]
+    return AnalysisStatus(
+        analysisId=analysis_id,
+        status=status,
+        result=result_from_record(record, record.get("title"), analysis_id) if record is not None else None,
+        error=entry["error"]
+    )
+
+async def refinement_events(analysis_id: str, sse: bool):
     """
+    Yield the current preview as a "preview" message if the full analysis is
+    still running, then a "result" message once it is done (or an "error")
+    """
+    status = analysis_status(analysis_id)
+    if status.status == "pending":
+        if status.result is not None:
+            yield stream_message({"type": "preview", "result": status.result.model_dump()}, sse)
+        entry = refinements.get(analysis_id)
+        if entry is not None:
+            # Shielded: a subscriber going away must not cancel the analysis
+            await asyncio.shield(entry["task"])
+        status = analysis_status(analysis_id) or status
+    
+    if status.status == "completed":
+        yield stream_message({"type": "result", "result": status.result.model_dump()}, sse)
+    else:
+        yield stream_message({"type": "error", "detail": f"Analysis failed: {status.error or status.status}"}, sse)
+
+def chord_segments_from_record(record: Dict[str, Any]) -> List[ChordSegment]:
+    return [
+        ChordSegment(
+            startTime=float(start),
+            endTime=float(end),
+            chord=label
+        )
+        for start, end, label in record["chords"]
+    ]
+
+def result_from_record(record: Dict[str, Any], title: Optional[str],
+                       analysis_id: Optional[str] = None) -> AnalysisResult:
+    """The response for a record; analysis_id is left out for records that were never stored"""
+    return AnalysisResult(
+        chords=chord_segments_from_record(record),
+        key=record["key"],
+        tempo=record["tempo"],
+        duration=record["duration"],
+        title=title,
+        match=record.get("match"),
+        quality=record.get("quality", "full"),
+        analysisId=analysis_id if record.get("stored", True) else None
+    )
+
+@metrics.timed("upload_write")
+def spool_upload(source, suffix: str) -> tuple:
+    """
+    Copy an upload to a temporary file in fixed-size chunks, hashing it in the same pass
+    Returns (path, content_hash); raises 413 once MAX_UPLOAD_BYTES is exceeded
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        try:
+            for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if MAX_UPLOAD_BYTES and size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+                digest.update(chunk)
+                tmp_file.write(chunk)
+        except BaseException:
+            os.unlink(tmp_file.name)
+            raise
+    return tmp_file.name, f"sha256-{digest.hexdigest()}"
+
+async def save_upload(file: UploadFile) -> tuple:
+    """
+    Stream an uploaded file to a temporary path without holding it in memory
+    Returns (path, content_hash); oversized or overlong audio is rejected with 413
+    """
+    if MAX_UPLOAD_BYTES and file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+    
+    tmp_path, content_hash = await run_in_threadpool(spool_upload, file.file, Path(file.filename).suffix)
+    
+    if MAX_AUDIO_SECONDS:
+        duration = await run_in_threadpool(pipeline.probe_duration, tmp_path)
+        if duration is not None and duration > MAX_AUDIO_SECONDS:
+            os.unlink(tmp_path)
+            raise HTTPException(
+                status_code=413,
+                detail=f"Audio is {duration:.0f}s long; the limit is {MAX_AUDIO_SECONDS:.0f}s"
+            )
+    
+    return tmp_path, content_hash
+
+def stream_message(message: Dict[str, Any], sse: bool) -> str:
+    """Encode one streamed message as an NDJSON line or a server-sent event"""
+    data = json.dumps(message)
+    if sse:
+        return f"event: {message['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+def chords_payload(chords_data: List[tuple]) -> List[Dict[str, Any]]:
+    return [
+        {"startTime": float(start), "endTime": float(end), "chord": label}
+        for start, end, label in chords_data
+    ]
+
+async def stream_analysis(audio_path: str, cache_key: str, title: Optional[str], sse: bool, cleanup=None):
+    """
+    Analyze a track and yield results as they become available:
+    "key" and "tempo" messages, provisional "chords" batches per window in
+    track order, then a "result" message with the same AnalysisResult the
+    non-streaming endpoint returns (or an "error" message)
+    """
+    tasks = []
+    handle = analysis = None
     try:
-        cache_dir = "cache/tempo/"
-        os.makedirs(cache_dir, exist_ok=True)
-        
-        # Create cache key
-        hash_object = hashlib.md5(audio_path.encode())
-        hashed_filename = hash_object.hexdigest() + ".txt"
-        cache_file = os.path.join(cache_dir, hashed_filename)
+        record = load_cached_analysis(cache_key)
+        if record is not None:
+            yield stream_message({"type": "key", "key": record["key"]}, sse)
+            yield stream_message({"type": "tempo", "tempo": record["tempo"]}, sse)
+            result = result_from_record(record, title, cache_key)
+            yield stream_message({"type": "result", "result": result.model_dump()}, sse)
+            return
         
-        # Check cache
-        if os.path.exists(cache_file):
-            logger.info(f"Loading tempo from cache: {cache_file}")
-            with open(cache_file, "r") as f:
-                return float(f.read().strip())
+        analysis = metrics.start_analysis()
+        handle = await decode_shared(audio_path)
+        duration = handle["shape"][0] / float(handle["sample_rate"])
+        windows = pipeline.plan_windows(
+            handle["shape"][0], pipeline.STREAM_WINDOW_SECONDS, pipeline.WINDOW_CONTEXT_SECONDS
+        )
         
-        # Process audio using madmom (matching DeChord)
-        logger.info(f"Processing tempo for: {audio_path}")
-        from madmom.features.beats import RNNBeatProcessor
-        from madmom.features.tempo import TempoEstimationProcessor
+        key_task = asyncio.ensure_future(run_stage_with_timeout("key", handle))
+        tempo_task = asyncio.ensure_future(run_stage_with_timeout("tempo", handle))
+        window_tasks = [
+            asyncio.ensure_future(asyncio.wait_for(
+                run_in_pool(pipeline.recognize_chord_window, handle, window), STAGE_TIMEOUT_SECONDS
+            ))
+            for window in windows
+        ]
+        tasks = [key_task, tempo_task, *window_tasks]
         
-        beat_processor = RNNBeatProcessor()
-        beats = beat_processor(audio_path)
-        tempo_processor = TempoEstimationProcessor(fps=200)
-        tempos = tempo_processor(beats)
-        
-        if len(tempos):
-            top_tempo = tempos[0][0]
-            # Adjust tempo (matching DeChord logic)
-            adjusted_tempo = adjust_tempo(top_tempo)
+        complete = True
+        key = tempo = None
+        features = []
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
             
-            # Cache result
-            with open(cache_file, "w") as f:
-                f.write(str(round(adjusted_tempo)))
+            if key_task in done:
+                try:
+                    key = key_task.result()[0]
+                except Exception as e:
+                    logger.error(f"Stage key failed: {e}")
+                    key, complete = "Unknown", False
+                yield stream_message({"type": "key", "key": key}, sse)
             
-            logger.info(f"Detected tempo: {adjusted_tempo} BPM")
-            return float(round(adjusted_tempo))
-        else:
-            return 120.0  # Default tempo
+            if tempo_task in done:
+                try:
+                    tempo = tempo_task.result()[0]
+                except Exception as e:
+                    logger.error(f"Stage tempo failed: {e}")
+                    tempo, complete = pipeline.DEFAULT_TEMPO, False
+                yield stream_message({"type": "tempo", "tempo": tempo}, sse)
+            
+            # Emit chord windows strictly in track order
+            while len(features) < len(window_tasks) and window_tasks[len(features)].done():
+                window = windows[len(features)]
+                try:
+                    window_features, window_chords = window_tasks[len(features)].result()
+                except Exception as e:
+                    raise RuntimeError(f"Chord recognition failed: {e}")
+                features.append(window_features)
+                yield stream_message({
+                    "type": "chords",
+                    "start": window["core_start"] / float(handle["sample_rate"]),
+                    "end": window["core_stop"] / float(handle["sample_rate"]),
+                    "chords": chords_payload(window_chords),
+                }, sse)
         
+        # The final chords decode all stitched features at once, like the non-streaming path
+        chords_data = await run_in_pool(pipeline.decode_chord_features, features)
+        record = {
+            "chords": [list(chord) for chord in chords_data],
+            "key": key,
+            "tempo": tempo,
+            "duration": duration,
+            "title": None,
+        }
+        if complete:
+            save_cached_analysis(cache_key, record)
+        analysis.audio_seconds = duration
+        
+        result = result_from_record(record, title, cache_key if complete else None)
+        logger.info(f"Streamed analysis complete: {len(result.chords)} chords, key={key}, tempo={tempo}")
+        yield stream_message({"type": "result", "result": result.model_dump()}, sse)
+    
     except Exception as e:
-        logger.error(f"Error detecting tempo: {e}")
-        return 120.0  # Default tempo
+        logger.error(f"Error streaming analysis: {e}")
+        yield stream_message({"type": "error", "detail": f"Analysis failed: {error_message(e)}"}, sse)
+    
+    finally:
+        # Also reached when the client disconnects mid-stream
+        for task in tasks:
+            task.cancel()
+        if handle is not None:
+            pipeline.release_shared_signal(handle)
+        if analysis is not None:
+            metrics.finish_analysis(analysis)
+        if cleanup:
+            cleanup()
+
+def streaming_response(request: Request, events) -> StreamingResponse:
+    """Wrap streamed analysis messages as SSE if the client asked for it, otherwise NDJSON"""
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(events(sse=True), media_type="text/event-stream")
+    return StreamingResponse(events(sse=False), media_type="application/x-ndjson")
 
 @app.post("/analyze", response_model=AnalysisResult)
 async def analyze_audio(
+    request: Request,
     file: UploadFile = File(...),
     title: Optional[str] = Form(None),
+    stream: bool = Form(False),
+    quality: str = Form("full"),
     background_tasks: BackgroundTasks = None
 ):
     """
     Analyze audio file for chords, key, and tempo
-    Returns complete analysis result
+    Returns complete analysis result, or streams partial results as NDJSON
+    (or server-sent events) when stream is set
+    quality="preview" answers at once with an approximate analysis (unless a
+    full one is cached) and queues the full analysis; poll or subscribe to
+    /analyses/{analysisId} for it
     """
+    validate_quality(quality)
+    if stream and quality == "preview":
+        raise HTTPException(status_code=400, detail="stream cannot be combined with quality=preview")
+    
     try:
         # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.filename).suffix) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_path = tmp_file.name
+        tmp_path, cache_key = await save_upload(file)
         
         try:
-            # Get audio duration
-            y, sr = librosa.load(tmp_path)
-            duration = float(librosa.get_duration(y=y, sr=sr))
-            
-            # Process in parallel (could be optimized with async)
-            logger.info("Starting audio analysis...")
-            
-            # Recognize chords
-            chords_data = recognize_chords(tmp_path)
+            if stream:
+                return streaming_response(request, lambda sse: stream_analysis(
+                    tmp_path, cache_key, title or Path(file.filename).stem, sse,
+                    cleanup=lambda: os.path.exists(tmp_path) and os.unlink(tmp_path)
+                ))
             
-            # Recognize key
-            key = recognize_key(tmp_path)
-            
-            # Detect tempo
-            tempo = detect_tempo(tmp_path)
-            
-            # Format chords
-            chord_segments = [
-                ChordSegment(
-                    startTime=float(start),
-                    endTime=float(end),
-                    chord=label
-                )
-                for start, end, label in chords_data
-            ]
-            
-            result = AnalysisResult(
-                chords=chord_segments,
-                key=key,
-                tempo=tempo,
-                duration=duration,
-                title=title or Path(file.filename).stem
-            )
+            if quality == "preview":
+                record = await get_preview(tmp_path, cache_key, title or Path(file.filename).stem)
+            else:
+                record = await get_analysis(tmp_path, cache_key, request=request)
+            result = result_from_record(record, title or Path(file.filename).stem, cache_key)
             
-            logger.info(f"Analysis complete: {len(chord_segments)} chords, key={key}, tempo={tempo}")
+            logger.info(f"Analysis complete: {len(result.chords)} chords, key={result.key}, tempo={result.tempo}")
             
             # Clean up temp file in background
             if background_tasks:
@@ -273,199 +941,269 @@ async def analyze_audio(
                 os.unlink(tmp_path)
             
             return result
-            
+        
         except Exception as e:
             # Clean up on error
             if os.path.exists(tmp_path):
                 os.unlink(tmp_path)
-            raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
-            
+            raise HTTPException(status_code=500, detail=f"Analysis failed: {error_message(e)}")
+    
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing request: {e}")
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error: {error_message(e)}")
 
 @app.post("/chords", response_model=List[ChordSegment])
-async def get_chords(file: UploadFile = File(...)):
+async def get_chords(request: Request, file: UploadFile = File(...)):
     """Extract only chords from audio file"""
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.filename).suffix) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_path = tmp_file.name
+        tmp_path, cache_key = await save_upload(file)
         
         try:
-            chords_data = recognize_chords(tmp_path)
-            chord_segments = [
-                ChordSegment(
-                    startTime=float(start),
-                    endTime=float(end),
-                    chord=label
-                )
-                for start, end, label in chords_data
-            ]
-            return chord_segments
+            record = await get_analysis(tmp_path, cache_key, request=request)
+            return chord_segments_from_record(record)
         finally:
             if os.path.exists(tmp_path):
                 os.unlink(tmp_path)
-                
+    
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error extracting chords: {e}")
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error: {error_message(e)}")
 
 @app.post("/key")
-async def get_key(file: UploadFile = File(...)):
+async def get_key(request: Request, file: UploadFile = File(...)):
     """Extract only key from audio file"""
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.filename).suffix) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_path = tmp_file.name
+        tmp_path, cache_key = await save_upload(file)
         
         try:
-            key = recognize_key(tmp_path)
-            return {"key": key}
+            record = await get_analysis(tmp_path, cache_key, request=request)
+            return {"key": record["key"]}
         finally:
             if os.path.exists(tmp_path):
                 os.unlink(tmp_path)
-                
+    
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error extracting key: {e}")
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error: {error_message(e)}")
 
 @app.post("/tempo")
-async def get_tempo(file: UploadFile = File(...)):
+async def get_tempo(request: Request, file: UploadFile = File(...)):
     """Extract only tempo from audio file"""
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.filename).suffix) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_path = tmp_file.name
+        tmp_path, cache_key = await save_upload(file)
         
         try:
-            tempo = detect_tempo(tmp_path)
-            return {"tempo": tempo}
+            record = await get_analysis(tmp_path, cache_key, request=request)
+            return {"tempo": record["tempo"]}
         finally:
             if os.path.exists(tmp_path):
                 os.unlink(tmp_path)
-                
+    
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error detecting tempo: {e}")
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error: {error_message(e)}")
 
-def download_youtube_audio(url: str, output_path: str) -> tuple:
+async def download_youtube_audio(url: str) -> tuple:
     """
-    Download audio from YouTube URL using yt-dlp
+    Fetch a YouTube video's audio through the download cache
     Returns (audio_file_path, video_title)
     """
     try:
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': output_path,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'quiet': True,
-            'no_warnings': True,
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            title = info.get('title', 'Unknown')
-            # yt-dlp adds extension automatically
-            audio_path = output_path + '.mp3'
-            
-            return audio_path, title
+        # Network-bound; waiting on another request's download of the same video blocks too
+        return await run_in_threadpool(youtube_cache.default_cache().get, url)
     except Exception as e:
         logger.error(f"Error downloading YouTube audio: {e}")
-        raise HTTPException(status_code=500, detail=f"YouTube download failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"YouTube download failed: {error_message(e)}")
+
+async def analyze_youtube_url(url: str, request: Optional[Request] = None) -> AnalysisResult:
+    """
+    Download a YouTube video's audio and analyze it
+    Videos analysed before are served from the cache without downloading
+    """
+    # Validate YouTube URL
+    if 'youtube.com' not in url and 'youtu.be' not in url:
+        raise HTTPException(status_code=400, detail="Invalid YouTube URL")
+    
+    video_id = youtube_cache.video_id(url)
+    record = load_cached_analysis(f"youtube-{video_id}") if video_id else None
+    if record is not None:
+        return result_from_record(record, record.get("title"), f"youtube-{video_id}")
+    
+    # Download audio from YouTube (kept in the download cache, not deleted here)
+    logger.info(f"Downloading audio from YouTube: {url}")
+    audio_path, video_title = await download_youtube_audio(url)
+    
+    cache_key = f"youtube-{video_id}" if video_id else await run_in_threadpool(hash_audio_file, audio_path)
+    record = await get_analysis(audio_path, cache_key, title=video_title, request=request)
+    result = result_from_record(record, video_title, cache_key)
+    
+    logger.info(f"Analysis complete: {len(result.chords)} chords, key={result.key}, tempo={result.tempo}")
+    return result
 
 @app.post("/analyze-youtube", response_model=AnalysisResult)
-async def analyze_youtube(
-    url: str = Form(...),
-    background_tasks: BackgroundTasks = None
-):
+async def analyze_youtube(request: Request, url: str = Form(...)):
     """
     Analyze YouTube video for chords, key, and tempo
     Downloads audio from YouTube URL and analyzes it
     """
     try:
-        # Validate YouTube URL
-        if 'youtube.com' not in url and 'youtu.be' not in url:
-            raise HTTPException(status_code=400, detail="Invalid YouTube URL")
-        
-        # Create temp file for download
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
-            tmp_path = tmp_file.name
+        return await analyze_youtube_url(url, request)
+    except HTTPException as e:
+        if e.status_code < 500:
+            raise
+        logger.error(f"Error processing YouTube request: {e.detail}")
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {e.detail}")
+    except Exception as e:
+        logger.error(f"Error processing YouTube request: {e}")
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {error_message(e)}")
+
+@app.post("/analyze-batch", response_model=BatchAnalysisResult)
+async def analyze_batch(
+    files: Optional[List[UploadFile]] = File(None),
+    urls: Optional[List[str]] = Form(None)
+):
+    """
+    Analyze many audio files and/or YouTube URLs in one request
+    Items are decoded and analysed concurrently on the worker pool; each
+    item reports its own result or error
+    """
+    files = files or []
+    urls = urls or []
+    if not files and not urls:
+        raise HTTPException(status_code=400, detail="At least one file or url must be provided")
+    if len(files) + len(urls) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ITEMS} items per batch")
+    
+    # Identical items (same content or video), in this batch or any other
+    # request, share one analysis through get_analysis
+    tmp_paths = []
+    
+    async def analyze_file_item(file: UploadFile) -> AnalysisResult:
+        tmp_path, cache_key = await save_upload(file)
+        tmp_paths.append(tmp_path)
+        record = await get_analysis(tmp_path, cache_key)
+        return result_from_record(record, Path(file.filename).stem, cache_key)
+    
+    try:
+        items, sources = [], []
+        for file in files:
+            items.append(analyze_file_item(file))
+            sources.append(file.filename)
+        for url in urls:
+            items.append(analyze_youtube_url(url))
+            sources.append(url)
         
-        try:
-            # Download audio from YouTube
-            logger.info(f"Downloading audio from YouTube: {url}")
-            audio_path, video_title = download_youtube_audio(url, tmp_path)
-            
-            if not os.path.exists(audio_path):
-                raise HTTPException(status_code=500, detail="Failed to download audio")
-            
-            # Get audio duration
-            y, sr = librosa.load(audio_path)
-            duration = float(librosa.get_duration(y=y, sr=sr))
-            
-            # Process analysis
-            logger.info("Starting audio analysis...")
-            
-            # Recognize chords
-            chords_data = recognize_chords(audio_path)
-            
-            # Recognize key
-            key = recognize_key(audio_path)
-            
-            # Detect tempo
-            tempo = detect_tempo(audio_path)
-            
-            # Format chords
-            chord_segments = [
-                ChordSegment(
-                    startTime=float(start),
-                    endTime=float(end),
-                    chord=label
-                )
-                for start, end, label in chords_data
-            ]
-            
-            result = AnalysisResult(
-                chords=chord_segments,
-                key=key,
-                tempo=tempo,
-                duration=duration,
-                title=video_title
-            )
-            
-            logger.info(f"Analysis complete: {len(chord_segments)} chords, key={key}, tempo={tempo}")
-            
-            # Clean up temp files in background
-            if background_tasks:
-                background_tasks.add_task(os.unlink, audio_path)
-                background_tasks.add_task(os.unlink, tmp_path)
-            else:
-                if os.path.exists(audio_path):
-                    os.unlink(audio_path)
-                if os.path.exists(tmp_path):
-                    os.unlink(tmp_path)
-            
-            return result
-            
-        except Exception as e:
-            # Clean up on error
+        outcomes = await asyncio.gather(*items, return_exceptions=True)
+    finally:
+        for tmp_path in tmp_paths:
             if os.path.exists(tmp_path):
                 os.unlink(tmp_path)
-            if 'audio_path' in locals() and os.path.exists(audio_path):
-                os.unlink(audio_path)
-            raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
-            
-    except Exception as e:
-        logger.error(f"Error processing YouTube request: {e}")
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    results = []
+    for source, outcome in zip(sources, outcomes):
+        if isinstance(outcome, BaseException):
+            error = error_message(outcome)
+            logger.error(f"Batch item {source} failed: {error}")
+            results.append(BatchItemResult(source=source, status="error", error=error))
+        else:
+            results.append(BatchItemResult(source=source, status="ok", result=outcome))
+    
+    logger.info(f"Batch complete: {sum(r.status == 'ok' for r in results)}/{len(results)} items analysed")
+    return BatchAnalysisResult(items=results)
+
+@app.get("/analyses/{analysis_id}", response_model=AnalysisStatus)
+async def get_analysis_status(analysis_id: str):
+    """Poll a previewed analysis: the preview while the full analysis runs, then the full result"""
+    status = analysis_status(analysis_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return status
+
+@app.get("/analyses/{analysis_id}/events")
+async def analysis_events(request: Request, analysis_id: str):
+    """
+    Subscribe to a previewed analysis: streams the preview, then the full
+    result once it replaces it, as NDJSON or server-sent events
+    """
+    if analysis_status(analysis_id) is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return streaming_response(request, lambda sse: refinement_events(analysis_id, sse))
+
+# Derived chord views by (analysis ID, variant); analysis IDs name content, so views never go stale
+chord_view_cache = chord_views.ViewCache()
+
+@app.get("/analyses/{analysis_id}/chart", response_model=ChordChart)
+async def get_chord_chart(
+    analysis_id: str,
+    transpose: int = 0,
+    capo: int = 0,
+    simplify: str = "full",
+    quantize: str = "none",
+    spelling: str = "auto",
+    beatsPerBar: int = 4
+):
+    """
+    A completed analysis's chords transposed by transpose semitones, as the
+    shapes to play with a capo on fret capo, reduced to a simpler vocabulary
+    ("majmin" or "sevenths") and/or one chord per bar (quantize="bar", on a
+    grid of beatsPerBar beats at the analysed tempo); never re-analyses audio
+    """
+    try:
+        chord_views.validate_variant(capo, simplify, quantize, spelling)
+        if beatsPerBar < 1:
+            raise ValueError("beatsPerBar must be at least 1")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    variant = (transpose, capo, simplify, quantize, spelling, beatsPerBar if quantize == "bar" else None)
+    chart = chord_view_cache.get((analysis_id, variant))
+    metrics.count_cache("chord_view", hit=chart is not None)
+    if chart is None:
+        status = analysis_status(analysis_id)
+        if status is None:
+            raise HTTPException(status_code=404, detail="Analysis not found")
+        if status.status != "completed":
+            raise HTTPException(status_code=409, detail=f"Analysis is {status.status}")
+        
+        result = status.result
+        segments = [(c.startTime, c.endTime, c.chord) for c in result.chords]
+        bar_starts = None
+        if quantize == "bar":
+            first_onset = next((start for start, _, label in segments if label != "N"), 0.0)
+            bar_starts = chord_views.tempo_bars(result.tempo, first_onset, result.duration, beatsPerBar)
+        view = chord_views.chord_view(
+            segments, result.key, transpose, capo, simplify, spelling, bar_starts, result.duration
+        )
+        chart = ChordChart(
+            analysisId=analysis_id,
+            key=view["key"],
+            transpose=transpose,
+            capo=capo,
+            simplify=simplify,
+            quantize=quantize,
+            chords=[ChordSegment(startTime=start, endTime=end, chord=label) for start, end, label in view["chords"]]
+        )
+        chord_view_cache.put((analysis_id, variant), chart)
+    
+    return chart
+
+@app.get("/inflight")
+async def inflight():
+    """Analyses currently running and how many requests are waiting on each"""
+    return {"analyses": analysis_flights.waiter_counts()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Per-stage latency, resource, cache and queue metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.get("/health")
 async def health_check():
@@ -476,6 +1214,13 @@ async def health_check():
         "version": "1.0.0"
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 503 until the analysis workers have loaded and warmed their models"""
+    if not ready:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ready", "workers": ANALYSIS_WORKERS}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 8001)))
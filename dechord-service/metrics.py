@@ -0,0 +1,280 @@
+"""
+Service Metrics - PhinAccords
+Heavenkeys Ltd
+
+Per-stage latency and resource metrics in the Prometheus text format.
+Stage functions are wrapped with @timed; inside analysis worker processes
+their observations are buffered and returned with the task result
+(see collect_call), then replayed into this process's registry.
+"""
+
+import time
+import resource
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RSS_BUCKETS = tuple(2 ** power * 1024 * 1024 for power in range(6, 14))
+REALTIME_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+def _label_text(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name, self.help_text = name, help_text
+        self.values: Dict[tuple, float] = {}
+    
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0.0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_label_text(key)} {value}" for key, value in sorted(self.values.items())]
+        return lines
+
+class Gauge:
+    """Gauge whose value is read from a callback when rendered"""
+    
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        self.name, self.help_text, self.read = name, help_text, read
+    
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple):
+        self.name, self.help_text, self.buckets = name, help_text, buckets
+        # labels -> [bucket counts..., sum, count]
+        self.values: Dict[tuple, List[float]] = {}
+    
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        series = self.values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', str(bound)),))} {count}")
+            lines.append(f"{self.name}_bucket{_label_text(key + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_text(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_label_text(key)} {series[-1]}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+    
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        with self.lock:
+            return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+REGISTRY = Registry()
+
+STAGE_WALL = REGISTRY.add(Histogram(
+    "analysis_stage_wall_seconds", "Wall-clock time per pipeline stage", DURATION_BUCKETS))
+STAGE_CPU = REGISTRY.add(Histogram(
+    "analysis_stage_cpu_seconds", "CPU time per pipeline stage", DURATION_BUCKETS))
+ANALYSIS_WALL = REGISTRY.add(Histogram(
+    "analysis_wall_seconds", "Wall-clock time per full analysis", DURATION_BUCKETS))
+ANALYSIS_PEAK_RSS = REGISTRY.add(Histogram(
+    "analysis_peak_rss_bytes", "Peak resident memory of the workers during one analysis", RSS_BUCKETS))
+ANALYSIS_REALTIME = REGISTRY.add(Histogram(
+    "analysis_realtime_factor", "Audio seconds processed per wall-clock second, per analysis", REALTIME_BUCKETS))
+AUDIO_SECONDS = REGISTRY.add(Counter(
+    "audio_seconds_processed_total", "Seconds of audio analysed"))
+CACHE_REQUESTS = REGISTRY.add(Counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit or miss)"))
+
+# Observation buffer of the current pool task (None outside collect_call)
+_local = threading.local()
+# Analysis the current request is running, for per-analysis totals
+_current_analysis: contextvars.ContextVar = contextvars.ContextVar("current_analysis", default=None)
+
+def reset_peak_rss() -> None:
+    """Reset the kernel's peak RSS mark for this process (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_bytes() -> int:
+    """Peak RSS since the last reset_peak_rss() (since start where resets are unsupported)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def process_memory() -> Dict[str, int]:
+    """
+    Resident memory of this process in bytes: "rss", plus on Linux "pss" (each
+    shared page split between the processes sharing it) and "private" (pages
+    no other process shares), which show what copy-on-write sharing saves
+    """
+    memory = {"rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = {line.split(":")[0]: int(line.split()[1]) * 1024 for line in f if line.endswith("kB\n")}
+        memory["rss"] = fields["Rss"]
+        memory["pss"] = fields["Pss"]
+        memory["private"] = fields["Private_Clean"] + fields["Private_Dirty"]
+    except (OSError, KeyError, ValueError):
+        pass
+    return memory
+
+def _record(observation: tuple) -> None:
+    buffer = getattr(_local, "observations", None)
+    if buffer is not None:
+        buffer.append(observation)
+    else:
+        replay([observation])
+
+def count_cache(cache: str, hit: bool) -> None:
+    """Count one cache lookup"""
+    _record(("cache", cache, "hit" if hit else "miss"))
+
+def timed(stage: str):
+    """
+    Decorator recording wall time, CPU time and peak RSS of every call as a stage.
+    CPU time is the whole process's, so it is exact in worker processes running
+    one task at a time.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Nested stages must not reset the peak their caller is measuring
+            depth = getattr(_local, "depth", 0)
+            if depth == 0:
+                reset_peak_rss()
+            _local.depth = depth + 1
+            started_wall, started_cpu = time.perf_counter(), time.process_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _local.depth = depth
+                _record((
+                    "stage", stage,
+                    time.perf_counter() - started_wall,
+                    time.process_time() - started_cpu,
+                    peak_rss_bytes(),
+                ))
+        return wrapper
+    return decorator
+
+def collect_call(func, *args) -> tuple:
+    """
+    Pool entry point: run func(*args) and return (result, observations) so the
+    parent process can replay the worker's metrics
+    """
+    _local.observations = []
+    try:
+        result = func(*args)
+        return result, _local.observations
+    finally:
+        _local.observations = None
+
+class _Analysis:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.peak_rss = 0
+        self.audio_seconds: Optional[float] = None
+        self.token = None
+
+def replay(observations: List[tuple]) -> None:
+    """Apply observations (from this process or a worker) to the registry"""
+    analysis = _current_analysis.get()
+    with REGISTRY.lock:
+        for observation in observations:
+            if observation[0] == "stage":
+                _, stage, wall, cpu, peak = observation
+                STAGE_WALL.observe(wall, stage=stage)
+                STAGE_CPU.observe(cpu, stage=stage)
+                if analysis is not None:
+                    analysis.peak_rss = max(analysis.peak_rss, peak)
+            elif observation[0] == "cache":
+                _, cache, result = observation
+                CACHE_REQUESTS.inc(cache=cache, result=result)
+
+def start_analysis() -> _Analysis:
+    """
+    Open the scope of one analysis: stages replayed in this context (and in tasks
+    created from it) count towards its peak RSS. Set .audio_seconds on the
+    returned object once the audio has been analysed, then finish_analysis() it.
+    """
+    current = _Analysis()
+    current.token = _current_analysis.set(current)
+    return current
+
+def finish_analysis(current: _Analysis) -> None:
+    try:
+        _current_analysis.reset(current.token)
+    except ValueError:
+        # Finished from another context, e.g. a streaming generator closed by the server
+        pass
+    wall = time.perf_counter() - current.started
+    with REGISTRY.lock:
+        ANALYSIS_WALL.observe(wall)
+        if current.peak_rss:
+            ANALYSIS_PEAK_RSS.observe(current.peak_rss)
+        if current.audio_seconds:
+            AUDIO_SECONDS.inc(current.audio_seconds)
+            ANALYSIS_REALTIME.observe(current.audio_seconds / max(wall, 1e-9))
+
+@contextmanager
+def analysis():
+    """start_analysis() / finish_analysis() around a block"""
+    current = start_analysis()
+    try:
+        yield current
+    finally:
+        finish_analysis(current)
+
+def add_gauge(name: str, help_text: str, read: Callable[[], float]) -> None:
+    REGISTRY.add(Gauge(name, help_text, read))
+
+class RequestsInFlightMiddleware:
+    """ASGI middleware counting HTTP requests that are being handled"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        global requests_in_flight
+        requests_in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            requests_in_flight -= 1
+
+requests_in_flight = 0
+add_gauge("http_requests_in_flight", "HTTP requests currently being handled", lambda: requests_in_flight)
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,563 @@
+"""
+DeChord Analysis Pipeline - PhinAccords
+Heavenkeys Ltd
+
+CPU-bound chord, key and tempo recognition with madmom.
+Kept free of the web app so analysis worker processes can import it
+without pulling in FastAPI.
+"""
+
+import os
+import time
+import subprocess
+import queue
+from multiprocessing import shared_memory
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any
+import numpy as np
+from loguru import logger
+
+import chord_templates
+import fingerprint
+import metrics
+from lazy_imports import lazy_import
+
+# Imported on first use, so the web process can import this module cheaply
+librosa = lazy_import("librosa")
+madmom = lazy_import("madmom")
+ndimage = lazy_import("scipy.ndimage")
+soundfile = lazy_import("soundfile")
+
+# CNNChordFeatureProcessor, CNNKeyRecognitionProcessor and RNNBeatProcessor all expect 44.1 kHz mono
+ANALYSIS_SAMPLE_RATE = 44100
+# CNNChordFeatureProcessor frame rate and the matching hop in samples
+CHORD_FPS = 10
+CHORD_HOP_SIZE = ANALYSIS_SAMPLE_RATE // CHORD_FPS
+
+# Windowed chord recognition: core length and the context added on each side,
+# which must cover the chord CNN's receptive field
+STREAM_WINDOW_SECONDS = float(os.getenv("STREAM_WINDOW_SECONDS", "30"))
+WINDOW_CONTEXT_SECONDS = 3.0
+
+# Tracks longer than LONG_INPUT_SECONDS are analysed as windows of
+# ANALYSIS_WINDOW_SECONDS in parallel (0 disables); the bidirectional beat
+# network gets BEAT_CONTEXT_SECONDS on each side of a window
+LONG_INPUT_SECONDS = float(os.getenv("LONG_INPUT_SECONDS", "600"))
+ANALYSIS_WINDOW_SECONDS = float(os.getenv("ANALYSIS_WINDOW_SECONDS", "120"))
+BEAT_CONTEXT_SECONDS = 10.0
+# RNNBeatProcessor frame rate and hop; CHORD_HOP_SIZE is a multiple of it
+BEAT_FPS = 100
+BEAT_HOP_SIZE = ANALYSIS_SAMPLE_RATE // BEAT_FPS
+
+# Preloaded madmom processor sets per worker process
+PROCESSOR_POOL_SIZE = int(os.getenv("PROCESSOR_POOL_SIZE", "1"))
+WARMUP_SECONDS = 3.0
+DEFAULT_TEMPO = 120.0
+
+def format_chord_label(chord_label: str) -> str:
+    """Format chord label (remove :maj, replace :min with m)"""
+    if ":maj" in chord_label:
+        return chord_label.replace(":maj", "")
+    elif ":min" in chord_label:
+        return chord_label.replace(":min", "m")
+    return chord_label
+
+def adjust_tempo(tempo: float) -> float:
+    """Adjust tempo to reasonable range (matching DeChord logic)"""
+    while tempo < 70:
+        tempo *= 2
+    while tempo > 190:
+        tempo /= 2
+    return tempo
+
+class AnalysisProcessors:
+    """One set of madmom processors; building it loads every network's weights"""
+    
+    def __init__(self):
+        from madmom.features.beats import RNNBeatProcessor
+        from madmom.features.tempo import TempoEstimationProcessor
+        
+        self.chord_features = madmom.features.chords.CNNChordFeatureProcessor()
+        self.chord_decoder = madmom.features.chords.CRFChordRecognitionProcessor()
+        self.key = madmom.features.key.CNNKeyRecognitionProcessor()
+        self.beats = RNNBeatProcessor()
+        self.tempo = TempoEstimationProcessor(fps=200)
+
+# Pool of preloaded processor sets (load once, borrow per request)
+processor_pool: Optional[queue.Queue] = None
+
+def warm_up(processors: AnalysisProcessors) -> None:
+    """Run every stage once on a short synthetic clip so lazy setup happens before real traffic"""
+    t = np.arange(int(WARMUP_SECONDS * ANALYSIS_SAMPLE_RATE)) / ANALYSIS_SAMPLE_RATE
+    # C major triad
+    clip = sum(0.2 * np.sin(2 * np.pi * freq * t) for freq in (261.63, 329.63, 392.0))
+    signal = madmom.audio.Signal(clip.astype(np.float32), sample_rate=ANALYSIS_SAMPLE_RATE, num_channels=1)
+    
+    recognize_chords(signal, processors)
+    recognize_key(signal, processors)
+    detect_tempo(signal, processors)
+    compute_fingerprint(signal, processors)
+
+def load_models():
+    """Build the processor pool and warm each set up"""
+    global processor_pool
+    
+    try:
+        started = time.perf_counter()
+        pool = queue.Queue()
+        for _ in range(PROCESSOR_POOL_SIZE):
+            processors = AnalysisProcessors()
+            warm_up(processors)
+            pool.put(processors)
+        processor_pool = pool
+        
+        logger.info(
+            f"Loaded and warmed {PROCESSOR_POOL_SIZE} processor set(s) "
+            f"in {time.perf_counter() - started:.2f}s (pid {os.getpid()})"
+        )
+    except Exception as e:
+        logger.error(f"Error loading models: {e}")
+        raise
+
+def init_worker() -> None:
+    """Pool initializer: load the models unless the worker was forked with them loaded"""
+    if processor_pool is None:
+        load_models()
+
+def worker_status() -> Dict[str, Any]:
+    """This process's pid and memory; run on each worker at boot, after init_worker"""
+    return {"pid": os.getpid(), **metrics.process_memory()}
+
+@contextmanager
+def borrow_processors():
+    """Borrow a processor set from the pool for the duration of one analysis"""
+    if processor_pool is None:
+        load_models()
+    
+    processors = processor_pool.get()
+    try:
+        yield processors
+    finally:
+        processor_pool.put(processors)
+
+def probe_duration(audio_path: str) -> Optional[float]:
+    """
+    Duration of an audio file in seconds, read from its header without decoding
+    Returns None when neither libsndfile nor ffprobe can tell
+    """
+    try:
+        return float(soundfile.info(audio_path).duration)
+    except Exception:
+        pass
+    
+    try:
+        probe = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", audio_path],
+            capture_output=True, text=True, timeout=30
+        )
+        return float(probe.stdout.strip())
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+@metrics.timed("decode")
+def decode_audio(audio_path: str) -> "madmom.audio.Signal":
+    """
+    Decode an audio file once into a mono signal at the rate shared by the
+    madmom chord, key and beat processors, so each stage can reuse it
+    """
+    return madmom.audio.Signal(audio_path, sample_rate=ANALYSIS_SAMPLE_RATE, num_channels=1)
+
+@metrics.timed("chord_cnn")
+def compute_chord_features(signal: "madmom.audio.Signal", processors: AnalysisProcessors) -> np.ndarray:
+    """Chord CNN features of a decoded signal, one row per frame"""
+    return processors.chord_features(signal)
+
+def recognize_chords(signal: "madmom.audio.Signal", processors: AnalysisProcessors) -> List[tuple]:
+    """
+    Recognize chords from a decoded signal using madmom
+    Returns list of (start_time, end_time, chord_label) tuples
+    """
+    formatted_chords = decode_chord_features([compute_chord_features(signal, processors)], processors)
+    
+    logger.info(f"Recognized {len(formatted_chords)} chords")
+    return formatted_chords
+
+@metrics.timed("key")
+def recognize_key(signal: "madmom.audio.Signal", processors: AnalysisProcessors) -> str:
+    """
+    Recognize musical key from a decoded signal using madmom
+    Returns key as string (e.g., "C major", "A minor")
+    """
+    key_prediction = processors.key(signal)
+    key = madmom.features.key.key_prediction_to_label(key_prediction)
+    
+    logger.info(f"Recognized key: {key}")
+    return key
+
+def key_from_probabilities(probabilities: List[np.ndarray], weights: List[float]) -> str:
+    """Key label of per-window key CNN outputs averaged with the given weights (e.g. window lengths)"""
+    average = np.average([np.atleast_2d(p)[0] for p in probabilities], axis=0, weights=weights)
+    key = madmom.features.key.key_prediction_to_label(average[np.newaxis])
+    
+    logger.info(f"Recognized key: {key}")
+    return key
+
+@metrics.timed("tempo")
+def detect_tempo(signal: "madmom.audio.Signal", processors: AnalysisProcessors) -> float:
+    """
+    Detect tempo (BPM) from a decoded signal using madmom (matching DeChord implementation)
+    Returns tempo as float
+    """
+    return tempo_from_activations([processors.beats(signal)], processors)
+
+def tempo_from_activations(activation_parts: List[np.ndarray],
+                           processors: Optional[AnalysisProcessors] = None) -> float:
+    """Tempo (BPM) from the beat activations of a whole track, possibly stitched from windows"""
+    if processors is None:
+        with borrow_processors() as processors:
+            return tempo_from_activations(activation_parts, processors)
+    
+    tempos = processors.tempo(np.concatenate(activation_parts))
+    
+    if not len(tempos):
+        return DEFAULT_TEMPO
+    
+    # Adjust tempo (matching DeChord logic)
+    adjusted_tempo = adjust_tempo(tempos[0][0])
+    logger.info(f"Detected tempo: {adjusted_tempo} BPM")
+    return float(round(adjusted_tempo))
+
+# Fingerprint chroma: STFT at a low rate with one frame per 1 / FINGERPRINT_FPS seconds
+FINGERPRINT_SAMPLE_RATE = 11025
+FINGERPRINT_N_FFT = 4096
+FINGERPRINT_SILENCE = 1e-3
+FINGERPRINT_HOP_SIZE = FINGERPRINT_SAMPLE_RATE // fingerprint.FINGERPRINT_FPS
+
+def fingerprint_frames(y: np.ndarray, sr: int) -> tuple:
+    """Unit-norm fingerprint chroma frames and the energy of each, before silence is marked"""
+    if sr != FINGERPRINT_SAMPLE_RATE:
+        y = librosa.resample(np.asarray(y, dtype=np.float32), orig_sr=sr, target_sr=FINGERPRINT_SAMPLE_RATE)
+    chroma = librosa.feature.chroma_stft(
+        y=y, sr=FINGERPRINT_SAMPLE_RATE, n_fft=FINGERPRINT_N_FFT,
+        hop_length=FINGERPRINT_HOP_SIZE, norm=None, tuning=0.0
+    )
+    energy = chroma.sum(axis=0)
+    chroma /= np.linalg.norm(chroma, axis=0, keepdims=True) + 1e-10
+    return chroma, energy
+
+def mark_silence(chroma: np.ndarray, energy: np.ndarray) -> np.ndarray:
+    """Zero frames far quieter than the loudest one and convert to the stored dtype"""
+    chroma[:, energy < FINGERPRINT_SILENCE * energy.max(initial=0.0)] = 0
+    return chroma.astype(np.float16)
+
+def fingerprint_chroma(y: np.ndarray, sr: int) -> np.ndarray:
+    """
+    Unit-norm chroma frames for fingerprint.FingerprintIndex, identical in
+    shape and scale for a full decoded track and for the start of an upload
+    Frames far quieter than the loudest are zeroed as silence
+    """
+    return mark_silence(*fingerprint_frames(y, sr))
+
+@metrics.timed("fingerprint")
+def compute_fingerprint(signal: "madmom.audio.Signal", processors: AnalysisProcessors) -> np.ndarray:
+    """Fingerprint chroma of a whole decoded track"""
+    return fingerprint_chroma(np.asarray(signal), signal.sample_rate)
+
+@metrics.timed("fingerprint_query")
+def fingerprint_file(audio_path: str) -> tuple:
+    """
+    Fingerprint chroma of an upload's first FINGERPRINT_QUERY_SECONDS, the
+    upload's full duration (None if unknown), and (start, chroma) excerpts of
+    its middle and end for FingerprintIndex.match; only those parts are decoded
+    """
+    y, sr = librosa.load(
+        audio_path, sr=FINGERPRINT_SAMPLE_RATE, mono=True, duration=fingerprint.FINGERPRINT_QUERY_SECONDS
+    )
+    duration = probe_duration(audio_path)
+    probes = []
+    for start in fingerprint.probe_starts(duration) if duration else []:
+        excerpt, _ = librosa.load(
+            audio_path, sr=FINGERPRINT_SAMPLE_RATE, mono=True,
+            offset=start, duration=fingerprint.FINGERPRINT_PROBE_SECONDS
+        )
+        probes.append((start, fingerprint_chroma(excerpt, sr)))
+    return fingerprint_chroma(y, sr), duration, probes
+
+# Preview quality: chord_templates' triads matched against fingerprint-rate chroma,
+# a key profile and librosa's tempo estimate, all from one low-rate decode
+PREVIEW_SAMPLE_RATE = FINGERPRINT_SAMPLE_RATE
+# Chroma frames averaged before matching, so chords do not flicker with single notes
+PREVIEW_SMOOTHING_FRAMES = 5
+# Key roots spelled as madmom's key recognizer spells them
+KEY_ROOTS = {
+    "major": ['C', 'Db', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B'],
+    "minor": ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'Bb', 'B'],
+}
+# Krumhansl-Kessler key profiles, tonic first
+KEY_PROFILES = {
+    "major": [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88],
+    "minor": [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17],
+}
+
+def match_chord_templates(chroma: np.ndarray, fps: float) -> List[tuple]:
+    """
+    Label every chroma frame with python-service's triad matcher (see
+    chord_templates), "N" where no template fits, and merge runs of equal labels
+    Returns list of (start_time, end_time, chord_label) tuples
+    """
+    num_frames = chroma.shape[1]
+    if not num_frames:
+        return []
+    
+    labels = chord_templates.match_chords(
+        ndimage.uniform_filter1d(chroma.astype(np.float32), PREVIEW_SMOOTHING_FRAMES, axis=1)
+    )
+    run_starts = np.concatenate(([0], np.flatnonzero(np.diff(labels)) + 1))
+    run_ends = np.append(run_starts[1:], num_frames)
+    return [
+        (start / fps, end / fps,
+         chord_templates.CHORD_NAMES[label] if label != chord_templates.NO_CHORD else "N")
+        for label, start, end in zip(labels[run_starts].tolist(), run_starts.tolist(), run_ends.tolist())
+    ]
+
+def estimate_key_from_chroma(chroma: np.ndarray) -> str:
+    """Key whose profile correlates best with the track's summed chroma (e.g. "A minor")"""
+    profile = chroma.astype(np.float64).sum(axis=1)
+    if not profile.any():
+        return "Unknown"
+    
+    candidates, rows = [], []
+    for mode, template in KEY_PROFILES.items():
+        for tonic in range(12):
+            candidates.append(f"{KEY_ROOTS[mode][tonic]} {mode}")
+            rows.append(np.roll(template, tonic))
+    rows = np.array(rows)
+    rows = (rows - rows.mean(axis=1, keepdims=True)) / rows.std(axis=1, keepdims=True)
+    profile = (profile - profile.mean()) / (profile.std() + 1e-10)
+    return candidates[int(np.argmax(rows @ profile))]
+
+@metrics.timed("preview")
+def preview_analysis(audio_path: str) -> Dict[str, Any]:
+    """
+    Fast approximate analysis for quality=preview, without the madmom networks:
+    chords from chroma templates, key from a key profile and tempo from librosa,
+    on a decode at PREVIEW_SAMPLE_RATE
+    Returns a record shaped like the full analysis, marked "quality": "preview"
+    """
+    y, sr = librosa.load(audio_path, sr=PREVIEW_SAMPLE_RATE, mono=True)
+    duration = len(y) / float(sr)
+    chroma = fingerprint_chroma(y, sr)
+    
+    tempo = DEFAULT_TEMPO
+    if len(y):
+        estimates = librosa.feature.tempo(y=y, sr=sr)
+        if len(estimates) and estimates[0] > 0:
+            tempo = float(round(adjust_tempo(float(estimates[0]))))
+    
+    chords = match_chord_templates(chroma, fingerprint.FINGERPRINT_FPS)
+    if chords:
+        # The last frame may run slightly past the end of the audio
+        chords[-1] = (chords[-1][0], min(chords[-1][1], duration), chords[-1][2])
+    
+    return {
+        "chords": [list(chord) for chord in chords],
+        "key": estimate_key_from_chroma(chroma),
+        "tempo": tempo,
+        "duration": duration,
+        "quality": "preview",
+    }
+
+# Stage name -> function; each takes (signal, processors)
+STAGES = {
+    "chords": recognize_chords,
+    "key": recognize_key,
+    "tempo": detect_tempo,
+    "fingerprint": compute_fingerprint,
+}
+
+def decode_to_shared_memory(audio_path: str) -> Dict[str, Any]:
+    """
+    Decode a track once into shared memory so stages running in other
+    worker processes can read the same samples without copying or decoding.
+    Returns a handle for run_stage(); the caller must release_shared_signal() it.
+    """
+    started = time.perf_counter()
+    signal = decode_audio(audio_path)
+    decode_time = time.perf_counter() - started
+    
+    samples = np.ascontiguousarray(signal)
+    shm = shared_memory.SharedMemory(create=True, size=max(samples.nbytes, 1))
+    np.ndarray(samples.shape, dtype=samples.dtype, buffer=shm.buf)[...] = samples
+    shm.close()
+    
+    return {
+        "name": shm.name,
+        "shape": samples.shape,
+        "dtype": samples.dtype.str,
+        "sample_rate": signal.sample_rate,
+        "decode_time": decode_time,
+    }
+
+def release_shared_signal(handle: Dict[str, Any]) -> None:
+    """Free the shared memory behind a decoded signal"""
+    try:
+        shm = shared_memory.SharedMemory(name=handle["name"])
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+@contextmanager
+def attached_signal(handle: Dict[str, Any], start: int = 0, stop: Optional[int] = None):
+    """Attach to a signal decoded by decode_to_shared_memory(), optionally a slice of it"""
+    shm = shared_memory.SharedMemory(name=handle["name"])
+    samples = signal = None
+    try:
+        samples = np.ndarray(handle["shape"], dtype=np.dtype(handle["dtype"]), buffer=shm.buf)
+        signal = madmom.audio.Signal(samples[start:stop], sample_rate=handle["sample_rate"], num_channels=1)
+        yield signal
+    finally:
+        # Views into the buffer must be gone before it can be closed
+        del samples, signal
+        try:
+            shm.close()
+        except BufferError:
+            # A traceback still references the buffer; it is unmapped once collected
+            pass
+
+def run_stage(stage: str, handle: Dict[str, Any]) -> tuple:
+    """
+    Run one analysis stage on a signal decoded by decode_to_shared_memory()
+    Returns (result, elapsed_seconds)
+    """
+    with attached_signal(handle) as signal:
+        started = time.perf_counter()
+        with borrow_processors() as processors:
+            result = STAGES[stage](signal, processors)
+        return result, time.perf_counter() - started
+
+def plan_windows(num_samples: int, window_seconds: float, context_seconds: float,
+                 hop_size: int = CHORD_HOP_SIZE) -> List[Dict[str, int]]:
+    """
+    Split a signal into consecutive core regions of about window_seconds, each
+    extended by context_seconds on both sides. All boundaries fall on multiples
+    of hop_size, so a window's frames line up with the full signal's frames.
+    """
+    core = max(hop_size, int(window_seconds * ANALYSIS_SAMPLE_RATE) // hop_size * hop_size)
+    context = int(np.ceil(context_seconds * ANALYSIS_SAMPLE_RATE / hop_size)) * hop_size
+    
+    windows = []
+    for core_start in range(0, max(num_samples, 1), core):
+        core_stop = min(core_start + core, num_samples)
+        windows.append({
+            "start": max(0, core_start - context),
+            "stop": min(num_samples, core_stop + context),
+            "core_start": core_start,
+            "core_stop": core_stop,
+        })
+    return windows
+
+def core_frames(frames: np.ndarray, window: Dict[str, int], hop_size: int) -> np.ndarray:
+    """
+    The frames of a window's core region, from frames computed over the whole window
+    madmom centres frames on multiples of the hop size, so these are exactly
+    the frames the full signal has at these positions (the last window keeps
+    the final partial frame, like the full signal)
+    """
+    first = (window["core_start"] - window["start"]) // hop_size
+    count = -(-window["core_stop"] // hop_size) - window["core_start"] // hop_size
+    return np.array(frames[first:first + count])
+
+def recognize_chord_window(handle: Dict[str, Any], window: Dict[str, int]) -> tuple:
+    """
+    Compute chord CNN features for one window of a shared signal
+    Returns (features, chords): the features of the window's core frames, ready
+    to be stitched with neighbouring windows, and a provisional CRF decoding
+    of just this window with times relative to the whole track
+    """
+    with attached_signal(handle, window["start"], window["stop"]) as signal:
+        with borrow_processors() as processors:
+            feats = compute_chord_features(signal, processors)
+            
+            core_feats = core_frames(feats, window, CHORD_HOP_SIZE)
+            
+            offset = window["core_start"] / float(ANALYSIS_SAMPLE_RATE)
+            chords = [
+                (start + offset, end + offset, label)
+                for start, end, label in decode_chord_features([core_feats], processors)
+            ]
+    return core_feats, chords
+
+def window_fingerprint(samples: np.ndarray, sr: int, window: Dict[str, int], num_samples: int) -> tuple:
+    """
+    Fingerprint chroma frames and energies of a window's core region, resampled
+    onto the frame times the whole track's fingerprint would have
+    """
+    chroma, energy = fingerprint_frames(samples, sr)
+    scale = FINGERPRINT_SAMPLE_RATE / float(sr)
+    core_start, core_stop = window["core_start"] * scale, window["core_stop"] * scale
+    first = int(np.ceil(core_start / FINGERPRINT_HOP_SIZE))
+    if window["core_stop"] == num_samples:
+        # Centred framing gives the whole track a frame at its very end
+        stop = 1 + int(np.ceil(core_stop)) // FINGERPRINT_HOP_SIZE
+    else:
+        stop = int(np.ceil(core_stop / FINGERPRINT_HOP_SIZE))
+    
+    local = np.round((np.arange(first, stop) * FINGERPRINT_HOP_SIZE - core_start) / FINGERPRINT_HOP_SIZE)
+    local = np.clip(local.astype(int), 0, chroma.shape[1] - 1)
+    return chroma[:, local], energy[local]
+
+def stitch_fingerprints(parts: List[tuple]) -> np.ndarray:
+    """Whole-track fingerprint chroma from window_fingerprint() parts in track order"""
+    chroma = np.concatenate([part[0] for part in parts], axis=1)
+    return mark_silence(chroma, np.concatenate([part[1] for part in parts]))
+
+@metrics.timed("window")
+def analyze_window(handle: Dict[str, Any], window: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Everything one window of a long shared signal contributes to its analysis:
+    chord CNN features and beat activations of the core frames (computed with
+    context so they line up with a single pass), the key CNN's output and
+    fingerprint chroma for the core region
+    """
+    chord_context = int(np.ceil(WINDOW_CONTEXT_SECONDS * ANALYSIS_SAMPLE_RATE / CHORD_HOP_SIZE)) * CHORD_HOP_SIZE
+    chord_window = dict(
+        window,
+        start=max(window["start"], window["core_start"] - chord_context),
+        stop=min(window["stop"], window["core_stop"] + chord_context),
+    )
+    
+    with borrow_processors() as processors:
+        with attached_signal(handle, chord_window["start"], chord_window["stop"]) as signal:
+            chord_features = core_frames(compute_chord_features(signal, processors), chord_window, CHORD_HOP_SIZE)
+        with attached_signal(handle, window["start"], window["stop"]) as signal:
+            beat_activations = core_frames(processors.beats(signal), window, BEAT_HOP_SIZE)
+        with attached_signal(handle, window["core_start"], window["core_stop"]) as signal:
+            key_prediction = processors.key(signal)
+            chroma, energy = window_fingerprint(np.asarray(signal), signal.sample_rate, window, handle["shape"][0])
+    
+    return {
+        "chord_features": chord_features,
+        "beat_activations": beat_activations,
+        "key_prediction": np.atleast_2d(key_prediction)[0],
+        "seconds": (window["core_stop"] - window["core_start"]) / float(ANALYSIS_SAMPLE_RATE),
+        "fingerprint": (chroma, energy),
+    }
+
+def decode_chord_features(feature_parts: List[np.ndarray],
+                          processors: Optional[AnalysisProcessors] = None) -> List[tuple]:
+    """Decode stitched chord CNN features into (start_time, end_time, chord_label) tuples"""
+    if processors is None:
+        with borrow_processors() as processors:
+            return decode_chord_features(feature_parts, processors)
+    
+    return run_chord_decoder(np.concatenate(feature_parts), processors)
+
+@metrics.timed("chord_crf")
+def run_chord_decoder(features: np.ndarray, processors: AnalysisProcessors) -> List[tuple]:
+    chords = processors.chord_decoder(features)
+    return [
+        (float(start_time), float(end_time), format_chord_label(chord_label))
+        for start_time, end_time, chord_label in chords
+    ]
@@ -0,0 +1,252 @@
+"""
+Analysis Result Store - PhinAccords
+Heavenkeys Ltd
+
+One SQLite database holding every cached analysis record, instead of a file
+per result. Chord segments are stored as packed float32 start/end times plus
+uint16 IDs into an interned label table. The store is bounded by a total size
+and a TTL, evicting least recently used records first, and is safe to share
+between processes.
+"""
+
+import os
+import glob
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Optional, Dict, Any
+import numpy as np
+from loguru import logger
+
+RESULT_STORE_MAX_BYTES = int(os.getenv("RESULT_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESULT_STORE_TTL_SECONDS = float(os.getenv("RESULT_STORE_TTL_SECONDS", str(30 * 24 * 3600)))
+# Hits only refresh a record's last-access time this often, so reads rarely write
+TOUCH_INTERVAL_SECONDS = 60
+# Accounted per record on top of its data, for the row and index entries
+ROW_OVERHEAD_BYTES = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    id INTEGER PRIMARY KEY,
+    label TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    starts BLOB NOT NULL,
+    ends BLOB NOT NULL,
+    label_ids BLOB NOT NULL,
+    music_key TEXT NOT NULL,
+    tempo REAL NOT NULL,
+    duration REAL NOT NULL,
+    title TEXT,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at);
+"""
+
+class ResultStore:
+    """Analysis records by cache key: {"chords", "key", "tempo", "duration", "title"}"""
+    
+    def __init__(self, db_path: str, max_bytes: int = RESULT_STORE_MAX_BYTES,
+                 ttl_seconds: float = RESULT_STORE_TTL_SECONDS):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # Label IDs never change once assigned, so each process can keep them
+        self._label_ids: Dict[str, int] = {}
+        self._labels: Dict[int, str] = {}
+        self._labels_lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            # WAL lets one process write while others read
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+    
+    @contextmanager
+    def _connect(self):
+        """Connection that commits on success and is always closed"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def _intern(self, conn, labels) -> np.ndarray:
+        """uint16 IDs of chord labels, adding unseen labels to the label table"""
+        with self._labels_lock:
+            missing = sorted(set(labels) - self._label_ids.keys())
+            if missing:
+                conn.executemany("INSERT OR IGNORE INTO labels (label) VALUES (?)", [(l,) for l in missing])
+                placeholders = ",".join("?" * len(missing))
+                for label_id, label in conn.execute(
+                    f"SELECT id, label FROM labels WHERE label IN ({placeholders})", missing
+                ):
+                    self._label_ids[label] = label_id
+                    self._labels[label_id] = label
+            return np.array([self._label_ids[label] for label in labels], dtype=np.uint16)
+    
+    def _label_names(self, conn, ids: np.ndarray) -> list:
+        with self._labels_lock:
+            if not set(ids.tolist()) <= self._labels.keys():
+                for label_id, label in conn.execute("SELECT id, label FROM labels"):
+                    self._label_ids[label] = label_id
+                    self._labels[label_id] = label
+            return [self._labels[label_id] for label_id in ids.tolist()]
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """The record stored under key, or None if missing or expired"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT starts, ends, label_ids, music_key, tempo, duration, title, created_at, accessed_at "
+                "FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            starts, ends, label_ids, music_key, tempo, duration, title, created_at, accessed_at = row
+            
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            if now - accessed_at > TOUCH_INTERVAL_SECONDS:
+                conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            
+            labels = self._label_names(conn, np.frombuffer(label_ids, dtype=np.uint16))
+        
+        # float32 is exact to well under a millisecond for tracks up to hours long
+        starts = np.round(np.frombuffer(starts, dtype=np.float32).astype(np.float64), 3).tolist()
+        ends = np.round(np.frombuffer(ends, dtype=np.float32).astype(np.float64), 3).tolist()
+        return {
+            "chords": [list(chord) for chord in zip(starts, ends, labels)],
+            "key": music_key,
+            "tempo": tempo,
+            "duration": duration,
+            "title": title,
+        }
+    
+    def put(self, key: str, record: Dict[str, Any]) -> None:
+        """Store a record under key, replacing any previous one, then enforce the size limit"""
+        chords = record["chords"]
+        starts = np.array([float(chord[0]) for chord in chords], dtype=np.float32).tobytes()
+        ends = np.array([float(chord[1]) for chord in chords], dtype=np.float32).tobytes()
+        title = record.get("title")
+        size = (
+            ROW_OVERHEAD_BYTES + len(key) + 2 * len(starts) + 2 * len(chords)
+            + len(record["key"]) + len((title or "").encode())
+        )
+        
+        now = time.time()
+        with self._connect() as conn:
+            label_ids = self._intern(conn, [chord[2] for chord in chords]).tobytes()
+            conn.execute(
+                "INSERT OR REPLACE INTO results "
+                "(key, starts, ends, label_ids, music_key, tempo, duration, title, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, starts, ends, label_ids, record["key"], float(record["tempo"]),
+                 float(record["duration"]), title, size, now, now)
+            )
+            self._evict(conn, now)
+    
+    def _evict(self, conn, now: float) -> None:
+        """Drop expired records, then least recently used ones until the store fits in max_bytes"""
+        if self.ttl_seconds:
+            conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,))
+        if not self.max_bytes:
+            return
+        
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        
+        evicted = 0
+        while total > self.max_bytes:
+            oldest = conn.execute("SELECT key, size FROM results ORDER BY accessed_at LIMIT 64").fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        logger.info(f"Evicted {evicted} record(s) from the result store")
+    
+    def delete_prefix(self, prefix: str) -> int:
+        """Delete every record whose key starts with prefix; returns how many were deleted"""
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM results WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+            ).rowcount
+    
+    def clear(self) -> None:
+        """Delete every record"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results")
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._connect() as conn:
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"records": count, "bytes": total}
+
+def _unlink(path: str) -> None:
+    # Another worker starting at the same time may have removed it first
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def migrate_file_caches(cache_dir: str, store: ResultStore) -> int:
+    """
+    Import the cache/analysis/<key>.json records of earlier versions into the
+    store and delete them. The older cache/chord, cache/key and cache/tempo
+    text files were keyed by a hash of the upload's temporary path, which no
+    lookup can produce, so they are deleted without importing, along with any
+    legacy-<hash> records an earlier migration made of them. Safe to run
+    repeatedly and from several processes at once; returns the number of
+    records imported.
+    """
+    imported = 0
+    
+    for path in glob.glob(os.path.join(cache_dir, "analysis", "*.json")):
+        # Renaming claims the file, so concurrent migrations import each record once
+        claimed = f"{path}.{os.getpid()}.migrating"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue
+        try:
+            with open(claimed) as f:
+                store.put(os.path.basename(path)[:-len(".json")], json.load(f))
+            imported += 1
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Skipping unreadable cache entry {path}: {e}")
+        _unlink(claimed)
+    
+    for stage in ("analysis", "chord", "key", "tempo"):
+        directory = os.path.join(cache_dir, stage)
+        for path in glob.glob(os.path.join(directory, "*.txt")):
+            _unlink(path)
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+    
+    legacy = store.delete_prefix("legacy-")
+    if legacy:
+        logger.info(f"Deleted {legacy} unreachable legacy record(s) from {store.db_path}")
+    if imported:
+        logger.info(f"Migrated {imported} cached analysis record(s) into {store.db_path}")
+    return imported
+
+if __name__ == "__main__":
+    import sys
+    
+    cache_dir = sys.argv[1] if len(sys.argv) > 1 else os.getenv("DECHORD_CACHE_DIR", "cache")
+    result_store = ResultStore(os.path.join(cache_dir, "results.db"))
+    print(f"Imported {migrate_file_caches(cache_dir, result_store)} record(s); store: {result_store.stats()}")
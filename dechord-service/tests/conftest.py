@@ -0,0 +1,12 @@
+"""
+Test setup - PhinAccords
+Heavenkeys Ltd
+
+Puts the service's modules on the import path, as when it runs from its own
+directory. Run the tests from there with `python -m pytest tests`.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,33 @@
+"""
+Fake YouTube Fetcher - PhinAccords
+Heavenkeys Ltd
+
+Stands in for yt-dlp in tests: select it with YOUTUBE_FETCHER=fake_fetcher:FakeFetcher
+(with this directory on the import path). Writes a few bytes of placeholder
+audio instead of downloading and records the URLs it was asked for.
+"""
+
+import threading
+import time
+
+class FakeFetcher:
+    # URLs fetched by every instance, in order
+    calls = []
+    # Seconds each fetch takes, to let concurrent callers overlap
+    delay = 0.0
+    # Raised instead of fetching, if set
+    error = None
+    _lock = threading.Lock()
+    
+    def fetch(self, url: str, output_stem: str) -> tuple:
+        with self._lock:
+            self.calls.append(url)
+        time.sleep(self.delay)
+        # Like yt-dlp, a failed download can leave a partial file behind
+        with open(output_stem + ".webm.part", "wb") as f:
+            f.write(b"partial")
+        if self.error is not None:
+            raise self.error
+        with open(output_stem + ".webm", "wb") as f:
+            f.write(b"\0" * 1000)
+        return output_stem + ".webm", f"Video {url[-11:]}"
@@ -0,0 +1,132 @@
+"""
+Admission Control Tests - PhinAccords
+Heavenkeys Ltd
+
+admission.py is shared with python-service; these tests cover both copies.
+"""
+
+import asyncio
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from admission import AdmissionController, AdmissionMiddleware, Rejected, client_id
+
+async def hold(controller: AdmissionController, client: str, release: asyncio.Event, log: list, name: str):
+    async with controller.admit(client):
+        log.append(name)
+        await release.wait()
+
+def test_requests_beyond_active_places_wait_in_arrival_order():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queued=2)
+        release = {name: asyncio.Event() for name in "abc"}
+        log = []
+        tasks = [asyncio.create_task(hold(controller, "client", release[name], log, name)) for name in "abc"]
+        await asyncio.sleep(0)
+        assert (log, controller.active, controller.queued) == (["a"], 1, 2)
+        
+        release["a"].set()
+        await asyncio.sleep(0.01)
+        assert (log, controller.active, controller.queued) == (["a", "b"], 1, 1)
+        release["b"].set()
+        release["c"].set()
+        await asyncio.gather(*tasks)
+        assert (log, controller.active, controller.queued, controller.clients) == (["a", "b", "c"], 0, 0, {})
+    
+    asyncio.run(scenario())
+
+def test_full_queue_rejects_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queued=1)
+        controller.service_seconds = 40.0
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(hold(controller, "client", release, [], name)) for name in "ab"]
+        await asyncio.sleep(0)
+        
+        with pytest.raises(Rejected) as rejected:
+            async with controller.admit("client"):
+                pass
+        # Two requests ahead at 40 s each on one place
+        assert (rejected.value.reason, rejected.value.retry_after) == ("queue_full", 80)
+        release.set()
+        await asyncio.gather(*tasks)
+    
+    asyncio.run(scenario())
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queued=2)
+        release = asyncio.Event()
+        log = []
+        running = asyncio.create_task(hold(controller, "a", release, log, "a"))
+        waiting = asyncio.create_task(hold(controller, "b", release, log, "b"))
+        after = asyncio.create_task(hold(controller, "c", release, log, "c"))
+        await asyncio.sleep(0)
+        
+        waiting.cancel()
+        await asyncio.sleep(0)
+        assert controller.queued == 1 and "b" not in controller.clients
+        release.set()
+        await asyncio.gather(running, after)
+        assert log == ["a", "c"] and controller.active == 0
+    
+    asyncio.run(scenario())
+
+def test_place_handed_to_a_cancelled_waiter_passes_on():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queued=2)
+        log = []
+        async with controller.admit("a"):
+            waiting = asyncio.create_task(hold(controller, "b", asyncio.Event(), log, "b"))
+            after = asyncio.create_task(hold(controller, "c", asyncio.Event(), log, "c"))
+            await asyncio.sleep(0)
+        # "b" has been handed the place but is cancelled before it resumes
+        waiting.cancel()
+        await asyncio.sleep(0.01)
+        assert log == ["c"] and controller.active == 1
+        
+        after.cancel()
+        await asyncio.gather(waiting, after, return_exceptions=True)
+        assert (controller.active, controller.queued, controller.clients) == (0, 0, {})
+    
+    asyncio.run(scenario())
+
+def test_client_limit_rejects_only_that_client():
+    async def scenario():
+        controller = AdmissionController(max_active=2, max_queued=2, max_per_client=1)
+        release = asyncio.Event()
+        task = asyncio.create_task(hold(controller, "busy", release, [], "busy"))
+        await asyncio.sleep(0)
+        
+        with pytest.raises(Rejected) as rejected:
+            async with controller.admit("busy"):
+                pass
+        assert rejected.value.reason == "client_limit"
+        async with controller.admit("other"):
+            pass
+        release.set()
+        await task
+    
+    asyncio.run(scenario())
+
+def test_middleware_answers_429_with_retry_after():
+    async def analyze(request):
+        return PlainTextResponse("done")
+    
+    app = Starlette(routes=[Route("/analyze", analyze, methods=["GET", "POST"])])
+    app.add_middleware(AdmissionMiddleware, controller=AdmissionController(0, 0), paths=["/analyze"])
+    client = TestClient(app)
+    
+    response = client.post("/analyze")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+    # Other methods pass straight through
+    assert client.get("/analyze").text == "done"
+
+def test_client_id_prefers_first_forwarded_address():
+    scope = {"headers": [(b"x-forwarded-for", b"203.0.113.7, 10.0.0.1")], "client": ("10.0.0.2", 5000)}
+    assert client_id(scope) == "203.0.113.7"
+    assert client_id({"headers": [], "client": ("10.0.0.2", 5000)}) == "10.0.0.2"
@@ -0,0 +1,25 @@
+"""
+Chord Template Matching Tests - PhinAccords
+Heavenkeys Ltd
+
+chord_templates.py is shared with python-service; these tests cover both copies.
+"""
+
+import numpy as np
+
+from chord_templates import CHORD_NAMES, NO_CHORD, match_chords
+
+def triad_chroma(root: int, minor: bool, noise: float = 0.0, seed: int = 0) -> np.ndarray:
+    column = np.full(12, noise) * np.random.default_rng(seed).random(12)
+    column[[root, (root + (3 if minor else 4)) % 12, (root + 7) % 12]] += 1.0
+    return column
+
+def test_every_triad_matches_its_own_template():
+    chroma = np.stack([triad_chroma(root, minor, noise=0.3, seed=root)
+                       for minor in (False, True) for root in range(12)], axis=1)
+    assert [CHORD_NAMES[i] for i in match_chords(chroma)] == CHORD_NAMES
+
+def test_silent_and_ambiguous_frames_match_no_chord():
+    chroma = np.stack([np.zeros(12), np.ones(12), triad_chroma(7, False)], axis=1)
+    assert match_chords(chroma).tolist() == [NO_CHORD, NO_CHORD, CHORD_NAMES.index("G")]
+    assert match_chords(np.zeros((12, 0))).shape == (0,)
@@ -0,0 +1,90 @@
+"""
+Chord Chart View Tests - PhinAccords
+Heavenkeys Ltd
+
+chord_views.py is shared with python-service; these tests cover both copies.
+"""
+
+import pytest
+
+from chord_views import (
+    ViewCache, chord_view, key_spelling, quantize_to_bars, simplify_label, tempo_bars,
+    transpose_key, transpose_label, validate_variant,
+)
+
+@pytest.mark.parametrize("label, semitones, spelling, expected", [
+    ("C", 2, "sharp", "D"),
+    ("A:min", 3, "sharp", "C:min"),
+    ("C#m7", 1, "flat", "Dm7"),
+    ("Bb/D", 2, "sharp", "C/E"),
+    ("F#m7b5", -1, "sharp", "Fm7b5"),
+    ("N", 5, "sharp", "N"),
+])
+def test_transpose_label(label, semitones, spelling, expected):
+    assert transpose_label(label, semitones, spelling) == expected
+
+def test_transpose_key_keeps_its_style():
+    assert transpose_key("A minor", 2, "sharp") == "B minor"
+    assert transpose_key("Am", 1, "flat") == "Bbm"
+    assert transpose_key("C", -1, "sharp") == "B"
+    assert transpose_key("unknown", 3, "sharp") == "unknown"
+
+def test_key_spelling_follows_the_transposed_key():
+    assert key_spelling("C", 5) == "flat"
+    assert key_spelling("C", 7) == "sharp"
+    assert key_spelling("Am", 5) == "flat"
+    assert key_spelling("?", 1) == "sharp"
+
+@pytest.mark.parametrize("label, vocabulary, expected", [
+    ("Cmaj7", "full", "Cmaj7"),
+    ("Cmaj7", "majmin", "C"),
+    ("Am7", "majmin", "Am"),
+    ("Bdim", "majmin", "Bm"),
+    ("G9", "sevenths", "G7"),
+    ("Dm11", "sevenths", "Dm7"),
+    ("Fmaj9", "sevenths", "Fmaj7"),
+    ("CmM7", "sevenths", "Cm"),
+    ("Bdim7", "sevenths", "Bm"),
+    ("Esus4", "sevenths", "E"),
+    ("N", "majmin", "N"),
+])
+def test_simplify_label(label, vocabulary, expected):
+    assert simplify_label(label, vocabulary) == expected
+
+def test_quantize_to_bars_keeps_the_longest_chord_of_each_bar():
+    segments = [(0.0, 1.0, "C"), (1.0, 2.2, "G"), (2.2, 2.6, "G"), (2.6, 4.0, "Am")]
+    assert quantize_to_bars(segments, [0.5, 2.5], 4.0) == [
+        (0.0, 0.5, "C"), (0.5, 2.5, "G"), (2.5, 4.0, "Am")
+    ]
+    # Neighbouring bars with the same chord merge
+    assert quantize_to_bars([(0.0, 4.0, "F")], [1.0, 2.0, 3.0], 4.0) == [(0.0, 4.0, "F")]
+
+def test_tempo_bars_start_on_the_first_onset():
+    assert tempo_bars(120.0, 0.5, 8.0) == [0.5, 2.5, 4.5, 6.5]
+    assert tempo_bars(0.0, 0.5, 8.0) == []
+
+def test_chord_view_with_capo_names_the_shapes_to_play():
+    segments = [(0.0, 2.0, "G"), (2.0, 4.0, "D/F#"), (4.0, 6.0, "Em7")]
+    view = chord_view(segments, "G", capo=2)
+    assert view == {"key": "F", "chords": [(0.0, 2.0, "F"), (2.0, 4.0, "C/E"), (4.0, 6.0, "Dm7")]}
+
+def test_chord_view_merges_chords_that_become_equal():
+    segments = [(0.0, 1.0, "Am7"), (1.0, 2.0, "Am"), (2.0, 3.0, "E7")]
+    view = chord_view(segments, "Am", transpose=1, simplify="majmin")
+    assert view == {"key": "Bbm", "chords": [(0.0, 2.0, "Bbm"), (2.0, 3.0, "F")]}
+
+def test_validate_variant():
+    validate_variant(0, "full", "none", "auto")
+    for args in ((12, "full", "none", "auto"), (0, "jazz", "none", "auto"),
+                 (0, "full", "beat", "auto"), (0, "full", "none", "double")):
+        with pytest.raises(ValueError):
+            validate_variant(*args)
+
+def test_view_cache_evicts_least_recently_used():
+    cache = ViewCache(max_entries=2)
+    cache.put(("a", 0), "A")
+    cache.put(("b", 0), "B")
+    assert cache.get(("a", 0)) == "A"
+    cache.put(("c", 0), "C")
+    assert cache.get(("b", 0)) is None
+    assert (cache.get(("a", 0)), cache.get(("c", 0))) == ("A", "C")
@@ -0,0 +1,75 @@
+"""
+Fingerprint Index Tests - PhinAccords
+Heavenkeys Ltd
+"""
+
+import numpy as np
+import pytest
+
+from fingerprint import FingerprintIndex, FINGERPRINT_FPS, probe_starts, shift_record
+
+def synthetic_chroma(seconds: float, seed: int) -> np.ndarray:
+    """Unit-norm chroma of a chord progression: a random pitch-class mix held for 1-3 s each"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    while len(frames) < seconds * FINGERPRINT_FPS:
+        mix = rng.random(12) ** 4
+        for _ in range(int(rng.integers(1, 4)) * FINGERPRINT_FPS):
+            frames.append(mix + 0.02 * rng.random(12))
+    chroma = np.array(frames[:int(seconds * FINGERPRINT_FPS)]).T
+    return (chroma / np.linalg.norm(chroma, axis=0, keepdims=True)).astype(np.float16)
+
+@pytest.fixture
+def index(tmp_path):
+    index = FingerprintIndex(str(tmp_path / "fingerprints.db"))
+    index.add("track-a", synthetic_chroma(120, seed=1), 120.0)
+    index.add("track-b", synthetic_chroma(90, seed=2), 90.0)
+    return index
+
+def test_matches_excerpt_at_its_offset(index):
+    track = synthetic_chroma(120, seed=1)
+    start = 40 * FINGERPRINT_FPS
+    query = track[:, start:start + 30 * FINGERPRINT_FPS]
+    probes = [(20.0, track[:, start + 20 * FINGERPRINT_FPS:start + 30 * FINGERPRINT_FPS])]
+    
+    match = index.match(query, 50.0, probes)
+    assert match["key"] == "track-a"
+    assert match["offset"] == 40.0
+    assert match["similarity"] > 0.99
+
+def test_unrelated_recording_does_not_match(index):
+    assert index.match(synthetic_chroma(30, seed=3), 30.0) is None
+
+def test_recording_longer_than_the_stored_track_does_not_match(index):
+    track = synthetic_chroma(120, seed=1)
+    assert index.match(track[:, 100 * FINGERPRINT_FPS:], 60.0) is None
+
+def test_probe_that_differs_rejects_the_match(index):
+    track = synthetic_chroma(120, seed=1)
+    probes = [(20.0, synthetic_chroma(10, seed=4))]
+    assert index.match(track[:, :30 * FINGERPRINT_FPS], 60.0, probes) is None
+
+def test_removed_track_no_longer_matches(index):
+    index.remove("track-b")
+    assert index.match(synthetic_chroma(90, seed=2)[:, :30 * FINGERPRINT_FPS], 30.0) is None
+
+def test_oldest_tracks_are_dropped_beyond_max_tracks(tmp_path):
+    index = FingerprintIndex(str(tmp_path / "fingerprints.db"), max_tracks=1)
+    first, second = synthetic_chroma(60, seed=5), synthetic_chroma(60, seed=6)
+    index.add("first", first, 60.0)
+    index.add("second", second, 60.0)
+    
+    assert index.match(first[:, :30 * FINGERPRINT_FPS], 30.0) is None
+    assert index.match(second[:, :30 * FINGERPRINT_FPS], 30.0)["key"] == "second"
+
+def test_probe_starts_cover_middle_and_end_of_long_uploads():
+    assert probe_starts(20.0) == []
+    assert probe_starts(100.0) == [45.0, 90.0]
+
+def test_shift_record_clips_chords_to_the_recording():
+    record = {"chords": [[0.0, 5.0, "C"], [5.0, 12.0, "G"], [12.0, 20.0, "Am"]],
+              "key": "C", "tempo": 100.0, "duration": 20.0, "title": "Song"}
+    
+    shifted = shift_record(record, 6.0, 10.0)
+    assert shifted["chords"] == [[0.0, 6.0, "G"], [6.0, 10.0, "Am"]]
+    assert shifted["duration"] == 10.0
@@ -0,0 +1,56 @@
+"""
+Analysis Pipeline Tests - PhinAccords
+Heavenkeys Ltd
+
+Only the parts that need no model; importing the pipeline still needs madmom installed.
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("madmom")
+
+import pipeline
+
+def held(column: np.ndarray, frames: int) -> np.ndarray:
+    return np.repeat(column[:, None], frames, axis=1)
+
+def triad(*pitch_classes: int) -> np.ndarray:
+    column = np.zeros(12)
+    column[list(pitch_classes)] = 1.0
+    return column
+
+def test_preview_chords_are_segments_of_matched_frames():
+    chroma = np.concatenate([held(triad(0, 4, 7), 20), np.zeros((12, 10)), held(triad(9, 0, 4), 20)], axis=1)
+    # Smoothing carries each chord a few frames into the silence
+    spread = pipeline.PREVIEW_SMOOTHING_FRAMES // 2
+    assert pipeline.match_chord_templates(chroma, fps=10.0) == [
+        (0.0, (20 + spread) / 10, "C"), ((20 + spread) / 10, (30 - spread) / 10, "N"), ((30 - spread) / 10, 5.0, "Am")
+    ]
+
+def test_key_from_chroma_profile_of_a_progression():
+    # I-IV-V-I in G major
+    chroma = np.concatenate([held(triad(7, 11, 2), 30), held(triad(0, 4, 7), 10),
+                             held(triad(2, 6, 9), 10), held(triad(7, 11, 2), 30)], axis=1)
+    assert pipeline.estimate_key_from_chroma(chroma) == "G major"
+
+def test_plan_windows_tile_the_signal_on_the_hop_grid():
+    hop = pipeline.CHORD_HOP_SIZE
+    num_samples = 95 * hop * 10 + 123
+    windows = pipeline.plan_windows(num_samples, 30.0, 3.0, hop)
+    assert windows[0]["core_start"] == 0 and windows[-1]["core_stop"] == num_samples
+    for before, after in zip(windows, windows[1:]):
+        assert before["core_stop"] == after["core_start"] and after["core_start"] % hop == 0
+        assert after["start"] < after["core_start"] and before["stop"] > before["core_stop"]
+
+def test_window_core_frames_stitch_into_the_whole_signals_frames():
+    hop = pipeline.CHORD_HOP_SIZE
+    num_samples = 95 * hop * 10 + 123
+    # madmom centres frame i on sample i * hop, so a signal has ceil(samples / hop) frames
+    whole = np.arange(-(-num_samples // hop))
+    
+    stitched = []
+    for window in pipeline.plan_windows(num_samples, 30.0, 3.0, hop):
+        window_frames = whole[window["start"] // hop:-(-window["stop"] // hop)]
+        stitched.extend(pipeline.core_frames(window_frames, window, hop).tolist())
+    assert stitched == whole.tolist()
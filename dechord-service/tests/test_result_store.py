@@ -0,0 +1,115 @@
+"""
+Result Store Tests - PhinAccords
+Heavenkeys Ltd
+"""
+
+import os
+import json
+import pytest
+
+import result_store
+from result_store import ResultStore, migrate_file_caches
+
+def make_record(chords, key="C", title=None):
+    return {"chords": chords, "key": key, "tempo": 120.0, "duration": 10.0, "title": title}
+
+class Clock:
+    """Stands in for time.time so tests decide when records are written and read"""
+    
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+    
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_store.time, "time", clock)
+    return clock
+
+def test_round_trip_keeps_labels_with_commas(tmp_path):
+    store = ResultStore(str(tmp_path / "results.db"))
+    chords = [[0.0, 1.5, "A:min7,b9"], [1.5, 3.25, "C,E"], [3.25, 10.0, "N"]]
+    store.put("track", make_record(chords, key="A minor", title="Song, live"))
+    
+    assert store.get("track") == {
+        "chords": chords, "key": "A minor", "tempo": 120.0, "duration": 10.0, "title": "Song, live"
+    }
+
+def test_labels_are_shared_between_store_instances(tmp_path):
+    path = str(tmp_path / "results.db")
+    ResultStore(path).put("first", make_record([[0.0, 1.0, "G"], [1.0, 2.0, "Em"]]))
+    
+    other = ResultStore(path)
+    other.put("second", make_record([[0.0, 1.0, "Em"], [1.0, 2.0, "D7"]]))
+    assert [c[2] for c in other.get("first")["chords"]] == ["G", "Em"]
+    assert [c[2] for c in ResultStore(path).get("second")["chords"]] == ["Em", "D7"]
+
+def test_missing_key_is_none(tmp_path):
+    assert ResultStore(str(tmp_path / "results.db")).get("nope") is None
+
+def test_put_replaces_record(tmp_path):
+    store = ResultStore(str(tmp_path / "results.db"))
+    store.put("track", make_record([[0.0, 1.0, "C"]]))
+    store.put("track", make_record([[0.0, 2.0, "D"]], key="D"))
+    
+    assert store.get("track")["chords"] == [[0.0, 2.0, "D"]]
+    assert store.stats()["records"] == 1
+
+def test_records_expire_after_ttl(tmp_path, clock):
+    store = ResultStore(str(tmp_path / "results.db"), ttl_seconds=60)
+    store.put("track", make_record([[0.0, 1.0, "C"]]))
+    
+    clock.now += 59
+    assert store.get("track") is not None
+    clock.now += 2
+    assert store.get("track") is None
+    assert store.stats()["records"] == 0
+
+def test_eviction_drops_least_recently_used(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(result_store, "TOUCH_INTERVAL_SECONDS", 0)
+    record = make_record([[0.0, 1.0, "C"]])
+    store = ResultStore(str(tmp_path / "results.db"), max_bytes=0)
+    store.put("a", record)
+    record_size = store.stats()["bytes"]
+    store.max_bytes = 2 * record_size
+    
+    clock.now += 1
+    store.put("b", record)
+    clock.now += 1
+    # Reading "a" makes "b" the least recently used
+    assert store.get("a") is not None
+    clock.now += 1
+    store.put("c", record)
+    
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+    assert store.stats() == {"records": 2, "bytes": 2 * record_size}
+
+def test_delete_prefix(tmp_path):
+    store = ResultStore(str(tmp_path / "results.db"))
+    for key in ("legacy-1", "legacy-2", "legacyx", "abc"):
+        store.put(key, make_record([[0.0, 1.0, "C"]]))
+    
+    assert store.delete_prefix("legacy-") == 2
+    assert store.get("legacyx") is not None and store.get("abc") is not None
+
+def test_migration_imports_analysis_records_and_deletes_legacy_files(tmp_path):
+    cache_dir = tmp_path / "cache"
+    for stage in ("analysis", "chord", "key", "tempo"):
+        (cache_dir / stage).mkdir(parents=True)
+    record = make_record([[0.0, 2.0, "F"], [2.0, 4.0, "Bb"]], key="F major", title="Song")
+    (cache_dir / "analysis" / "hash1.json").write_text(json.dumps(record))
+    (cache_dir / "analysis" / "broken.json").write_text("{not json")
+    (cache_dir / "chord" / "tmp-hash.txt").write_text("0.0 2.0 F\n")
+    (cache_dir / "key" / "tmp-hash.txt").write_text("F major")
+    store = ResultStore(str(cache_dir / "results.db"))
+    store.put("legacy-tmp-hash", make_record([[0.0, 2.0, "F"]]))
+    
+    assert migrate_file_caches(str(cache_dir), store) == 1
+    assert store.get("hash1") == record
+    assert store.get("legacy-tmp-hash") is None
+    assert not [name for name in os.listdir(cache_dir) if not name.startswith("results.db")]
+    # Running again finds nothing left to import
+    assert migrate_file_caches(str(cache_dir), store) == 0
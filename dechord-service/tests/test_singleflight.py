@@ -0,0 +1,113 @@
+"""
+In-flight Request Coalescing Tests - PhinAccords
+Heavenkeys Ltd
+
+singleflight.py is shared with python-service; these tests cover both copies.
+"""
+
+import asyncio
+import pytest
+
+from singleflight import SingleFlight, ClientDisconnected
+
+class DisconnectingRequest:
+    """Just enough of a Request for SingleFlight: its client leaves once left is set"""
+    
+    def __init__(self):
+        self.left = asyncio.Event()
+    
+    async def receive(self):
+        await self.left.wait()
+        return {"type": "http.disconnect"}
+
+def test_concurrent_calls_share_one_run():
+    async def scenario():
+        flights = SingleFlight()
+        calls = []
+        
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+        
+        results = await asyncio.gather(*(flights.run("key", compute) for _ in range(3)))
+        assert results == ["result"] * 3 and len(calls) == 1
+        assert flights.waiter_counts() == {}
+        # A later call starts a new run
+        assert await flights.run("key", compute) == "result" and len(calls) == 2
+    
+    asyncio.run(scenario())
+
+def test_different_keys_run_separately():
+    async def scenario():
+        flights = SingleFlight()
+        
+        async def compute(value):
+            await asyncio.sleep(0.01)
+            return value
+        
+        assert await asyncio.gather(flights.run("a", lambda: compute(1)), flights.run("b", lambda: compute(2))) == [1, 2]
+    
+    asyncio.run(scenario())
+
+def test_errors_reach_every_waiter():
+    async def scenario():
+        flights = SingleFlight()
+        
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("bad audio")
+        
+        results = await asyncio.gather(*(flights.run("key", fail) for _ in range(2)), return_exceptions=True)
+        assert [str(r) for r in results] == ["bad audio", "bad audio"]
+    
+    asyncio.run(scenario())
+
+def test_disconnected_waiter_leaves_the_run_to_the_others():
+    async def scenario():
+        flights = SingleFlight()
+        finish = asyncio.Event()
+        
+        async def compute():
+            await finish.wait()
+            return "result"
+        
+        request = DisconnectingRequest()
+        leaving = asyncio.create_task(flights.run("key", compute, request))
+        staying = asyncio.create_task(flights.run("key", compute))
+        await asyncio.sleep(0)
+        assert flights.waiter_counts() == {"key": 2}
+        
+        request.left.set()
+        with pytest.raises(ClientDisconnected):
+            await leaving
+        assert flights.waiter_counts() == {"key": 1}
+        finish.set()
+        assert await staying == "result"
+    
+    asyncio.run(scenario())
+
+def test_run_is_cancelled_once_every_waiter_leaves():
+    async def scenario():
+        flights = SingleFlight()
+        cancelled = asyncio.Event()
+        
+        async def compute():
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        
+        requests = [DisconnectingRequest(), DisconnectingRequest()]
+        waiters = [asyncio.create_task(flights.run("key", compute, request)) for request in requests]
+        await asyncio.sleep(0)
+        for request in requests:
+            request.left.set()
+        
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert all(isinstance(r, ClientDisconnected) for r in results)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flights.waiter_counts() == {}
+    
+    asyncio.run(scenario())
@@ -0,0 +1,68 @@
+"""
+YouTube Audio Cache Tests - PhinAccords
+Heavenkeys Ltd
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+import youtube_cache
+from youtube_cache import YouTubeAudioCache, cache_key
+from fake_fetcher import FakeFetcher
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+@pytest.fixture
+def fetcher(monkeypatch):
+    monkeypatch.setattr(youtube_cache, "YOUTUBE_FETCHER", "fake_fetcher:FakeFetcher")
+    monkeypatch.setattr(FakeFetcher, "calls", [])
+    return FakeFetcher
+
+def test_fetcher_is_loaded_from_the_setting(fetcher):
+    assert isinstance(youtube_cache.load_fetcher(), FakeFetcher)
+
+def test_cache_key_uses_the_video_id():
+    assert cache_key(URL) == cache_key("https://youtu.be/dQw4w9WgXcQ") == "youtube-dQw4w9WgXcQ"
+    assert cache_key("https://example.com/song.mp3").startswith("url-")
+
+def test_second_request_is_served_from_the_cache(tmp_path, fetcher):
+    cache = YouTubeAudioCache(str(tmp_path), max_bytes=0)
+    path, title = cache.get(URL)
+    
+    assert (os.path.basename(path), title) == ("youtube-dQw4w9WgXcQ.webm", "Video dQw4w9WgXcQ")
+    assert cache.get("https://youtu.be/dQw4w9WgXcQ") == (path, title)
+    assert fetcher.calls == [URL]
+
+def test_concurrent_requests_share_one_download(tmp_path, fetcher, monkeypatch):
+    monkeypatch.setattr(FakeFetcher, "delay", 0.2)
+    cache = YouTubeAudioCache(str(tmp_path), max_bytes=0)
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: cache.get(URL), range(4)))
+    
+    assert len(set(results)) == 1
+    assert fetcher.calls == [URL]
+
+def test_failed_download_leaves_no_partial_files(tmp_path, fetcher, monkeypatch):
+    monkeypatch.setattr(FakeFetcher, "error", RuntimeError("video unavailable"))
+    cache = YouTubeAudioCache(str(tmp_path), max_bytes=0)
+    with pytest.raises(RuntimeError):
+        cache.get(URL)
+    assert os.listdir(tmp_path) == [".locks"]
+
+def test_least_recently_used_audio_is_evicted(tmp_path, fetcher, monkeypatch):
+    monkeypatch.setattr(youtube_cache, "EVICTION_GRACE_SECONDS", 0)
+    cache = YouTubeAudioCache(str(tmp_path), max_bytes=2500)
+    urls = [f"https://youtu.be/video{i:06d}" for i in range(3)]
+    first, _ = cache.get(urls[0])
+    second, _ = cache.get(urls[1])
+    now = time.time()
+    os.utime(first, (now - 100, now - 100))
+    os.utime(second, (now - 50, now - 50))
+    # A hit makes the first the most recently used again
+    cache.get(urls[0])
+    cache.get(urls[2])
+    
+    assert os.path.exists(first) and not os.path.exists(second)
+    assert len(fetcher.calls) == 3
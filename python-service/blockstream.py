@@ -0,0 +1,199 @@
+"""
+Block-Streaming Audio Features - PhinAccords
+Heavenkeys Ltd
+
+Reads audio in fixed blocks and frames it exactly as librosa frames a whole
+signal, so spectral features of a long recording can be computed with memory
+that stays flat with its length. Blocks are mono-mixed and resampled as a
+stream (as librosa.load does in one go), and STFT blocks overlap by
+n_fft - hop_length samples with the same zero padding as centred framing.
+"""
+
+import tempfile
+from typing import Iterator, List
+import numpy as np
+
+from lazy_imports import lazy_import
+
+librosa = lazy_import("librosa")
+soundfile = lazy_import("soundfile")
+soxr = lazy_import("soxr")
+
+# Samples read from the file per block
+READ_BLOCK_SIZE = 65536
+# STFT frames computed per block
+STFT_BLOCK_FRAMES = 1024
+# Pitch peaks read back per chunk when estimating tuning
+SPILL_CHUNK_SIZE = 1 << 20
+TUNING_RESOLUTION = 0.01
+# Tuning histogram bin edges, in fractions of a semitone
+TUNING_EDGES = np.linspace(-0.5, 0.5, int(np.ceil(1.0 / TUNING_RESOLUTION)) + 1)
+
+# One spilled pitch peak: its magnitude and its tuning histogram bin
+SPILL_DTYPE = np.dtype([("mag", "<f4"), ("bin", "<u1")])
+
+def can_stream(audio_path: str) -> bool:
+    """Whether libsndfile can read the file block by block"""
+    try:
+        soundfile.info(audio_path)
+        return True
+    except Exception:
+        return False
+
+def read_blocks(audio_path: str, sr: int) -> Iterator[np.ndarray]:
+    """
+    Mono float32 blocks of an audio file at sr, which concatenated equal
+    librosa.load(audio_path, sr=sr)
+    """
+    with soundfile.SoundFile(audio_path) as f:
+        native_sr = f.samplerate
+        resampler = None
+        if native_sr != sr:
+            resampler = soxr.ResampleStream(native_sr, sr, 1, dtype="float32", quality="HQ")
+        # librosa.resample pads or trims its output to this length
+        expected = int(np.ceil(f.frames * sr / native_sr))
+        produced = 0
+        
+        for block in f.blocks(blocksize=READ_BLOCK_SIZE, dtype="float32", always_2d=True):
+            y = librosa.to_mono(block.T)
+            if resampler is not None:
+                y = resampler.resample_chunk(y)
+            y = y[:expected - produced]
+            produced += len(y)
+            if len(y):
+                yield y
+        
+        if resampler is not None:
+            y = resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)[:expected - produced]
+            produced += len(y)
+            if len(y):
+                yield y
+        if produced < expected:
+            yield np.zeros(expected - produced, dtype=np.float32)
+
+class BlockSTFT:
+    """
+    Power spectrogram of a signal pushed in blocks, as consecutive blocks of
+    frames that together equal np.abs(librosa.stft(y, n_fft, hop_length)) ** 2
+    """
+    
+    def __init__(self, n_fft: int, hop_length: int):
+        self.n_fft, self.hop_length = n_fft, hop_length
+        # Centred framing pads the signal with n_fft // 2 zeros at each end
+        self.buffer = np.zeros(n_fft // 2, dtype=np.float32)
+        self.block_samples = (STFT_BLOCK_FRAMES - 1) * hop_length + n_fft
+    
+    def _power(self, samples: np.ndarray) -> np.ndarray:
+        return np.abs(librosa.stft(samples, n_fft=self.n_fft, hop_length=self.hop_length, center=False)) ** 2
+    
+    def push(self, y: np.ndarray) -> List[np.ndarray]:
+        """Append samples; returns the spectrogram blocks completed by them"""
+        self.buffer = np.concatenate((self.buffer, y.astype(np.float32, copy=False)))
+        blocks = []
+        while len(self.buffer) >= self.block_samples:
+            blocks.append(self._power(self.buffer[:self.block_samples]))
+            self.buffer = self.buffer[STFT_BLOCK_FRAMES * self.hop_length:]
+        return blocks
+    
+    def finish(self) -> List[np.ndarray]:
+        """The remaining frames, up to the end of the padded signal"""
+        self.buffer = np.concatenate((self.buffer, np.zeros(self.n_fft // 2, dtype=np.float32)))
+        if len(self.buffer) < self.n_fft:
+            return []
+        count = (len(self.buffer) - self.n_fft) // self.hop_length + 1
+        block = self._power(self.buffer[:(count - 1) * self.hop_length + self.n_fft])
+        self.buffer = self.buffer[:0]
+        return [block]
+
+def power_spectrogram_blocks(audio_path: str, sr: int, n_fft: int, hop_length: int) -> Iterator[np.ndarray]:
+    stft = BlockSTFT(n_fft, hop_length)
+    for y in read_blocks(audio_path, sr):
+        yield from stft.push(y)
+    yield from stft.finish()
+
+def _sortable(values: np.ndarray) -> np.ndarray:
+    """uint32 keys that sort like the float32 values"""
+    bits = values.astype(np.float32).view(np.uint32)
+    return bits ^ np.where(bits >> 31, np.uint32(0xFFFFFFFF), np.uint32(0x80000000))
+
+def _tuning_bins(pitch: np.ndarray) -> np.ndarray:
+    """Tuning histogram bin of each pitch (Hz), binned as librosa.pitch_tuning bins them"""
+    residual = np.mod(12 * librosa.hz_to_octs(pitch), 1.0)
+    residual[residual >= 0.5] -= 1.0
+    return np.clip(np.searchsorted(TUNING_EDGES, residual, side="right") - 1, 0, len(TUNING_EDGES) - 2)
+
+def tuning_histogram(S: np.ndarray, sr: int) -> np.ndarray:
+    """
+    Pitch deviation histogram of a power spectrogram's pitch peaks at or above
+    their median magnitude, as librosa.estimate_tuning builds it. Histograms of
+    consecutive blocks can be summed and passed to tuning_from_histogram; the
+    median is then each block's rather than the whole track's
+    """
+    pitch, mag = librosa.piptrack(S=S, sr=sr)
+    voiced = pitch > 0
+    if not np.any(voiced):
+        return np.zeros(len(TUNING_EDGES) - 1, dtype=np.int64)
+    strong = voiced & (mag >= np.median(mag[voiced]))
+    return np.bincount(_tuning_bins(pitch[strong]), minlength=len(TUNING_EDGES) - 1)
+
+def tuning_from_histogram(histogram: np.ndarray) -> float:
+    """Tuning deviation at the peak of a tuning histogram (0 if it is empty)"""
+    if not np.any(histogram):
+        return 0.0
+    return float(TUNING_EDGES[np.argmax(histogram)])
+
+def estimate_tuning(audio_path: str, sr: int, n_fft: int, hop_length: int) -> float:
+    """
+    librosa.estimate_tuning of the whole track's power spectrogram (what
+    chroma_stft uses when no tuning is given), computed block by block
+    Pitch peaks go to a temporary file; their median magnitude is then found
+    with a 16-bit radix pass over it, so the result is exactly librosa's
+    """
+    num_bins = len(TUNING_EDGES) - 1
+    
+    with tempfile.TemporaryFile() as spill:
+        total = 0
+        for S in power_spectrogram_blocks(audio_path, sr, n_fft, hop_length):
+            pitch, mag = librosa.piptrack(S=S, sr=sr)
+            voiced = pitch > 0
+            peaks = np.empty(int(voiced.sum()), dtype=SPILL_DTYPE)
+            peaks["mag"] = mag[voiced]
+            peaks["bin"] = _tuning_bins(pitch[voiced])
+            peaks.tofile(spill)
+            total += len(peaks)
+        if not total:
+            return 0.0
+        
+        def chunks():
+            spill.seek(0)
+            while True:
+                chunk = np.fromfile(spill, dtype=SPILL_DTYPE, count=SPILL_CHUNK_SIZE)
+                if not len(chunk):
+                    return
+                yield chunk
+        
+        # First pass: which high-16-bit buckets hold the two middle magnitudes
+        counts = np.zeros(1 << 16, dtype=np.int64)
+        for chunk in chunks():
+            counts += np.bincount(_sortable(chunk["mag"]) >> 16, minlength=1 << 16)
+        cumulative = np.cumsum(counts)
+        ranks = ((total - 1) // 2, total // 2)
+        low, high = (int(np.searchsorted(cumulative, rank, side="right")) for rank in ranks)
+        below = int(cumulative[low - 1]) if low else 0
+        
+        # Second pass: peaks above those buckets all count; the ones inside are kept to compare exactly
+        histogram = np.zeros(num_bins, dtype=np.int64)
+        middle_mags, middle_bins = [], []
+        for chunk in chunks():
+            buckets = _sortable(chunk["mag"]) >> 16
+            histogram += np.bincount(chunk["bin"][buckets > high], minlength=num_bins)
+            inside = (buckets >= low) & (buckets <= high)
+            middle_mags.append(chunk["mag"][inside])
+            middle_bins.append(chunk["bin"][inside])
+    
+    middle_mags, middle_bins = np.concatenate(middle_mags), np.concatenate(middle_bins)
+    ordered = np.sort(middle_mags)
+    # np.median of the whole set: the mean of its two middle values (one value for an odd count)
+    threshold = np.median(ordered[[ranks[0] - below, ranks[1] - below]])
+    histogram += np.bincount(middle_bins[middle_mags >= threshold], minlength=num_bins)
+    return tuning_from_histogram(histogram)
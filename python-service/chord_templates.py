@@ -0,0 +1,54 @@
+"""
+Chord Template Matching - PhinAccords
+Heavenkeys Ltd
+
+Major and minor triad templates and the vectorized matcher that labels
+chroma frames with them, without a trained model. python-service recognizes
+its chords with it and dechord-service its preview chords, so both services
+chart the same audio the same way. Every frame is scored against every
+template by cosine similarity in one matrix multiply.
+"""
+
+from typing import Tuple, List
+import numpy as np
+
+PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+# Chord intervals above the root, by label suffix
+TRIADS = (("", (0, 4, 7)), ("m", (0, 3, 7)))
+# Cosine similarity a frame needs to its best template to be labelled
+MIN_SIMILARITY = 0.5
+# Label index of frames no template matches well enough
+NO_CHORD = -1
+
+def build_chord_templates() -> Tuple[List[str], np.ndarray]:
+    """
+    Major then minor triad templates, one per root
+    Returns (chord_names, templates) with one unit-norm template per row
+    """
+    names, rows = [], []
+    for suffix, intervals in TRIADS:
+        for root, name in enumerate(PITCH_CLASSES):
+            row = np.zeros(12)
+            row[[(root + interval) % 12 for interval in intervals]] = 1.0
+            names.append(name + suffix)
+            rows.append(row)
+    templates = np.array(rows)
+    templates /= np.linalg.norm(templates, axis=1, keepdims=True)
+    return names, templates
+
+# Precomputed once; rows follow CHORD_NAMES
+CHORD_NAMES, CHORD_TEMPLATES = build_chord_templates()
+
+def match_chords(chroma: np.ndarray) -> np.ndarray:
+    """
+    Index into CHORD_NAMES of the closest template to each chroma column, or
+    NO_CHORD where even the closest falls below MIN_SIMILARITY (e.g. silence)
+    """
+    num_columns = chroma.shape[1]
+    if not num_columns:
+        return np.zeros(0, dtype=np.int64)
+    
+    chroma = chroma / (np.linalg.norm(chroma, axis=0, keepdims=True) + 1e-10)
+    scores = CHORD_TEMPLATES @ chroma
+    best_match = np.argmax(scores, axis=0)
+    return np.where(scores[best_match, np.arange(num_columns)] >= MIN_SIMILARITY, best_match, NO_CHORD)
@@ -0,0 +1,183 @@
+"""
+Chord Chart Views - PhinAccords
+Heavenkeys Ltd
+
+Views of an analysed track's chords that need no audio: transposed, as the
+shapes to play with a capo, reduced to a simpler chord vocabulary, or one
+chord per bar. Everything works on (start, end, label) segments and key
+names alone. Views are memoized per analysis and variant; an analysis never
+changes once complete, so they never go stale.
+"""
+
+import os
+import re
+from collections import OrderedDict
+from typing import Optional, List, Tuple, Dict, Any
+
+SHARP_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+FLAT_NAMES = ['C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B']
+NOTE_INDEX = {
+    **{name: i for i, name in enumerate(SHARP_NAMES)},
+    **{name: i for i, name in enumerate(FLAT_NAMES)},
+    'Cb': 11, 'B#': 0, 'E#': 5, 'Fb': 4,
+}
+
+# "auto" spells notes the way the (transposed) key is written
+SPELLINGS = ("auto", "sharp", "flat")
+VOCABULARIES = ("full", "majmin", "sevenths")
+QUANTIZATIONS = ("none", "bar")
+MAX_CAPO = 11
+# Tonics of the keys written with flats
+FLAT_KEY_TONICS = {"major": {1, 3, 5, 6, 8, 10}, "minor": {0, 2, 3, 5, 7, 10}}
+
+# Root, suffix and optional bass note: "C#m7", "Bb/D", "F#m7b5"
+CHORD_PATTERN = re.compile(r"^([A-G][#b]?)([^/]*)(?:/([A-G][#b]?))?$")
+# "C", "Am" or "A minor"
+KEY_PATTERN = re.compile(r"^([A-G][#b]?)(m| major| minor)?$")
+
+MAX_CACHED_VIEWS = int(os.getenv("MAX_CACHED_CHORD_VIEWS", "10000"))
+
+Segment = Tuple[float, float, str]
+
+def transpose_note(note: str, semitones: int, spelling: str) -> str:
+    names = FLAT_NAMES if spelling == "flat" else SHARP_NAMES
+    return names[(NOTE_INDEX[note] + semitones) % 12]
+
+def transpose_label(label: str, semitones: int, spelling: str) -> str:
+    """A chord label moved by semitones; labels that are not chords ("N") are unchanged"""
+    match = CHORD_PATTERN.match(label)
+    if match is None:
+        return label
+    root, suffix, bass = match.groups()
+    moved = transpose_note(root, semitones, spelling) + suffix
+    if bass:
+        moved += "/" + transpose_note(bass, semitones, spelling)
+    return moved
+
+def transpose_key(key: str, semitones: int, spelling: str) -> str:
+    """A key name moved by semitones, in the same style ("Am" or "A minor")"""
+    match = KEY_PATTERN.match(key)
+    if match is None:
+        return key
+    tonic, mode = match.groups()
+    return transpose_note(tonic, semitones, spelling) + (mode or "")
+
+def key_spelling(key: str, semitones: int) -> str:
+    """"flat" or "sharp", as the key moved by semitones is written; "sharp" for unrecognized keys"""
+    match = KEY_PATTERN.match(key)
+    if match is None:
+        return "sharp"
+    tonic, mode = match.groups()
+    minor = mode in ("m", " minor")
+    tonic_index = (NOTE_INDEX[tonic] + semitones) % 12
+    return "flat" if tonic_index in FLAT_KEY_TONICS["minor" if minor else "major"] else "sharp"
+
+def simplify_label(label: str, vocabulary: str) -> str:
+    """
+    A chord label reduced to vocabulary: "majmin" keeps a root-position major
+    or minor triad, "sevenths" also keeps dominant, major and minor sevenths
+    (extensions fold into their seventh); "full" keeps the label
+    """
+    match = CHORD_PATTERN.match(label)
+    if vocabulary == "full" or match is None:
+        return label
+    root, suffix, _ = match.groups()
+    
+    diminished = suffix.startswith(("dim", "°"))
+    minor = diminished or (suffix.startswith("m") and not suffix.startswith("maj"))
+    triad = root + ("m" if minor else "")
+    if vocabulary == "majmin" or diminished or not any(d in suffix for d in ("7", "9", "11", "13")):
+        return triad
+    if "maj" in suffix or "M7" in suffix:
+        # A minor-major seventh has no place in the vocabulary; keep its triad
+        return triad if minor else root + "maj7"
+    return root + ("m7" if minor else "7")
+
+def append_segment(chart: List[Segment], start: float, end: float, label: str) -> None:
+    """Append a segment, extending the last one instead when it has the same label and touches it"""
+    if chart and chart[-1][2] == label and chart[-1][1] == start:
+        chart[-1] = (chart[-1][0], end, label)
+    else:
+        chart.append((start, end, label))
+
+def tempo_bars(tempo: float, first_onset: float, duration: float, beats_per_bar: int = 4) -> List[float]:
+    """Bar starts on a constant-tempo grid through first_onset, for analyses without beat positions"""
+    if tempo <= 0 or beats_per_bar <= 0:
+        return []
+    bar = beats_per_bar * 60.0 / tempo
+    phase = first_onset % bar
+    return [phase + i * bar for i in range(int((duration - phase) / bar) + 1) if phase + i * bar < duration]
+
+def quantize_to_bars(segments: List[Segment], bar_starts: List[float], duration: float) -> List[Segment]:
+    """
+    One chord per bar: the label covering most of it ("N" counts, so a mostly
+    silent bar stays silent). Time before the first bar is a bar of its own;
+    bars no segment touches are left out.
+    """
+    edges = [0.0] + [start for start in bar_starts if 0.0 < start < duration] + [duration]
+    chart: List[Segment] = []
+    first = 0
+    for bar_start, bar_end in zip(edges[:-1], edges[1:]):
+        while first < len(segments) and segments[first][1] <= bar_start:
+            first += 1
+        coverage: Dict[str, float] = {}
+        for start, end, label in segments[first:]:
+            if start >= bar_end:
+                break
+            coverage[label] = coverage.get(label, 0.0) + min(end, bar_end) - max(start, bar_start)
+        if coverage:
+            append_segment(chart, bar_start, bar_end, max(coverage, key=coverage.get))
+    return chart
+
+def validate_variant(capo: int, simplify: str, quantize: str, spelling: str) -> None:
+    """Raises ValueError describing the first invalid view parameter"""
+    if not 0 <= capo <= MAX_CAPO:
+        raise ValueError(f"capo must be between 0 and {MAX_CAPO}")
+    if simplify not in VOCABULARIES:
+        raise ValueError(f"simplify must be one of: {', '.join(VOCABULARIES)}")
+    if quantize not in QUANTIZATIONS:
+        raise ValueError(f"quantize must be one of: {', '.join(QUANTIZATIONS)}")
+    if spelling not in SPELLINGS:
+        raise ValueError(f"spelling must be one of: {', '.join(SPELLINGS)}")
+
+def chord_view(segments: List[Segment], key: str, transpose: int = 0, capo: int = 0,
+               simplify: str = "full", spelling: str = "auto",
+               bar_starts: Optional[List[float]] = None, duration: float = 0.0) -> Dict[str, Any]:
+    """
+    The chart of an analysis for one variant: chords moved by transpose
+    semitones and, with a capo on fret capo, named by the shapes to play (the
+    chart sounds the same), reduced to the simplify vocabulary, and with
+    bar_starts, one chord per bar of a track lasting duration
+    Returns {"chords": [(start, end, label)], "key": ...} with the key of the shapes
+    """
+    shift = transpose - capo
+    if spelling == "auto":
+        spelling = key_spelling(key, shift)
+    chart: List[Segment] = []
+    for start, end, label in segments:
+        append_segment(chart, start, end, simplify_label(transpose_label(label, shift, spelling), simplify))
+    if bar_starts is not None:
+        chart = quantize_to_bars(chart, bar_starts, duration)
+    return {"chords": chart, "key": transpose_key(key, shift, spelling)}
+
+class ViewCache:
+    """
+    Views by (analysis id, variant), in whatever form a service serves them,
+    evicting the least recently used
+    """
+    
+    def __init__(self, max_entries: int = MAX_CACHED_VIEWS):
+        self.max_entries = max_entries
+        self.views: "OrderedDict[tuple, Any]" = OrderedDict()
+    
+    def get(self, key: tuple) -> Optional[Any]:
+        view = self.views.get(key)
+        if view is not None:
+            self.views.move_to_end(key)
+        return view
+    
+    def put(self, key: tuple, view: Any) -> None:
+        self.views[key] = view
+        self.views.move_to_end(key)
+        while len(self.views) > self.max_entries:
+            self.views.popitem(last=False)
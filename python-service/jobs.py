@@ -0,0 +1,195 @@
+"""
+PhinAccords Audio Processing Jobs
+Heavenkeys Ltd
+
+Persistent job store for asynchronous chord extraction.
+Job state and results live in SQLite so queued and interrupted jobs
+survive a restart; workers in other processes report progress through it.
+"""
+
+import os
+import json
+import time
+import sqlite3
+from contextlib import contextmanager
+from typing import Optional, Dict, Any
+from loguru import logger
+
+import pipeline
+import youtube_cache
+
+# Finished (completed or failed) jobs are deleted this long after they finish (0 keeps them)
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Progress reported when each stage starts
+STAGE_PROGRESS = {
+    "queued": 0.0,
+    "downloading": 5.0,
+    "decoding": 20.0,
+    "chroma": 35.0,
+    "beats": 50.0,
+    "chords": 80.0,
+    "key": 90.0,
+    "completed": 100.0,
+}
+
+def error_message(e: BaseException) -> str:
+    """The reason to record for a failure; some exceptions (decoder errors, bare raises) carry no message"""
+    return str(e) or type(e).__name__
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    progress REAL NOT NULL,
+    audio_path TEXT,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at);
+"""
+
+class JobStore:
+    """SQLite-backed job table shared by the web process and analysis workers"""
+    
+    def __init__(self, db_path: str, ttl_seconds: float = JOB_TTL_SECONDS):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            # WAL lets workers write progress while the web process reads it
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+    
+    @contextmanager
+    def _connect(self):
+        """Connection that commits on success and is always closed"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def create(self, job_id: str, audio_path: Optional[str], params: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, stage, progress, audio_path, params, created_at, updated_at) "
+                "VALUES (?, 'queued', 'queued', 0, ?, ?, ?, ?)",
+                (job_id, audio_path, json.dumps(params), now, now)
+            )
+            self._sweep(conn, now)
+    
+    def add_completed(self, job_id: str, params: Dict[str, Any], result: Dict[str, Any]) -> None:
+        """Record an extraction finished outside the job queue, so its result and charts are served by ID"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, stage, progress, params, result, created_at, updated_at) "
+                "VALUES (?, 'completed', 'completed', ?, ?, ?, ?, ?)",
+                (job_id, STAGE_PROGRESS["completed"], json.dumps(params), json.dumps(result), now, now)
+            )
+            self._sweep(conn, now)
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job, or None if missing or finished longer than the TTL ago"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or self._expired(row["status"], row["updated_at"], time.time()):
+            return None
+        
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+    
+    def _expired(self, status: str, updated_at: float, now: float) -> bool:
+        return bool(self.ttl_seconds) and status in ("completed", "failed") and now - updated_at > self.ttl_seconds
+    
+    def _sweep(self, conn, now: float) -> None:
+        """Delete jobs that finished longer than the TTL ago, with any upload left behind"""
+        if not self.ttl_seconds:
+            return
+        expired = conn.execute(
+            "SELECT id, audio_path FROM jobs WHERE status IN ('completed', 'failed') AND updated_at < ?",
+            (now - self.ttl_seconds,)
+        ).fetchall()
+        if not expired:
+            return
+        conn.executemany("DELETE FROM jobs WHERE id = ?", [(row["id"],) for row in expired])
+        for row in expired:
+            # Workers delete uploads when they finish; a worker that died leaves its upload
+            if row["audio_path"] and os.path.exists(row["audio_path"]):
+                os.unlink(row["audio_path"])
+        logger.info(f"Deleted {len(expired)} expired job(s)")
+    
+    def _update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+    
+    def set_stage(self, job_id: str, stage: str) -> None:
+        self._update(job_id, status="processing", stage=stage, progress=STAGE_PROGRESS[stage])
+    
+    def complete(self, job_id: str, result: Dict[str, Any]) -> None:
+        self._update(
+            job_id, status="completed", stage="completed",
+            progress=STAGE_PROGRESS["completed"], result=json.dumps(result)
+        )
+    
+    def fail(self, job_id: str, error: str) -> None:
+        self._update(job_id, status="failed", error=error)
+    
+    def requeue_unfinished(self) -> list:
+        """Mark jobs interrupted by a restart as queued again and return their IDs; also sweeps expired jobs"""
+        with self._connect() as conn:
+            self._sweep(conn, time.time())
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'processing') ORDER BY created_at"
+            ).fetchall()
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = 'queued', progress = 0, updated_at = ? "
+                "WHERE status IN ('queued', 'processing')",
+                (time.time(),)
+            )
+        return [row["id"] for row in rows]
+
+def run_job(db_path: str, job_id: str) -> None:
+    """
+    Process one job end to end; runs inside an analysis worker process.
+    Progress, the result or the error are written back to the store.
+    """
+    store = JobStore(db_path)
+    job = store.get(job_id)
+    if job is None or job["status"] in ("completed", "failed"):
+        return
+    
+    # Uploaded audio belongs to the job; downloads stay in the download cache
+    upload_path = job["audio_path"]
+    try:
+        if upload_path is None:
+            store.set_stage(job_id, "downloading")
+            audio_path, _ = youtube_cache.default_cache().get(job["params"]["url"])
+        else:
+            audio_path = upload_path
+        
+        extraction = pipeline.extract_from_file(
+            audio_path,
+            progress=lambda stage: store.set_stage(job_id, stage),
+            segmentation=job["params"].get("segmentation", "frame")
+        )
+        store.complete(job_id, extraction)
+        logger.info(f"Job {job_id} completed: {len(extraction['chords'])} chords")
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {error_message(e)}")
+        store.fail(job_id, error_message(e))
+    finally:
+        if upload_path and os.path.exists(upload_path):
+            os.unlink(upload_path)
@@ -0,0 +1,34 @@
+"""
+Lazy Module Imports - PhinAccords
+Heavenkeys Ltd
+
+madmom, librosa and scipy take seconds to import but only analysis code
+needs them. Modules from lazy_import() are imported on first attribute
+access. The web process can then import the pipeline, for its constants and
+to hand its functions to the workers, and answer /health without paying for
+them.
+"""
+
+import sys
+import importlib.util
+from types import ModuleType
+
+def lazy_import(name: str) -> ModuleType:
+    """The named module, imported when one of its attributes is first used"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
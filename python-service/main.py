@@ -6,28 +6,57 @@ Main FastAPI application for chord extraction from audio files.
 Uses librosa and madmom for Music Information Retrieval (MIR).
 """
 
+import time
+# Boot timing starts before the imports below; see warm_up()
+BOOT_STARTED = time.perf_counter()
+
 import os
+import json
+import uuid
+import shutil
+import hashlib
+import asyncio
 import tempfile
 import logging
+import multiprocessing
+from contextlib import asynccontextmanager
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Optional, List, Dict, Any
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import librosa
-import madmom
-import numpy as np
 from loguru import logger
 
+import admission
+import blockstream
+import chord_views
+import jobs
+import metrics
+import pipeline
+import singleflight
+import youtube_cache
+
+IMPORT_SECONDS = time.perf_counter() - BOOT_STARTED
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger.add("logs/audio_service.log", rotation="500 MB")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup_event()
+    yield
+    await shutdown_event()
+
 app = FastAPI(
     title="PhinAccords Audio Processing API",
     description="AI-powered chord extraction and beat tracking service",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -37,13 +66,48 @@ ALLOWED_ORIGINS = os.getenv(
     "https://phin-accords-kzhmbuv20-jackmichaels-projects.vercel.app,http://localhost:3000"
 ).split(",")
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=ALLOWED_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Upload limits (0 disables): bytes per uploaded file and seconds of audio
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "3600"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject request bodies over the upload limit while they are still arriving,
+    before the multipart parser has spooled all of them to disk
+    """
+    
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.max_bytes:
+            await self.app(scope, receive, send)
+            return
+        
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse(status_code=413, content={"detail": f"Upload exceeds {self.max_bytes} bytes"})
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside body parsing, so FastAPI turns it into the response
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {self.max_bytes} bytes")
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+app.add_middleware(metrics.RequestsInFlightMiddleware)
 
 # Models
 class ChordSegment(BaseModel):
@@ -66,265 +130,837 @@ class ExtractionResult(BaseModel):
     duration: float
     title: Optional[str] = None
     artist: Optional[str] = None
+    # "preview" results are replaced by the full extraction of job jobId
+    quality: str = "full"
+    jobId: Optional[str] = None
+
+class ChartChord(BaseModel):
+    startTime: float
+    endTime: float
+    chord: str
+
+class ChordChart(BaseModel):
+    jobId: str
+    key: str
+    transpose: int
+    capo: int
+    simplify: str
+    quantize: str
+    chords: List[ChartChord]
 
 class ProcessingStatus(BaseModel):
     status: str
     progress: float
+    stage: Optional[str] = None
     message: Optional[str] = None
 
-# Global variables for models (load once)
-chord_model = None
-beat_tracker = None
-downbeat_tracker = None
+class JobSubmission(BaseModel):
+    jobId: str
+    status: str
+
+# Analysis worker processes (0 runs analyses in this process's thread pool instead)
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(os.cpu_count() or 1)))
+
+# Fork the workers from a server process that has loaded the models once, so
+# they share them copy-on-write (0 spawns workers that each load their own)
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "1") != "0"
+
+# Process pool for CPU-bound analysis
+executor: Optional[ProcessPoolExecutor] = None
+# Calls submitted to the pool (or thread pool) that have not finished yet
+pool_tasks = 0
+# Set once the pool is up (or the models are loaded here); calls wait for it
+pool_started = asyncio.Event()
+# Whether the workers have loaded and warmed their models, for /ready
+ready = False
+warm_up_task: Optional[asyncio.Task] = None
+
+def start_executor() -> list:
+    """
+    Start the analysis workers; returns one future per worker that resolves to
+    its pid and memory once its models are loaded
+    With PRELOAD_MODELS the first start blocks until the fork server has loaded them
+    """
+    global executor
+    
+    if PRELOAD_MODELS and "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # Imported by the fork server before it forks any worker
+        context.set_forkserver_preload(["worker_preload"])
+    else:
+        context = multiprocessing.get_context("spawn")
+    
+    pool = ProcessPoolExecutor(
+        max_workers=ANALYSIS_WORKERS,
+        mp_context=context,
+        initializer=pipeline.init_worker,
+    )
+    # Workers are started on demand; submitting one task per worker brings them all up
+    boots = [pool.submit(pipeline.worker_status) for _ in range(ANALYSIS_WORKERS)]
+    executor = pool
+    logger.info(f"Started {ANALYSIS_WORKERS} analysis worker(s) ({context.get_start_method()})")
+    return boots
 
-def load_models():
-    """Load pre-trained models for chord recognition and beat tracking"""
-    global chord_model, beat_tracker, downbeat_tracker
+async def warm_up() -> None:
+    """
+    Bring up the analysis workers (or load the models in this process without
+    any), then log each one's memory and the time since boot, and report ready
+    """
+    global ready
     
     try:
-        # Initialize madmom beat tracker
-        # Using madmom's built-in DBN beat tracker
-        beat_tracker = madmom.features.beats.DBNBeatTrackingProcessor(fps=100)
-        downbeat_tracker = madmom.features.downbeats.DBNDownBeatTrackingProcessor(fps=100)
-        
-        logger.info("Models loaded successfully")
+        if ANALYSIS_WORKERS <= 0:
+            await run_in_threadpool(pipeline.load_models)
+            statuses = [pipeline.worker_status()]
+        else:
+            boots = await run_in_threadpool(start_executor)
+            pool_started.set()
+            statuses = await asyncio.gather(*(asyncio.wrap_future(boot) for boot in boots))
     except Exception as e:
-        logger.error(f"Error loading models: {e}")
-        raise
+        logger.error(f"Warm-up failed: {e}")
+        return
+    finally:
+        pool_started.set()
+    
+    # One boot task per worker is not guaranteed to reach every worker; log those that answered
+    for status in {status["pid"]: status for status in statuses}.values():
+        logger.info(
+            f"Worker {status['pid']}: RSS {status['rss'] / 2**20:.0f} MB"
+            + (f", PSS {status['pss'] / 2**20:.0f} MB, private {status['private'] / 2**20:.0f} MB" if "pss" in status else "")
+        )
+    ready = True
+    logger.info(f"Ready {time.perf_counter() - BOOT_STARTED:.2f}s after boot")
+
+async def run_in_pool(func, *args):
+    """
+    Run a CPU-bound function in the analysis pool and await its result
+    Stage metrics recorded by the worker come back with the result
+    """
+    global executor, pool_tasks
+    
+    pool_tasks += 1
+    try:
+        # Until the workers are up, calls queue here rather than run in this process
+        await pool_started.wait()
+        if executor is None:
+            result, observations = await run_in_threadpool(metrics.collect_call, func, *args)
+        else:
+            pool = executor
+            loop = asyncio.get_running_loop()
+            try:
+                result, observations = await loop.run_in_executor(pool, metrics.collect_call, func, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM); replace the pool once so later requests still run
+                if executor is pool:
+                    logger.error("Analysis worker pool broke, restarting it")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    # The fork server is already up, so this does not wait on the models
+                    start_executor()
+                raise
+    finally:
+        pool_tasks -= 1
+    
+    metrics.replay(observations)
+    return result
+
+def pool_capacity() -> int:
+    # Without workers every call starts on a thread of its own right away
+    return ANALYSIS_WORKERS if ANALYSIS_WORKERS > 0 else max(pool_tasks, 1)
+
+metrics.add_gauge(
+    "analysis_tasks_running", "Pool calls currently executing",
+    lambda: min(pool_tasks, pool_capacity())
+)
+metrics.add_gauge(
+    "analysis_tasks_queued", "Pool calls waiting for a free worker",
+    lambda: max(0, pool_tasks - pool_capacity())
+)
+
+# Admission control for the analysis endpoints: requests handled at once (0
+# disables), requests waiting for a place beyond those, and places any one
+# client may hold (0 for no per-client limit)
+MAX_ACTIVE_ANALYSES = int(os.getenv("MAX_ACTIVE_ANALYSES", str(max(ANALYSIS_WORKERS, 1))))
+MAX_QUEUED_ANALYSES = int(os.getenv("MAX_QUEUED_ANALYSES", str(4 * max(ANALYSIS_WORKERS, 1))))
+MAX_ANALYSES_PER_CLIENT = int(os.getenv("MAX_ANALYSES_PER_CLIENT", "0"))
+ADMITTED_PATHS = ("/extract-chords",)
+
+admission_control = admission.AdmissionController(MAX_ACTIVE_ANALYSES, MAX_QUEUED_ANALYSES, MAX_ANALYSES_PER_CLIENT)
+if MAX_ACTIVE_ANALYSES > 0:
+    app.add_middleware(admission.AdmissionMiddleware, controller=admission_control, paths=ADMITTED_PATHS)
+
+# Added after the other middleware so it is outermost (Starlette wraps each new
+# middleware around the ones before it) and their error responses, such as 413
+# and 429, carry CORS headers; Retry-After is exposed so clients can back off
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=ALLOWED_ORIGINS,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["Retry-After"],
+)
+
+metrics.add_gauge(
+    "admission_requests_active", "Analysis requests holding a place",
+    lambda: admission_control.active
+)
+metrics.add_gauge(
+    "admission_requests_queued", "Analysis requests waiting for a place",
+    lambda: admission_control.queued
+)
+metrics.add_gauge(
+    "admission_service_seconds", "Moving average of an admitted analysis request's handling time",
+    admission_control.estimated_service_seconds
+)
+
+# Persistent job store for /jobs submissions
+JOBS_DIR = os.getenv("JOBS_DIR", "jobs")
+JOBS_UPLOAD_DIR = os.path.join(JOBS_DIR, "uploads")
+JOBS_DB_PATH = os.path.join(JOBS_DIR, "jobs.db")
+job_store = jobs.JobStore(JOBS_DB_PATH)
+
+# Keep references to running job tasks so they are not garbage collected
+job_tasks = set()
+
+async def run_job(job_id: str) -> None:
+    try:
+        with metrics.analysis() as analysis:
+            await run_in_pool(jobs.run_job, JOBS_DB_PATH, job_id)
+            job = job_store.get(job_id)
+            if job and job["result"]:
+                analysis.audio_seconds = job["result"]["duration"]
+    except Exception as e:
+        # The worker died before it could record the failure itself
+        logger.error(f"Job {job_id} failed: {jobs.error_message(e)}")
+        job_store.fail(job_id, jobs.error_message(e))
+
+def schedule_job(job_id: str) -> None:
+    task = asyncio.create_task(run_job(job_id))
+    job_tasks.add(task)
+    task.add_done_callback(job_tasks.discard)
 
-# Load models on startup
-@app.on_event("startup")
 async def startup_event():
-    load_models()
+    global warm_up_task
+    
+    logger.info(f"Imported in {IMPORT_SECONDS:.2f}s")
+    # Models load in the background: /health answers at once, /ready once they are warm
+    warm_up_task = asyncio.create_task(warm_up())
+    
+    # Resume jobs that were queued or running when the service stopped
+    unfinished = job_store.requeue_unfinished()
+    for job_id in unfinished:
+        schedule_job(job_id)
+    if unfinished:
+        logger.info(f"Resumed {len(unfinished)} unfinished job(s)")
 
-def extract_chroma_features(y: np.ndarray, sr: int) -> np.ndarray:
-    """Extract chroma features for chord recognition"""
-    # Use librosa to extract chroma features
-    chroma = librosa.feature.chroma_stft(y=y, sr=sr, n_chroma=12)
-    return chroma
+async def shutdown_event():
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
 
-def recognize_chords(chroma: np.ndarray, hop_length: int, sr: int) -> List[Dict[str, Any]]:
+@metrics.timed("upload_write")
+def spool_upload(source, suffix: str, directory: Optional[str] = None) -> tuple:
     """
-    Recognize chords from chroma features using template matching
-    In production, this would use a trained deep neural network
+    Copy an upload to a temporary file in fixed-size chunks, hashing it in the same pass
+    Returns (path, content_hash); raises 413 once MAX_UPLOAD_BYTES is exceeded
     """
-    chords = []
-    
-    # Chord templates (simplified - in production use trained model)
-    chord_templates = {
-        'C': [1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0],
-        'C#': [1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0],
-        'D': [0, 1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0],
-        'D#': [0, 1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0],
-        'E': [0, 0, 1, 0, 0, 0, 1, 0, 0, 1, 0, 0],
-        'F': [1, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0],
-        'F#': [1, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0],
-        'G': [0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 1],
-        'G#': [0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1],
-        'A': [0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 1],
-        'A#': [0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 1, 0],
-        'B': [0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 1],
-    }
-    
-    # Minor chord templates
-    for root in list(chord_templates.keys()):
-        minor_template = chord_templates[root].copy()
-        # Shift for minor third
-        minor_template = np.roll(minor_template, -3)
-        chord_templates[f"{root}m"] = minor_template
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=directory) as tmp_file:
+        try:
+            for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if MAX_UPLOAD_BYTES and size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+                digest.update(chunk)
+                tmp_file.write(chunk)
+        except BaseException:
+            os.unlink(tmp_file.name)
+            raise
+    return tmp_file.name, f"sha256-{digest.hexdigest()}"
+
+async def save_upload(file: UploadFile, directory: Optional[str] = None) -> tuple:
+    """
+    Stream an uploaded file to a temporary path (optionally inside directory)
+    without holding it in memory
+    Returns (path, content_hash); oversized or overlong audio is rejected with 413
+    """
+    if MAX_UPLOAD_BYTES and file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
     
-    # Process chroma features frame by frame
-    frame_time = hop_length / sr
-    num_frames = chroma.shape[1]
+    tmp_path, content_hash = await run_in_threadpool(spool_upload, file.file, Path(file.filename).suffix, directory)
     
-    current_chord = None
-    chord_start = 0.0
+    if MAX_AUDIO_SECONDS:
+        duration = await run_in_threadpool(pipeline.probe_duration, tmp_path)
+        if duration is not None and duration > MAX_AUDIO_SECONDS:
+            os.unlink(tmp_path)
+            raise HTTPException(
+                status_code=413,
+                detail=f"Audio is {duration:.0f}s long; the limit is {MAX_AUDIO_SECONDS:.0f}s"
+            )
     
-    for frame_idx in range(num_frames):
-        frame_chroma = chroma[:, frame_idx]
-        frame_chroma_norm = frame_chroma / (np.sum(frame_chroma) + 1e-10)
+    return tmp_path, content_hash
+
+def stream_message(message: Dict[str, Any], sse: bool) -> str:
+    """Encode one streamed message as an NDJSON line or a server-sent event"""
+    data = json.dumps(message)
+    if sse:
+        return f"event: {message['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+# Extractions currently running, by content and segmentation; identical concurrent requests share one
+extraction_flights = singleflight.SingleFlight()
+
+metrics.add_gauge(
+    "coalesced_requests_waiting", "Requests waiting on a shared in-flight extraction",
+    lambda: sum(extraction_flights.waiter_counts().values())
+)
+
+def link_audio_file(audio_path: str) -> str:
+    """Second directory entry for an audio file, so it outlives its owner deleting the original"""
+    directory, name = os.path.split(audio_path)
+    stem, suffix = os.path.splitext(name)
+    link_path = os.path.join(directory, f".{stem}.{uuid.uuid4().hex}{suffix}")
+    try:
+        os.link(audio_path, link_path)
+    except OSError:
+        shutil.copyfile(audio_path, link_path)
+    return link_path
+
+async def extract_windowed(audio_path: str, segmentation: str) -> Dict[str, Any]:
+    """
+    extract_from_file for long recordings, spread over the whole worker pool:
+    downbeat activations and tuning histograms are computed per window and
+    pooled into one global beat tracking pass and one tuning, then chords are
+    recognized per window (on the global beat grid when segmenting by beat) and
+    joined across window edges, and the key comes from the windows' summed
+    chroma. No stage holds the whole track's spectrogram.
+    """
+    handle = await run_in_pool(pipeline.decode_to_shared_memory, audio_path)
+    tasks = []
+    try:
+        num_samples, sr = handle["shape"][0], handle["sample_rate"]
+        tuning_windows = pipeline.plan_windows(
+            num_samples, pipeline.ANALYSIS_WINDOW_SECONDS, pipeline.WINDOW_CONTEXT_SECONDS
+        )
+        histogram_tasks = [
+            asyncio.ensure_future(run_in_pool(pipeline.run_signal_stage, "tuning_window", handle, window))
+            for window in tuning_windows
+        ]
+        tasks = list(histogram_tasks)
         
-        # Find best matching chord
-        best_match = None
-        best_score = 0.0
+        beat_windows = pipeline.plan_windows(
+            num_samples, pipeline.ANALYSIS_WINDOW_SECONDS, pipeline.BEAT_CONTEXT_SECONDS,
+            hop_size=pipeline.BEAT_WINDOW_HOP
+        )
+        activations = await asyncio.gather(
+            *(run_in_pool(pipeline.run_signal_stage, "beat_window", handle, window) for window in beat_windows)
+        )
+        beat_positions, tempo, time_signature = await run_in_pool(pipeline.beats_from_activations, activations)
         
-        for chord_name, template in chord_templates.items():
-            # Calculate cosine similarity
-            template_norm = np.array(template) / (np.sum(template) + 1e-10)
-            similarity = np.dot(frame_chroma_norm, template_norm)
-            
-            if similarity > best_score:
-                best_score = similarity
-                best_match = chord_name
+        grid = None
+        subdivisions = pipeline.SEGMENTATIONS[segmentation]
+        if subdivisions:
+            grid = pipeline.chord_grid([b["time"] for b in beat_positions], sr, subdivisions)
         
-        # Only add chord if confidence is high enough and it's different
-        if best_match and best_score > 0.3:
-            if best_match != current_chord:
-                # Save previous chord
-                if current_chord:
-                    chords.append({
-                        'chord': current_chord,
-                        'startTime': chord_start,
-                        'endTime': frame_idx * frame_time,
-                        'confidence': 0.85
-                    })
-                
-                current_chord = best_match
-                chord_start = frame_idx * frame_time
+        # Every window uses the one tuning pooled from all of them
+        tuning = blockstream.tuning_from_histogram(sum(await asyncio.gather(*histogram_tasks)))
+        windows = pipeline.plan_windows(
+            num_samples, pipeline.ANALYSIS_WINDOW_SECONDS, pipeline.WINDOW_CONTEXT_SECONDS, grid=grid
+        )
+        window_results = await asyncio.gather(
+            *(run_in_pool(pipeline.run_signal_stage, "chord_window", handle, window, tuning, grid) for window in windows)
+        )
+        chord_segments: List[Dict[str, Any]] = []
+        for window_chords, window_end, _ in window_results:
+            pipeline.merge_chord_windows(chord_segments, window_chords, window_end)
+        key = pipeline.key_from_chroma_profile(sum(profile for _, _, profile in window_results))
+        
+        logger.info(
+            f"Extracted {num_samples / sr:.0f}s of audio as {len(beat_windows)} beat and "
+            f"{len(windows)} chord windows (tuning {tuning:+.2f}, key {key})"
+        )
+        return {
+            "chords": chord_segments,
+            "beats": beat_positions,
+            "tempo": tempo,
+            "key": key,
+            "timeSignature": time_signature,
+            "duration": num_samples / sr,
+        }
+    finally:
+        for task in tasks:
+            task.cancel()
+        pipeline.release_shared_signal(handle)
+
+async def extract_shared(audio_path: str, content_key: str, segmentation: str,
+                         request: Optional[Request] = None) -> Dict[str, Any]:
+    """
+    Run extract_from_file in the worker pool, sharing one run between concurrent
+    requests for the same content and segmentation
+    Given the request, a client that disconnects stops waiting; the extraction is
+    cancelled once no request is waiting on it
+    """
+    async def extract() -> Dict[str, Any]:
+        # The extraction can outlive the request that started it, which deletes its upload
+        flight_path = link_audio_file(audio_path)
+        try:
+            with metrics.analysis() as analysis:
+                duration = await run_in_threadpool(pipeline.probe_duration, flight_path)
+                streamed = await run_in_threadpool(pipeline.use_block_streaming, flight_path, duration)
+                if not streamed and pipeline.LONG_INPUT_SECONDS and duration and duration > pipeline.LONG_INPUT_SECONDS:
+                    extraction = await extract_windowed(flight_path, segmentation)
+                else:
+                    extraction = await run_in_pool(pipeline.extract_from_file, flight_path, None, segmentation)
+                analysis.audio_seconds = extraction["duration"]
+            return extraction
+        finally:
+            os.unlink(flight_path)
     
-    # Add final chord
-    if current_chord:
-        chords.append({
-            'chord': current_chord,
-            'startTime': chord_start,
-            'endTime': num_frames * frame_time,
-            'confidence': 0.85
-        })
+    return await extraction_flights.run(f"{content_key}:{segmentation}", extract, request)
+
+def store_extraction(extraction: Dict[str, Any], url: Optional[str], title: Optional[str],
+                     artist: Optional[str], segmentation: str) -> str:
+    """
+    Keep a finished synchronous extraction as a completed job and return its
+    ID, so its result and charts are served without extracting it again
+    """
+    job_id = uuid.uuid4().hex
+    result = {name: extraction[name] for name in ("chords", "beats", "tempo", "key", "timeSignature", "duration")}
+    job_store.add_completed(
+        job_id, {"url": url, "title": title, "artist": artist, "segmentation": segmentation}, result
+    )
+    return job_id
+
+def validate_segmentation(segmentation: str) -> None:
+    if segmentation not in pipeline.SEGMENTATIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"segmentation must be one of: {', '.join(pipeline.SEGMENTATIONS)}"
+        )
+
+QUALITIES = ("full", "preview")
+
+def validate_quality(quality: str) -> None:
+    if quality not in QUALITIES:
+        raise HTTPException(status_code=400, detail=f"quality must be one of: {', '.join(QUALITIES)}")
+
+async def preview_extraction(file: Optional[UploadFile], url: Optional[str], title: Optional[str],
+                             artist: Optional[str], segmentation: str) -> ExtractionResult:
+    """
+    Run the quick preview extraction and queue the full one as a job that
+    replaces it; the job's ID is returned with the preview
+    """
+    if file:
+        # The upload is handed over to the job afterwards
+        os.makedirs(JOBS_UPLOAD_DIR, exist_ok=True)
+        audio_path, _ = await save_upload(file, directory=JOBS_UPLOAD_DIR)
+    else:
+        audio_path, _ = await run_in_threadpool(youtube_cache.default_cache().get, url)
     
-    return chords
+    try:
+        extraction = await run_in_pool(pipeline.preview_from_file, audio_path, segmentation)
+    except Exception:
+        if file and os.path.exists(audio_path):
+            os.unlink(audio_path)
+        raise
+    
+    job_id = uuid.uuid4().hex
+    job_store.create(
+        job_id, audio_path if file else None,
+        {"url": url, "title": title, "artist": artist, "segmentation": segmentation}
+    )
+    schedule_job(job_id)
+    logger.info(f"Returned preview of {len(extraction['chords'])} chords; queued job {job_id} for the full extraction")
+    
+    return ExtractionResult(**extraction, title=title, artist=artist, quality="preview", jobId=job_id)
 
-def track_beats(y: np.ndarray, sr: int) -> tuple:
-    """Track beats and downbeats using madmom"""
+async def stream_extraction(tmp_path: str, url: Optional[str], title: Optional[str], artist: Optional[str],
+                            segmentation: str, sse: bool, cleanup: bool = True):
+    """
+    Extract chords and yield results as they become available: provisional
+    "chords" batches per window in track order, "key" (with the tuning) and
+    "tempo" (with beats and time signature) as they are found, and finally a
+    "result" message with the same ExtractionResult the non-streaming
+    endpoint returns (or an "error" message)
+    Windows start on the tuning of the track's opening, so the first chords
+    do not wait for a whole-track spectrogram; if the whole track's tuning
+    differs, windows are redone with it before the result
+    The audio file is deleted afterwards when cleanup is set
+    """
+    tasks = []
+    handle = None
+    analysis = metrics.start_analysis()
     try:
-        # Extract onset features
-        proc = madmom.features.beats.RNNBeatProcessor()
-        act = proc(y)
+        handle = await run_in_pool(pipeline.decode_to_shared_memory, tmp_path)
+        num_samples, sr = handle["shape"][0], handle["sample_rate"]
         
-        # Track beats
-        beats = beat_tracker(act)
+        def start(stage: str, *args) -> asyncio.Future:
+            task = asyncio.ensure_future(run_in_pool(pipeline.run_signal_stage, stage, handle, *args))
+            tasks.append(task)
+            return task
         
-        # Track downbeats
-        proc_db = madmom.features.downbeats.RNNDownBeatProcessor()
-        act_db = proc_db(y)
-        downbeats = downbeat_tracker(act_db)
+        # Beat-synchronous chords need the beat grid first; windows then split on grid points
+        subdivisions = pipeline.SEGMENTATIONS[segmentation]
+        opening_task = start("opening_tuning")
+        beats_task = start("beats") if subdivisions else None
+        tuning = await opening_task
+        grid = None
+        if subdivisions:
+            beat_positions, _, _ = await beats_task
+            grid = pipeline.chord_grid([b["time"] for b in beat_positions], sr, subdivisions)
         
-        # Convert to list of beat positions
-        beat_positions = []
-        beat_num = 1
+        windows = pipeline.plan_windows(
+            num_samples, pipeline.STREAM_WINDOW_SECONDS, pipeline.WINDOW_CONTEXT_SECONDS, grid=grid
+        )
+        # Whole-track stages queue behind the first window, so the first chords come first
+        window_tasks = [start("chord_window", window, tuning, grid) for window in windows[:1]]
+        tonality_task = start("tonality")
+        if beats_task is None:
+            beats_task = start("beats")
+        window_tasks += [start("chord_window", window, tuning, grid) for window in windows[1:]]
         
-        for i, beat_time in enumerate(beats):
-            is_downbeat = any(abs(beat_time - db) < 0.1 for db in downbeats[:, 0])
-            beat_positions.append({
-                'time': float(beat_time),
-                'beat': beat_num,
-                'downbeat': is_downbeat
-            })
-            beat_num = beat_num + 1 if not is_downbeat else 1
+        emitted_windows = 0
+        pending = set(tasks) - {opening_task}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            
+            if tonality_task in done:
+                track_tuning, key = tonality_task.result()
+                yield stream_message({"type": "key", "key": key, "tuning": track_tuning}, sse)
+                if track_tuning != tuning:
+                    # Redo every window on the whole track's tuning, as the non-streaming path uses
+                    tuning = track_tuning
+                    for i, window in enumerate(windows):
+                        pending.discard(window_tasks[i])
+                        window_tasks[i].cancel()
+                        window_tasks[i] = start("chord_window", window, tuning, grid)
+                        pending.add(window_tasks[i])
+            
+            if beats_task in done:
+                beat_positions, tempo, time_signature = beats_task.result()
+                yield stream_message({
+                    "type": "tempo",
+                    "tempo": tempo,
+                    "beats": beat_positions,
+                    "timeSignature": time_signature,
+                }, sse)
+            
+            # Emit chord windows strictly in track order
+            while emitted_windows < len(window_tasks) and window_tasks[emitted_windows].done():
+                window = windows[emitted_windows]
+                window_chords = window_tasks[emitted_windows].result()[0]
+                yield stream_message({
+                    "type": "chords",
+                    "start": window["core_start"] / sr,
+                    "end": window["core_stop"] / sr,
+                    "chords": window_chords,
+                }, sse)
+                emitted_windows += 1
+        
+        chord_segments: List[Dict[str, Any]] = []
+        for task in window_tasks:
+            window_chords, window_end, _ = task.result()
+            pipeline.merge_chord_windows(chord_segments, window_chords, window_end)
         
-        return beat_positions, float(np.mean(1.0 / np.diff(beats)) * 60) if len(beats) > 1 else 120.0
+        extraction = {
+            "chords": chord_segments,
+            "beats": beat_positions,
+            "tempo": tempo,
+            "key": key,
+            "timeSignature": time_signature,
+            "duration": num_samples / sr,
+        }
+        result = ExtractionResult(
+            **extraction, title=title, artist=artist,
+            jobId=store_extraction(extraction, url, title, artist, segmentation)
+        )
+        analysis.audio_seconds = num_samples / sr
+        logger.info(f"Successfully streamed {len(chord_segments)} chords")
+        yield stream_message({"type": "result", "result": result.model_dump()}, sse)
+    
     except Exception as e:
-        logger.error(f"Error tracking beats: {e}")
-        # Fallback to librosa tempo
-        tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-        return [{'time': float(b), 'beat': i+1, 'downbeat': i % 4 == 0} for i, b in enumerate(beats)], float(tempo)
-
-def estimate_key(y: np.ndarray, sr: int) -> str:
-    """Estimate the key of the song"""
-    try:
-        # Use librosa's key estimation
-        chroma = librosa.feature.chroma_stft(y=y, sr=sr)
-        key = librosa.harmonic.key_estimation(y=y, sr=sr)
-        key_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-        return key_names[key] if key < len(key_names) else 'C'
-    except:
-        return 'C'
+        logger.error(f"Error streaming extraction: {e}")
+        yield stream_message({"type": "error", "detail": f"Error processing audio: {jobs.error_message(e)}"}, sse)
+    
+    finally:
+        # Also reached when the client disconnects mid-stream
+        for task in tasks:
+            task.cancel()
+        if handle is not None:
+            pipeline.release_shared_signal(handle)
+        metrics.finish_analysis(analysis)
+        if cleanup and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
 
 @app.post("/extract-chords", response_model=ExtractionResult)
 async def extract_chords(
+    request: Request,
     background_tasks: BackgroundTasks,
     file: Optional[UploadFile] = File(None),
     url: Optional[str] = Form(None),
     title: Optional[str] = Form(None),
-    artist: Optional[str] = Form(None)
+    artist: Optional[str] = Form(None),
+    stream: bool = Form(False),
+    segmentation: str = Form("frame"),
+    quality: str = Form("full")
 ):
     """
     Extract chords from audio file or URL
+    Streams partial results as NDJSON (or server-sent events) when stream is set
+    segmentation selects chords per chroma frame ("frame"), per beat ("beat")
+    or per half beat ("half-beat")
+    quality="preview" answers at once with an approximate extraction and queues
+    the full one as job jobId (see /status, /jobs/{job_id}/result and /jobs/{job_id}/events);
+    full results are kept as completed job jobId for /jobs/{job_id}/chart
     """
+    validate_segmentation(segmentation)
+    validate_quality(quality)
+    if stream and quality == "preview":
+        raise HTTPException(status_code=400, detail="stream cannot be combined with quality=preview")
+    
     try:
+        if quality == "preview":
+            if not file and not url:
+                raise HTTPException(status_code=400, detail="Either file or url must be provided")
+            return await preview_extraction(file, url, title, artist, segmentation)
+        
         # Handle file upload or URL
         if file:
             # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.filename).suffix) as tmp_file:
-                content = await file.read()
-                tmp_file.write(content)
-                tmp_path = tmp_file.name
+            tmp_path, content_key = await save_upload(file)
         elif url:
-            # Download from URL (YouTube, etc.)
-            import yt_dlp
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'outtmpl': tempfile.mktemp(suffix='.%(ext)s'),
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                tmp_path = ydl.prepare_filename(info).replace('.webm', '.mp3').replace('.m4a', '.mp3')
+            # Download from URL (YouTube, etc.); the download cache keeps the file
+            tmp_path, _ = await run_in_threadpool(youtube_cache.default_cache().get, url)
+            content_key = youtube_cache.cache_key(url)
         else:
             raise HTTPException(status_code=400, detail="Either file or url must be provided")
         
+        if stream:
+            # The stream owns the temporary file from here on
+            sse = "text/event-stream" in request.headers.get("accept", "")
+            return StreamingResponse(
+                stream_extraction(tmp_path, url, title, artist, segmentation, sse, cleanup=bool(file)),
+                media_type="text/event-stream" if sse else "application/x-ndjson"
+            )
+        
         try:
-            # Load audio file
-            logger.info(f"Loading audio from: {tmp_path}")
-            y, sr = librosa.load(tmp_path, sr=22050, duration=None)
-            duration = len(y) / sr
-            
-            # Extract chroma features
-            chroma = extract_chroma_features(y, sr)
-            hop_length = 512
-            
-            # Recognize chords
-            logger.info("Recognizing chords...")
-            chord_segments = recognize_chords(chroma, hop_length, sr)
-            
-            # Track beats
-            logger.info("Tracking beats...")
-            beat_positions, tempo = track_beats(y, sr)
-            
-            # Estimate key
-            key = estimate_key(y, sr)
-            
-            # Determine time signature (simplified - assume 4/4)
-            time_signature = "4/4"
+            extraction = await extract_shared(tmp_path, content_key, segmentation, request)
+            chord_segments = extraction["chords"]
             
             # Format results
             result = ExtractionResult(
                 chords=[ChordSegment(**c) for c in chord_segments],
-                beats=[BeatPosition(**b) for b in beat_positions],
-                tempo=tempo,
-                key=key,
-                timeSignature=time_signature,
-                duration=duration,
+                beats=[BeatPosition(**b) for b in extraction["beats"]],
+                tempo=extraction["tempo"],
+                key=extraction["key"],
+                timeSignature=extraction["timeSignature"],
+                duration=extraction["duration"],
                 title=title,
-                artist=artist
+                artist=artist,
+                jobId=store_extraction(extraction, url, title, artist, segmentation)
             )
             
             logger.info(f"Successfully extracted {len(chord_segments)} chords")
             
             return result
-            
+        
         finally:
-            # Clean up temporary file
-            if os.path.exists(tmp_path):
+            # Clean up temporary file (downloads stay in the download cache)
+            if file and os.path.exists(tmp_path):
                 os.unlink(tmp_path)
-                
+    
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing audio: {e}")
-        raise HTTPException(status_code=500, detail=f"Error processing audio: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing audio: {jobs.error_message(e)}")
+
+@app.get("/inflight")
+async def inflight():
+    """Extractions currently running and how many requests are waiting on each"""
+    return {"extractions": extraction_flights.waiter_counts()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Per-stage latency, resource, cache and queue metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "PhinAccords Audio Processing"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 503 until the analysis workers have loaded their models"""
+    if not ready:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ready", "workers": ANALYSIS_WORKERS}
+
+@app.post("/jobs", response_model=JobSubmission, status_code=202)
+async def submit_job(
+    file: Optional[UploadFile] = File(None),
+    url: Optional[str] = Form(None),
+    title: Optional[str] = Form(None),
+    artist: Optional[str] = Form(None),
+    segmentation: str = Form("frame")
+):
+    """
+    Queue chord extraction for an audio file or URL
+    Returns a job ID at once; poll /status/{job_id} and fetch /jobs/{job_id}/result
+    """
+    if not file and not url:
+        raise HTTPException(status_code=400, detail="Either file or url must be provided")
+    validate_segmentation(segmentation)
+    
+    try:
+        job_id = uuid.uuid4().hex
+        audio_path = None
+        if file:
+            # Uploads are kept with the job so it can be resumed after a restart
+            os.makedirs(JOBS_UPLOAD_DIR, exist_ok=True)
+            audio_path, _ = await save_upload(file, directory=JOBS_UPLOAD_DIR)
+        
+        job_store.create(job_id, audio_path, {"url": url, "title": title, "artist": artist, "segmentation": segmentation})
+        schedule_job(job_id)
+        
+        logger.info(f"Queued job {job_id}")
+        return JobSubmission(jobId=job_id, status="queued")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error queueing job: {e}")
+        raise HTTPException(status_code=500, detail=f"Error queueing job: {jobs.error_message(e)}")
+
 @app.get("/status/{job_id}", response_model=ProcessingStatus)
 async def get_processing_status(job_id: str):
     """Get processing status for async jobs"""
-    # In production, this would check Redis/Celery for job status
-    return ProcessingStatus(status="completed", progress=100.0)
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return ProcessingStatus(
+        status=job["status"],
+        progress=job["progress"],
+        stage=job["stage"],
+        message=job["error"]
+    )
+
+@app.get("/jobs/{job_id}/result", response_model=ExtractionResult)
+async def get_job_result(job_id: str):
+    """Get the extraction result of a completed job"""
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Error processing audio: {job['error']}")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']} ({job['stage']})")
+    
+    return result_from_job(job)
+
+def result_from_job(job: Dict[str, Any]) -> ExtractionResult:
+    params = job["params"]
+    return ExtractionResult(**job["result"], title=params["title"], artist=params["artist"], jobId=job["id"])
+
+# Derived chord views by (job ID, variant); a completed job's result never changes
+chord_view_cache = chord_views.ViewCache()
+
+@app.get("/jobs/{job_id}/chart", response_model=ChordChart)
+async def get_chord_chart(
+    job_id: str,
+    transpose: int = 0,
+    capo: int = 0,
+    simplify: str = "full",
+    quantize: str = "none",
+    spelling: str = "auto"
+):
+    """
+    A completed job's chords transposed by transpose semitones, as the shapes
+    to play with a capo on fret capo, reduced to a simpler vocabulary
+    ("majmin" or "sevenths") and/or one chord per bar (quantize="bar", bars
+    starting on the tracked downbeats); never re-extracts audio
+    """
+    try:
+        chord_views.validate_variant(capo, simplify, quantize, spelling)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    variant = (transpose, capo, simplify, quantize, spelling)
+    chart = chord_view_cache.get((job_id, variant))
+    metrics.count_cache("chord_view", hit=chart is not None)
+    if chart is None:
+        job = job_store.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if job["status"] != "completed":
+            raise HTTPException(status_code=409, detail=f"Job is {job['status']} ({job['stage']})")
+        
+        result = job["result"]
+        segments = [(c["startTime"], c["endTime"], c["chord"]) for c in result["chords"]]
+        bar_starts = None
+        if quantize == "bar":
+            bar_starts = [b["time"] for b in result["beats"] if b["downbeat"]]
+        view = chord_views.chord_view(
+            segments, result["key"], transpose, capo, simplify, spelling, bar_starts, result["duration"]
+        )
+        chart = ChordChart(
+            jobId=job_id,
+            key=view["key"],
+            transpose=transpose,
+            capo=capo,
+            simplify=simplify,
+            quantize=quantize,
+            chords=[ChartChord(startTime=start, endTime=end, chord=label) for start, end, label in view["chords"]]
+        )
+        chord_view_cache.put((job_id, variant), chart)
+    
+    return chart
+
+# How often a job event stream re-reads the job store
+JOB_EVENTS_POLL_SECONDS = 0.5
+
+async def job_events(job_id: str, sse: bool):
+    """
+    Yield a "progress" message whenever a job's stage changes, then a "result"
+    message with its ExtractionResult (or an "error" message)
+    """
+    last = None
+    while True:
+        job = job_store.get(job_id)
+        if job is None:
+            yield stream_message({"type": "error", "detail": "Job not found"}, sse)
+            return
+        if job["status"] == "completed":
+            yield stream_message({"type": "result", "result": result_from_job(job).model_dump()}, sse)
+            return
+        if job["status"] == "failed":
+            yield stream_message({"type": "error", "detail": f"Error processing audio: {job['error']}"}, sse)
+            return
+        
+        progress = (job["status"], job["stage"], job["progress"])
+        if progress != last:
+            last = progress
+            yield stream_message({
+                "type": "progress", "status": job["status"], "stage": job["stage"], "progress": job["progress"]
+            }, sse)
+        await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(request: Request, job_id: str):
+    """
+    Subscribe to a job: streams its progress and then its result as NDJSON
+    (or server-sent events), e.g. to replace a preview with the full extraction
+    """
+    if job_store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    return StreamingResponse(
+        job_events(job_id, sse),
+        media_type="text/event-stream" if sse else "application/x-ndjson"
+    )
 
 if __name__ == "__main__":
     import uvicorn
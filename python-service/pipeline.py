@@ -0,0 +1,771 @@
+"""
+PhinAccords Audio Processing Pipeline
+Heavenkeys Ltd
+
+CPU-bound chord, beat and key extraction with librosa and madmom.
+Kept free of the web app so analysis worker processes can import it
+without pulling in FastAPI.
+"""
+
+import os
+import time
+import subprocess
+from contextlib import contextmanager
+from functools import cached_property
+from multiprocessing import shared_memory
+from typing import Optional, Callable, List, Dict, Any
+import numpy as np
+from loguru import logger
+
+import blockstream
+import chord_templates
+import metrics
+from lazy_imports import lazy_import
+
+# Imported on first use, so the web process can import this module cheaply
+librosa = lazy_import("librosa")
+madmom = lazy_import("madmom")
+soundfile = lazy_import("soundfile")
+
+SAMPLE_RATE = 22050
+HOP_LENGTH = 512
+# madmom's beat and downbeat networks expect 44.1 kHz mono
+MADMOM_SAMPLE_RATE = 44100
+# Bar lengths the downbeat tracker chooses between and the time signature each implies
+TIME_SIGNATURES = {3: "3/4", 4: "4/4", 6: "6/8"}
+DEFAULT_TIME_SIGNATURE = "4/4"
+# Largest distance (seconds) between a beat and a tracked downbeat for them to coincide
+DOWNBEAT_TOLERANCE = 0.1
+
+# Chord segmentation modes -> grid points per beat (0 classifies every chroma frame)
+SEGMENTATIONS = {"frame": 0, "beat": 1, "half-beat": 2}
+
+# Windowed chord recognition for streamed results: core length and the
+# context added on each side (at least half an STFT frame)
+STREAM_WINDOW_SECONDS = float(os.getenv("STREAM_WINDOW_SECONDS", "30"))
+WINDOW_CONTEXT_SECONDS = 0.5
+# Streamed chord windows start on the tuning of this much of the track's
+# opening, rather than wait for the whole track's
+OPENING_TUNING_SECONDS = float(os.getenv("OPENING_TUNING_SECONDS", "30"))
+
+# Tracks longer than LONG_INPUT_SECONDS are extracted as parallel windows of
+# ANALYSIS_WINDOW_SECONDS (0 disables); the bidirectional downbeat network
+# gets BEAT_CONTEXT_SECONDS on each side of a window
+LONG_INPUT_SECONDS = float(os.getenv("LONG_INPUT_SECONDS", "600"))
+ANALYSIS_WINDOW_SECONDS = float(os.getenv("ANALYSIS_WINDOW_SECONDS", "120"))
+BEAT_CONTEXT_SECONDS = 10.0
+# Downbeat activation frame rate; every BEAT_WINDOW_HOP samples (at SAMPLE_RATE)
+# starts both a chroma frame and an activation frame, so windows split there
+BEAT_FPS = 100
+BEAT_WINDOW_HOP = int(np.lcm(HOP_LENGTH, 2 * SAMPLE_RATE // BEAT_FPS))
+
+# Preview quality decodes at this rate and tracks beats with librosa instead of madmom
+PREVIEW_SAMPLE_RATE = 11025
+
+# Tracks longer than BLOCK_STREAMING_SECONDS (0 disables) are read and featurized
+# block by block, so memory stays flat with track length at the cost of decoding
+# twice; this takes precedence over parallel windows
+BLOCK_STREAMING_SECONDS = float(os.getenv("BLOCK_STREAMING_SECONDS", "0"))
+N_FFT = 2048
+
+# Krumhansl-Kessler key profiles, tonic first
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+# The profile of every major key, then every minor key, z-scored so a dot product gives their correlation
+KEY_PROFILES = np.array([np.roll(base, tonic) for base in (MAJOR_PROFILE, MINOR_PROFILE) for tonic in range(12)])
+KEY_PROFILES = (KEY_PROFILES - KEY_PROFILES.mean(axis=1, keepdims=True)) / KEY_PROFILES.std(axis=1, keepdims=True)
+
+# Global variables for models (load once)
+chord_model = None
+beat_tracker = None
+downbeat_processor = None
+downbeat_tracker = None
+
+def load_models():
+    """Load pre-trained models for chord recognition and beat tracking"""
+    global chord_model, beat_tracker, downbeat_processor, downbeat_tracker
+    
+    try:
+        # Initialize madmom beat tracker
+        # Using madmom's built-in DBN beat tracker
+        beat_tracker = madmom.features.beats.DBNBeatTrackingProcessor(fps=100)
+        # One downbeat network feeds both the beat and the downbeat tracker
+        downbeat_processor = madmom.features.downbeats.RNNDownBeatProcessor()
+        downbeat_tracker = madmom.features.downbeats.DBNDownBeatTrackingProcessor(
+            beats_per_bar=list(TIME_SIGNATURES), fps=100
+        )
+        
+        logger.info("Models loaded successfully")
+    except Exception as e:
+        logger.error(f"Error loading models: {e}")
+        raise
+
+def init_worker() -> None:
+    """Pool initializer: load the models unless the worker was forked with them loaded"""
+    if downbeat_tracker is None:
+        load_models()
+
+def worker_status() -> Dict[str, Any]:
+    """This process's pid and memory; run on each worker at boot, after init_worker"""
+    return {"pid": os.getpid(), **metrics.process_memory()}
+
+@metrics.timed("chroma")
+def extract_chroma_features(y: np.ndarray, sr: int, tuning: Optional[float] = None) -> np.ndarray:
+    """Extract chroma features for chord recognition"""
+    # Use librosa to extract chroma features
+    chroma = librosa.feature.chroma_stft(y=y, sr=sr, n_chroma=12, hop_length=HOP_LENGTH, tuning=tuning)
+    return chroma
+
+class SpectralFeatures:
+    """
+    Spectral features of one signal, shared by the stages of a request: the
+    power spectrogram is computed once, on first use, and everything else is
+    derived from it and kept
+    """
+    
+    def __init__(self, y: np.ndarray, sr: int):
+        self.y = y
+        self.sr = sr
+    
+    @cached_property
+    @metrics.timed("stft")
+    def power(self) -> np.ndarray:
+        """The power spectrogram chroma_stft and onset_strength would each compute from y"""
+        return np.abs(librosa.stft(self.y, n_fft=N_FFT, hop_length=HOP_LENGTH)) ** 2
+    
+    @cached_property
+    @metrics.timed("tuning")
+    def tuning(self) -> float:
+        """
+        Tuning deviation exactly as chroma_stft estimates it from the whole signal,
+        so chroma computed window by window can use the same value
+        """
+        return float(librosa.estimate_tuning(S=self.power, sr=self.sr, bins_per_octave=12))
+    
+    @cached_property
+    @metrics.timed("chroma")
+    def chroma(self) -> np.ndarray:
+        """Equal to extract_chroma_features(y, sr)"""
+        return librosa.feature.chroma_stft(S=self.power, sr=self.sr, n_chroma=12, tuning=self.tuning)
+    
+    @cached_property
+    @metrics.timed("onset")
+    def onset_envelope(self) -> np.ndarray:
+        """The onset strength envelope librosa.beat.beat_track would compute from y"""
+        mel = librosa.feature.melspectrogram(S=self.power, sr=self.sr)
+        return librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=self.sr, aggregate=np.median)
+    
+    @cached_property
+    def tonal_profile(self) -> np.ndarray:
+        """Chroma summed over the whole signal"""
+        return self.chroma.sum(axis=1)
+
+@metrics.timed("chords")
+def recognize_chords(chroma: np.ndarray, hop_length: int, sr: int, frame_offset: int = 0,
+                     column_frames: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+    """
+    Recognize chords from chroma features by matching triad templates (see chord_templates)
+    In production, this would use a trained deep neural network
+    frame_offset is the index of the first chroma frame within the whole track
+    column_frames, if given, holds the track frame at which each column starts
+    plus the end of the last one (for chroma aggregated over several frames)
+    """
+    frame_time = hop_length / sr
+    num_columns = chroma.shape[1]
+    if column_frames is None:
+        column_frames = np.arange(num_columns + 1) + frame_offset
+    
+    # Only confident columns can change the chord; the rest extend the current one
+    column_labels = chord_templates.match_chords(chroma)
+    confident_columns = np.flatnonzero(column_labels != chord_templates.NO_CHORD)
+    if not confident_columns.size:
+        return []
+    labels = column_labels[confident_columns]
+    
+    # Run-length encode the confident labels into segments
+    run_starts = np.concatenate(([0], np.flatnonzero(np.diff(labels)) + 1))
+    start_frames = column_frames[confident_columns[run_starts]]
+    end_frames = np.append(start_frames[1:], column_frames[-1])
+    
+    return [
+        {
+            'chord': chord_templates.CHORD_NAMES[label],
+            'startTime': start * frame_time,
+            'endTime': end * frame_time,
+            'confidence': 0.85
+        }
+        for label, start, end in zip(labels[run_starts].tolist(), start_frames.tolist(), end_frames.tolist())
+    ]
+
+def chord_grid(beat_times: List[float], sr: int, subdivisions: int) -> np.ndarray:
+    """
+    Chroma frames at which beat-synchronous chords may change: every beat,
+    split into subdivisions equal parts
+    """
+    beat_frames = librosa.time_to_frames(np.asarray(beat_times, dtype=float), sr=sr, hop_length=HOP_LENGTH)
+    if subdivisions > 1 and len(beat_frames) > 1:
+        positions = np.arange((len(beat_frames) - 1) * subdivisions + 1) / subdivisions
+        beat_frames = np.round(np.interp(positions, np.arange(len(beat_frames)), beat_frames)).astype(int)
+    return np.unique(beat_frames)
+
+def segment_medians(features: np.ndarray, boundaries: np.ndarray) -> np.ndarray:
+    """
+    Median of each feature row over the columns boundaries[i]:boundaries[i + 1]
+    boundaries must start at 0, end at the number of columns and strictly increase
+    """
+    lengths = np.diff(boundaries)
+    # Offsetting each segment past the previous one's values makes one sort order every segment in place
+    offset = (np.max(features, initial=0.0) + 1.0) * np.repeat(np.arange(len(lengths)), lengths)
+    ordered = np.sort(features + offset, axis=1) - offset
+    lower = boundaries[:-1] + (lengths - 1) // 2
+    upper = boundaries[:-1] + lengths // 2
+    return 0.5 * (ordered[:, lower] + ordered[:, upper])
+
+@metrics.timed("beat_sync")
+def recognize_chords_on_grid(chroma: np.ndarray, sr: int, grid: np.ndarray,
+                             frame_offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    Recognize chords once per grid segment instead of once per frame
+    Each segment's chroma is reduced to its median, so chord changes snap to the grid
+    frame_offset is the index of chroma's first frame within the whole track
+    """
+    last_frame = frame_offset + chroma.shape[1]
+    inner = grid[(grid > frame_offset) & (grid < last_frame)]
+    boundaries = np.concatenate(([frame_offset], inner, [last_frame]))
+    
+    synced = segment_medians(chroma, boundaries - frame_offset)
+    return recognize_chords(synced, HOP_LENGTH, sr, column_frames=boundaries)
+
+def infer_beats_per_bar(downbeats: np.ndarray) -> Optional[int]:
+    """
+    Most common bar length in the downbeat tracker's output
+    downbeats holds (time, position in bar) rows; None if no complete bar was tracked
+    """
+    positions = downbeats[:, 1].astype(int)
+    # The beat before each downbeat (after the first) closes a bar
+    bar_ends = np.flatnonzero(positions == 1)[1:] - 1
+    if not bar_ends.size:
+        return None
+    return int(np.bincount(positions[bar_ends]).argmax())
+
+def label_beats(beats: np.ndarray, downbeat_times: np.ndarray, beats_per_bar: int) -> List[Dict[str, Any]]:
+    """
+    Mark the beats that coincide with a tracked downbeat and number each beat within its bar
+    Beats are matched to their nearest downbeat with a binary search over the sorted downbeat times
+    """
+    is_downbeat = np.zeros(len(beats), dtype=bool)
+    if len(downbeat_times) and len(beats):
+        right = np.searchsorted(downbeat_times, beats)
+        left = np.clip(right - 1, 0, len(downbeat_times) - 1)
+        right = np.clip(right, 0, len(downbeat_times) - 1)
+        nearest = np.minimum(np.abs(beats - downbeat_times[left]), np.abs(downbeat_times[right] - beats))
+        is_downbeat = nearest < DOWNBEAT_TOLERANCE
+    
+    # Count from the latest downbeat; pickup beats before the first one count back from it
+    index = np.arange(len(beats))
+    last_downbeat = np.maximum.accumulate(np.where(is_downbeat, index, -1))
+    first_downbeat = int(np.argmax(is_downbeat)) if is_downbeat.any() else 0
+    numbers = np.where(
+        last_downbeat >= 0,
+        index - last_downbeat + 1,
+        (index - first_downbeat) % beats_per_bar + 1
+    )
+    
+    return [
+        {'time': time, 'beat': number, 'downbeat': downbeat}
+        for time, number, downbeat in zip(beats.tolist(), numbers.tolist(), is_downbeat.tolist())
+    ]
+
+@metrics.timed("beats")
+def track_beats(y: np.ndarray, sr: int, features: Optional[SpectralFeatures] = None) -> tuple:
+    """
+    Track beats and downbeats using madmom
+    A single downbeat-network pass feeds both trackers
+    Returns (beat_positions, tempo, time_signature)
+    The librosa fallback uses features' onset envelope when given
+    """
+    try:
+        signal = madmom.audio.Signal(
+            librosa.resample(y, orig_sr=sr, target_sr=MADMOM_SAMPLE_RATE),
+            sample_rate=MADMOM_SAMPLE_RATE, num_channels=1
+        )
+        return beats_from_activations([downbeat_processor(signal)])
+    except Exception as e:
+        logger.error(f"Error tracking beats: {e}")
+        # Fallback to librosa tempo
+        return track_beats_librosa(features or SpectralFeatures(y, sr))
+
+def beats_from_activations(activation_parts: List[np.ndarray]) -> tuple:
+    """
+    Beats, tempo and time signature from downbeat network activations of a
+    whole track, possibly stitched from windows; one DBN pass over the whole
+    track keeps the beat grid continuous across window edges
+    """
+    if beat_tracker is None:
+        load_models()
+    
+    # Columns are beat and downbeat activations; together they give every beat
+    act = np.concatenate(activation_parts)
+    beats = beat_tracker(act.sum(axis=1))
+    downbeats = downbeat_tracker(act)
+    
+    beats_per_bar = infer_beats_per_bar(downbeats)
+    time_signature = TIME_SIGNATURES.get(beats_per_bar, DEFAULT_TIME_SIGNATURE)
+    beat_positions = label_beats(beats, downbeats[downbeats[:, 1] == 1, 0], beats_per_bar or 4)
+    
+    tempo = float(np.mean(1.0 / np.diff(beats)) * 60) if len(beats) > 1 else 120.0
+    return beat_positions, tempo, time_signature
+
+@metrics.timed("beat_window")
+def compute_beat_window(y: np.ndarray, sr: int, window: Dict[str, int]) -> np.ndarray:
+    """
+    Downbeat network activations of one window's core frames, computed over the
+    whole window so the network sees context on both sides
+    Window edges must be multiples of BEAT_WINDOW_HOP
+    """
+    signal = madmom.audio.Signal(
+        librosa.resample(y[window["start"]:window["stop"]], orig_sr=sr, target_sr=MADMOM_SAMPLE_RATE),
+        sample_rate=MADMOM_SAMPLE_RATE, num_channels=1
+    )
+    act = downbeat_processor(signal)
+    
+    frame_samples = sr / BEAT_FPS
+    first = int(round((window["core_start"] - window["start"]) / frame_samples))
+    count = int(np.ceil(window["core_stop"] / frame_samples)) - int(round(window["core_start"] / frame_samples))
+    return np.array(act[first:first + count])
+
+def track_beats_librosa(features: SpectralFeatures) -> tuple:
+    """
+    Track beats with librosa, assuming 4/4 with the first beat on a downbeat
+    Returns (beat_positions, tempo, time_signature) like track_beats
+    """
+    tempo, beats = librosa.beat.beat_track(
+        onset_envelope=features.onset_envelope, sr=features.sr, hop_length=HOP_LENGTH, units='time'
+    )
+    beat_positions = [{'time': float(b), 'beat': i % 4 + 1, 'downbeat': i % 4 == 0} for i, b in enumerate(beats)]
+    return beat_positions, float(np.atleast_1d(tempo)[0]), DEFAULT_TIME_SIGNATURE
+
+def key_from_chroma_profile(profile: np.ndarray) -> str:
+    """
+    Key whose Krumhansl-Kessler profile correlates best with a tonal profile
+    (chroma summed over the track), as 'E' for a major key or 'C#m' for a minor one
+    """
+    if not np.any(profile):
+        return 'C'
+    best = int(np.argmax(KEY_PROFILES @ (profile - profile.mean())))
+    return PITCH_CLASSES[best % 12] + ('m' if best >= 12 else '')
+
+@metrics.timed("key")
+def estimate_key(features: SpectralFeatures) -> str:
+    """Estimate the key of the song from its tonal profile"""
+    return key_from_chroma_profile(features.tonal_profile)
+
+def estimate_tonality(y: np.ndarray, sr: int) -> tuple:
+    """(tuning, key) of a whole signal from a single spectrogram"""
+    features = SpectralFeatures(y, sr)
+    return features.tuning, estimate_key(features)
+
+@metrics.timed("decode")
+def decode_audio(audio_path: str) -> tuple:
+    """Decode an audio file to mono at SAMPLE_RATE; returns (y, sr)"""
+    return librosa.load(audio_path, sr=SAMPLE_RATE, duration=None)
+
+def extract_from_file(tmp_path: str, progress: Optional[Callable[[str], None]] = None,
+                      segmentation: str = "frame") -> Dict[str, Any]:
+    """
+    Run the full extraction on an audio file
+    Returns chords, beats, tempo, key, time signature and duration
+    progress, if given, is called with each stage name as it starts
+    segmentation is one of SEGMENTATIONS: chords per chroma frame, per beat or per half beat
+    """
+    report = progress or (lambda stage: None)
+    if beat_tracker is None:
+        load_models()
+    if use_block_streaming(tmp_path):
+        return extract_streaming(tmp_path, report, segmentation)
+    
+    # Load audio file
+    report("decoding")
+    logger.info(f"Loading audio from: {tmp_path}")
+    y, sr = decode_audio(tmp_path)
+    duration = len(y) / sr
+    features = SpectralFeatures(y, sr)
+    
+    # Extract chroma features
+    report("chroma")
+    chroma = features.chroma
+    
+    # Track beats
+    report("beats")
+    logger.info("Tracking beats...")
+    beat_positions, tempo, time_signature = track_beats(y, sr, features)
+    
+    # Recognize chords
+    report("chords")
+    logger.info("Recognizing chords...")
+    subdivisions = SEGMENTATIONS[segmentation]
+    if subdivisions:
+        grid = chord_grid([b['time'] for b in beat_positions], sr, subdivisions)
+        chord_segments = recognize_chords_on_grid(chroma, sr, grid)
+    else:
+        chord_segments = recognize_chords(chroma, HOP_LENGTH, sr)
+    
+    # Estimate key
+    report("key")
+    key = estimate_key(features)
+    
+    return {
+        "chords": chord_segments,
+        "beats": beat_positions,
+        "tempo": tempo,
+        "key": key,
+        "timeSignature": time_signature,
+        "duration": duration,
+    }
+
+@metrics.timed("preview")
+def preview_from_file(tmp_path: str, segmentation: str = "frame") -> Dict[str, Any]:
+    """
+    Fast approximate extraction for quality=preview: the same chroma template
+    matching and key estimate as extract_from_file, but on a decode at
+    PREVIEW_SAMPLE_RATE and with librosa's beat tracker instead of madmom's networks
+    """
+    y, sr = librosa.load(tmp_path, sr=PREVIEW_SAMPLE_RATE, duration=None)
+    features = SpectralFeatures(y, sr)
+    chroma = features.chroma
+    beat_positions, tempo, time_signature = track_beats_librosa(features)
+    
+    subdivisions = SEGMENTATIONS[segmentation]
+    if subdivisions:
+        grid = chord_grid([b['time'] for b in beat_positions], sr, subdivisions)
+        chord_segments = recognize_chords_on_grid(chroma, sr, grid)
+    else:
+        chord_segments = recognize_chords(chroma, HOP_LENGTH, sr)
+    
+    return {
+        "chords": chord_segments,
+        "beats": beat_positions,
+        "tempo": tempo,
+        "key": estimate_key(features),
+        "timeSignature": time_signature,
+        "duration": len(y) / sr,
+    }
+
+def probe_duration(audio_path: str) -> Optional[float]:
+    """
+    Duration of an audio file in seconds, read from its header without decoding
+    Returns None when neither libsndfile nor ffprobe can tell
+    """
+    try:
+        return float(soundfile.info(audio_path).duration)
+    except Exception:
+        pass
+    
+    try:
+        probe = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", audio_path],
+            capture_output=True, text=True, timeout=30
+        )
+        return float(probe.stdout.strip())
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+def decode_to_shared_memory(tmp_path: str) -> Dict[str, Any]:
+    """
+    Decode an audio file into shared memory so stages running in other
+    worker processes can read the same samples without copying or decoding.
+    The caller must release_shared_signal() the returned handle.
+    """
+    started = time.perf_counter()
+    y, sr = decode_audio(tmp_path)
+    decode_time = time.perf_counter() - started
+    
+    shm = shared_memory.SharedMemory(create=True, size=max(y.nbytes, 1))
+    np.ndarray(y.shape, dtype=y.dtype, buffer=shm.buf)[...] = y
+    shm.close()
+    
+    return {"name": shm.name, "shape": y.shape, "dtype": y.dtype.str, "sample_rate": sr, "decode_time": decode_time}
+
+def release_shared_signal(handle: Dict[str, Any]) -> None:
+    """Free the shared memory behind a decoded signal"""
+    try:
+        shm = shared_memory.SharedMemory(name=handle["name"])
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+@contextmanager
+def attached_signal(handle: Dict[str, Any]):
+    """Attach to a signal decoded by decode_to_shared_memory()"""
+    shm = shared_memory.SharedMemory(name=handle["name"])
+    y = None
+    try:
+        y = np.ndarray(handle["shape"], dtype=np.dtype(handle["dtype"]), buffer=shm.buf)
+        yield y
+    finally:
+        # Views into the buffer must be gone before it can be closed
+        del y
+        try:
+            shm.close()
+        except BufferError:
+            # A traceback still references the buffer; it is unmapped once collected
+            pass
+
+def plan_windows(num_samples: int, window_seconds: float, context_seconds: float,
+                 hop_size: int = HOP_LENGTH, grid: Optional[np.ndarray] = None) -> List[Dict[str, int]]:
+    """
+    Split a signal into consecutive core regions of about window_seconds, each
+    extended by context_seconds on both sides. All boundaries fall on multiples
+    of hop_size, so a window's frames line up with the full signal's frames.
+    With a grid of frame indices, boundaries move to the nearest grid frame so
+    no grid segment straddles two windows.
+    """
+    core = max(hop_size, int(window_seconds * SAMPLE_RATE) // hop_size * hop_size)
+    context = int(np.ceil(context_seconds * SAMPLE_RATE / hop_size)) * hop_size
+    
+    boundaries = np.arange(core, num_samples, core)
+    if grid is not None and len(grid) and len(boundaries):
+        grid_samples = np.asarray(grid) * hop_size
+        right = np.clip(np.searchsorted(grid_samples, boundaries), 0, len(grid_samples) - 1)
+        left = np.clip(right - 1, 0, len(grid_samples) - 1)
+        closer_left = boundaries - grid_samples[left] < grid_samples[right] - boundaries
+        boundaries = np.unique(np.where(closer_left, grid_samples[left], grid_samples[right]))
+        boundaries = boundaries[(boundaries > 0) & (boundaries < num_samples)]
+    edges = [0] + boundaries.tolist() + [num_samples]
+    
+    windows = []
+    for core_start, core_stop in zip(edges[:-1], edges[1:]):
+        windows.append({
+            "start": max(0, core_start - context),
+            "stop": min(num_samples, core_stop + context),
+            "core_start": core_start,
+            "core_stop": core_stop,
+        })
+    return windows
+
+def core_frames(window: Dict[str, int], num_samples: int) -> tuple:
+    """
+    (first, last) whole-signal frames of a window's core region; consecutive
+    windows' core frames tile the signal's frames
+    """
+    first_frame = window["core_start"] // HOP_LENGTH
+    # Like librosa's centred framing, the last window keeps the final frame
+    if window["core_stop"] == num_samples:
+        last_frame = 1 + num_samples // HOP_LENGTH
+    else:
+        last_frame = window["core_stop"] // HOP_LENGTH
+    return first_frame, last_frame
+
+def window_core(features: np.ndarray, window: Dict[str, int], num_samples: int) -> np.ndarray:
+    """The core frames of features computed over a whole window"""
+    first_frame, last_frame = core_frames(window, num_samples)
+    local_first = first_frame - window["start"] // HOP_LENGTH
+    return features[:, local_first:local_first + last_frame - first_frame]
+
+@metrics.timed("tuning_window")
+def tuning_window(y: np.ndarray, sr: int, window: Dict[str, int]) -> np.ndarray:
+    """
+    Tuning histogram of one window's core frames (see blockstream.tuning_histogram);
+    the peak of the windows' summed histograms is the track's tuning
+    """
+    power = np.abs(librosa.stft(y[window["start"]:window["stop"]], n_fft=N_FFT, hop_length=HOP_LENGTH)) ** 2
+    return blockstream.tuning_histogram(window_core(power, window, len(y)), sr)
+
+@metrics.timed("chord_window")
+def recognize_chord_window(y: np.ndarray, sr: int, window: Dict[str, int], tuning: float,
+                           grid: Optional[np.ndarray] = None) -> tuple:
+    """
+    Recognize chords in one window's core region, per frame or, given a grid
+    from chord_grid(), per grid segment
+    Chroma frames are centred on multiples of the hop, so the core frames match
+    the full-signal chroma exactly when the same tuning is used
+    Returns (chords, end_time, profile) where end_time is the end of the core
+    region and profile its chroma summed, to add up into the track's tonal profile
+    """
+    chroma = extract_chroma_features(y[window["start"]:window["stop"]], sr, tuning=tuning)
+    first_frame, last_frame = core_frames(window, len(y))
+    core_chroma = window_core(chroma, window, len(y))
+    
+    if grid is not None:
+        chords = recognize_chords_on_grid(core_chroma, sr, grid, frame_offset=first_frame)
+    else:
+        chords = recognize_chords(core_chroma, HOP_LENGTH, sr, frame_offset=first_frame)
+    return chords, last_frame * (HOP_LENGTH / sr), core_chroma.sum(axis=1)
+
+def merge_chord_windows(chords: List[Dict[str, Any]], window_chords: List[Dict[str, Any]],
+                        window_end: float) -> None:
+    """
+    Append one window's chords to the chords recognized so far, in place,
+    joining segments across the boundary the way a single pass would
+    """
+    if not chords:
+        chords.extend(window_chords)
+        return
+    
+    if not window_chords:
+        # No confident frames: the current chord carries on through this window
+        chords[-1]['endTime'] = window_end
+        return
+    
+    first = window_chords[0]
+    if first['chord'] == chords[-1]['chord']:
+        chords[-1]['endTime'] = first['endTime']
+        chords.extend(window_chords[1:])
+    else:
+        chords[-1]['endTime'] = first['startTime']
+        chords.extend(window_chords)
+
+def use_block_streaming(audio_path: str, duration: Optional[float] = None) -> bool:
+    """Whether to extract a track block by block (see BLOCK_STREAMING_SECONDS); probes duration if not given"""
+    if not BLOCK_STREAMING_SECONDS:
+        return False
+    if duration is None:
+        duration = probe_duration(audio_path)
+    return bool(duration and duration > BLOCK_STREAMING_SECONDS) and blockstream.can_stream(audio_path)
+
+class BeatWindowStream:
+    """
+    Downbeat activations of a signal pushed in blocks, computed window by window
+    with the same windows plan_windows gives extract_windowed, so only about one
+    window of samples is held at a time
+    """
+    
+    def __init__(self, sr: int):
+        self.sr = sr
+        self.core = max(BEAT_WINDOW_HOP, int(ANALYSIS_WINDOW_SECONDS * SAMPLE_RATE) // BEAT_WINDOW_HOP * BEAT_WINDOW_HOP)
+        self.context = int(np.ceil(BEAT_CONTEXT_SECONDS * SAMPLE_RATE / BEAT_WINDOW_HOP)) * BEAT_WINDOW_HOP
+        self.buffer = np.zeros(0, dtype=np.float32)
+        # Track sample positions of the buffer's first sample and of the next window's core
+        self.buffer_start = 0
+        self.core_start = 0
+    
+    @property
+    def buffer_end(self) -> int:
+        return self.buffer_start + len(self.buffer)
+    
+    def push(self, y: np.ndarray) -> List[np.ndarray]:
+        """Append samples; returns activations of the windows they complete"""
+        self.buffer = np.concatenate((self.buffer, y))
+        parts = []
+        while self.buffer_end >= self.core_start + self.core + self.context:
+            parts.append(self._next_window(self.core_start + self.core))
+        return parts
+    
+    def finish(self) -> List[np.ndarray]:
+        """Activations of the remaining windows, up to the end of the signal"""
+        parts = []
+        while self.core_start < self.buffer_end:
+            parts.append(self._next_window(min(self.core_start + self.core, self.buffer_end)))
+        return parts
+    
+    def _next_window(self, core_stop: int) -> np.ndarray:
+        start = max(0, self.core_start - self.context)
+        stop = min(self.buffer_end, core_stop + self.context)
+        # Window edges are multiples of BEAT_WINDOW_HOP, so relative to start they still are
+        window = {
+            "start": 0,
+            "stop": stop - start,
+            "core_start": self.core_start - start,
+            "core_stop": core_stop - start,
+        }
+        samples = self.buffer[start - self.buffer_start:stop - self.buffer_start]
+        activations = compute_beat_window(samples, self.sr, window)
+        
+        self.core_start = core_stop
+        keep_from = max(0, self.core_start - self.context)
+        self.buffer = self.buffer[keep_from - self.buffer_start:]
+        self.buffer_start = keep_from
+        return activations
+
+@metrics.timed("tuning")
+def estimate_streamed_tuning(audio_path: str) -> float:
+    """SpectralFeatures.tuning of a whole file, reading it block by block"""
+    return blockstream.estimate_tuning(audio_path, SAMPLE_RATE, N_FFT, HOP_LENGTH)
+
+@metrics.timed("chroma")
+def chroma_from_power(S: np.ndarray, sr: int, tuning: float) -> np.ndarray:
+    """extract_chroma_features for frames of a power spectrogram"""
+    return librosa.feature.chroma_stft(S=S, sr=sr, n_chroma=12, tuning=tuning)
+
+def extract_streaming(tmp_path: str, report: Callable[[str], None], segmentation: str) -> Dict[str, Any]:
+    """
+    extract_from_file for long tracks, reading the audio in blocks: a first pass
+    estimates tuning, a second computes chroma, feeds the chord matcher and
+    collects downbeat activations. Chroma frames equal the in-memory path's, so
+    the chords do too.
+    """
+    sr = SAMPLE_RATE
+    report("decoding")
+    logger.info(f"Streaming audio from: {tmp_path}")
+    tuning = estimate_streamed_tuning(tmp_path)
+    
+    report("chroma")
+    subdivisions = SEGMENTATIONS[segmentation]
+    stft = blockstream.BlockSTFT(N_FFT, HOP_LENGTH)
+    beat_windows = BeatWindowStream(sr)
+    activations, chroma_blocks, chords = [], [], []
+    profile = np.zeros(12)
+    num_samples = num_frames = 0
+    
+    def consume(S: np.ndarray) -> None:
+        nonlocal num_frames
+        chroma = chroma_from_power(S, sr, tuning)
+        profile[:] += chroma.sum(axis=1)
+        if subdivisions:
+            # Beat-synchronous chords need the beats first; chroma is small enough to keep
+            chroma_blocks.append(chroma)
+        else:
+            block_chords = recognize_chords(chroma, HOP_LENGTH, sr, frame_offset=num_frames)
+            merge_chord_windows(chords, block_chords, (num_frames + chroma.shape[1]) * HOP_LENGTH / sr)
+        num_frames += chroma.shape[1]
+    
+    for y in blockstream.read_blocks(tmp_path, sr):
+        num_samples += len(y)
+        activations.extend(beat_windows.push(y))
+        for S in stft.push(y):
+            consume(S)
+    for S in stft.finish():
+        consume(S)
+    activations.extend(beat_windows.finish())
+    
+    report("beats")
+    beat_positions, tempo, time_signature = beats_from_activations(activations)
+    
+    report("chords")
+    if subdivisions:
+        grid = chord_grid([b['time'] for b in beat_positions], sr, subdivisions)
+        chords = recognize_chords_on_grid(np.concatenate(chroma_blocks, axis=1), sr, grid)
+    
+    report("key")
+    return {
+        "chords": chords,
+        "beats": beat_positions,
+        "tempo": tempo,
+        "key": key_from_chroma_profile(profile),
+        "timeSignature": time_signature,
+        "duration": num_samples / sr,
+    }
+
+def estimate_opening_tuning(y: np.ndarray, sr: int) -> float:
+    """The tuning of the first OPENING_TUNING_SECONDS of a signal"""
+    return SpectralFeatures(y[:int(OPENING_TUNING_SECONDS * sr)], sr).tuning
+
+# Stages that can run in a worker on a shared signal; each takes (y, sr, *args)
+SIGNAL_STAGES = {
+    "tonality": estimate_tonality,
+    "opening_tuning": estimate_opening_tuning,
+    "tuning_window": tuning_window,
+    "chord_window": recognize_chord_window,
+    "beats": track_beats,
+    "beat_window": compute_beat_window,
+}
+
+def run_signal_stage(stage: str, handle: Dict[str, Any], *args):
+    """Run one stage in a worker on a signal decoded by decode_to_shared_memory()"""
+    if beat_tracker is None:
+        load_models()
+    with attached_signal(handle) as y:
+        return SIGNAL_STAGES[stage](y, handle["sample_rate"], *args)
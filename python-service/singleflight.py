@@ -0,0 +1,73 @@
+"""
+In-flight Request Coalescing - PhinAccords
+Heavenkeys Ltd
+
+Concurrent requests for the same work (same audio content or video) attach
+to one running computation and all receive its result. The computation is
+only cancelled once every request waiting on it has gone away.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+from starlette.requests import Request
+
+class ClientDisconnected(Exception):
+    """The client went away before the result was ready"""
+
+async def wait_for_disconnect(request: Request) -> None:
+    """Return once the client of a request (whose body has been read) disconnects"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single task"""
+    
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+    
+    async def run(self, key: str, start: Callable[[], Awaitable[Any]], request: Optional[Request] = None) -> Any:
+        """
+        Await the result for key, calling start() only if no call for key is running
+        With a request, raises ClientDisconnected if its client leaves first; the
+        shared computation is cancelled only when its last waiter leaves
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(start()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        
+        flight.waiters += 1
+        watcher = asyncio.ensure_future(wait_for_disconnect(request)) if request is not None else None
+        try:
+            # Shielded so one waiter being cancelled does not cancel the others' result
+            result = asyncio.shield(flight.task)
+            if watcher is None:
+                return await result
+            
+            done, _ = await asyncio.wait({result, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if result in done:
+                return result.result()
+            result.cancel()
+            raise ClientDisconnected(f"Client disconnected while waiting for {key}")
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+    
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+    
+    def waiter_counts(self) -> Dict[str, int]:
+        """Number of requests waiting on each running computation"""
+        return {key: flight.waiters for key, flight in self._flights.items()}
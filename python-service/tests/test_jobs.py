@@ -0,0 +1,60 @@
+"""
+Job Store Tests - PhinAccords
+Heavenkeys Ltd
+"""
+
+import pytest
+
+pytest.importorskip("madmom")
+
+import jobs
+from jobs import JobStore
+
+RESULT = {"chords": [], "beats": [], "tempo": 120.0, "key": "C", "timeSignature": "4/4", "duration": 1.0}
+PARAMS = {"url": None, "title": "Song", "artist": None, "segmentation": "frame"}
+
+def test_job_moves_through_its_stages(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    store.create("job", None, PARAMS)
+    assert (store.get("job")["status"], store.get("job")["params"]) == ("queued", PARAMS)
+    
+    store.set_stage("job", "chroma")
+    job = store.get("job")
+    assert (job["status"], job["stage"], job["progress"]) == ("processing", "chroma", jobs.STAGE_PROGRESS["chroma"])
+    store.complete("job", RESULT)
+    job = store.get("job")
+    assert (job["status"], job["progress"], job["result"]) == ("completed", 100.0, RESULT)
+
+def test_completed_extraction_is_served_by_id(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    store.add_completed("sync", PARAMS, RESULT)
+    job = store.get("sync")
+    assert (job["status"], job["stage"], job["params"], job["result"]) == ("completed", "completed", PARAMS, RESULT)
+    # Nothing for a restart to resume
+    assert store.requeue_unfinished() == []
+
+def test_finished_jobs_expire(tmp_path, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(jobs.time, "time", lambda: now[0])
+    store = JobStore(str(tmp_path / "jobs.db"), ttl_seconds=60)
+    store.add_completed("done", PARAMS, RESULT)
+    store.create("waiting", None, PARAMS)
+    
+    now[0] += 61
+    assert store.get("done") is None
+    assert store.get("waiting")["status"] == "queued"
+
+def test_requeue_unfinished_resets_interrupted_jobs(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    store.create("first", None, PARAMS)
+    store.create("second", None, PARAMS)
+    store.set_stage("second", "beats")
+    store.create("failed", None, PARAMS)
+    store.fail("failed", "bad audio")
+    
+    assert store.requeue_unfinished() == ["first", "second"]
+    assert (store.get("second")["status"], store.get("second")["progress"]) == ("queued", 0)
+
+def test_error_message_never_empty():
+    assert jobs.error_message(ValueError("bad audio")) == "bad audio"
+    assert jobs.error_message(EOFError()) == "EOFError"
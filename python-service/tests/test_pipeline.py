@@ -0,0 +1,120 @@
+"""
+Extraction Pipeline Tests - PhinAccords
+Heavenkeys Ltd
+
+Only the parts that need no model; importing the pipeline still needs madmom installed.
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("madmom")
+
+import blockstream
+import pipeline
+
+SR = pipeline.SAMPLE_RATE
+# I-vi-IV-V in C, two seconds per chord, as MIDI notes
+PROGRESSION = [(60, 64, 67), (57, 60, 64), (53, 57, 60), (55, 59, 62)]
+
+def synthetic_track(seconds: float, detune: float = 0.0) -> np.ndarray:
+    """Chords of harmonic tones, detune semitones off concert pitch"""
+    t = np.arange(int(seconds * SR)) / SR
+    y = np.zeros_like(t)
+    for i, start in enumerate(np.arange(0.0, seconds, 2.0)):
+        held = (t >= start) & (t < start + 2.0)
+        for note in PROGRESSION[i % len(PROGRESSION)]:
+            frequency = 440.0 * 2 ** ((note + detune - 69) / 12)
+            for harmonic in (1, 2, 3):
+                y[held] += np.sin(2 * np.pi * frequency * harmonic * t[held]) / harmonic
+    return (0.1 * y).astype(np.float32)
+
+def test_recognize_chords_labels_the_progression():
+    chroma = pipeline.extract_chroma_features(synthetic_track(8.0), SR)
+    chords = pipeline.recognize_chords(chroma, pipeline.HOP_LENGTH, SR)
+    assert [c["chord"] for c in chords] == ["C", "Am", "F", "G"]
+    assert [round(c["startTime"]) for c in chords] == [0, 2, 4, 6]
+
+def test_segment_medians_match_numpy_median():
+    rng = np.random.default_rng(0)
+    features = rng.random((12, 40))
+    boundaries = np.array([0, 1, 4, 10, 11, 25, 40])
+    expected = np.stack([np.median(features[:, a:b], axis=1) for a, b in zip(boundaries[:-1], boundaries[1:])], axis=1)
+    np.testing.assert_allclose(pipeline.segment_medians(features, boundaries), expected)
+
+def test_label_beats_numbers_beats_within_bars():
+    beats = np.array([0.0, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5])
+    # The first downbeat comes after a pickup beat; 1.98 is within the tolerance of 2.0
+    labelled = pipeline.label_beats(beats, np.array([0.5, 1.98]), 3)
+    assert [(b["beat"], b["downbeat"]) for b in labelled] == [
+        (3, False), (1, True), (2, False), (3, False), (1, True), (2, False), (3, False), (4, False)
+    ]
+    assert [b["beat"] for b in pipeline.label_beats(beats[:3], np.array([]), 4)] == [1, 2, 3]
+
+def test_infer_beats_per_bar():
+    downbeats = np.array([[t, p] for t, p in zip(range(10), [1, 2, 3, 1, 2, 3, 1, 2, 3, 1])], dtype=float)
+    assert pipeline.infer_beats_per_bar(downbeats) == 3
+    assert pipeline.infer_beats_per_bar(downbeats[:2]) is None
+
+def chord(label, start, end):
+    return {"chord": label, "startTime": start, "endTime": end, "confidence": 0.85}
+
+def test_merge_chord_windows_joins_chords_across_boundaries():
+    chords = []
+    pipeline.merge_chord_windows(chords, [chord("C", 0.0, 4.0), chord("G", 4.0, 10.0)], 10.0)
+    # The same chord carries on over the boundary
+    pipeline.merge_chord_windows(chords, [chord("G", 10.5, 12.0), chord("Am", 12.0, 20.0)], 20.0)
+    # No confident frames: the chord carries on through the window
+    pipeline.merge_chord_windows(chords, [], 30.0)
+    pipeline.merge_chord_windows(chords, [chord("F", 31.0, 40.0)], 40.0)
+    assert chords == [
+        chord("C", 0.0, 4.0), chord("G", 4.0, 12.0), chord("Am", 12.0, 31.0), chord("F", 31.0, 40.0)
+    ]
+
+def windowed_chords(y, windows, tuning, grid=None):
+    chords, profile = [], np.zeros(12)
+    for window in windows:
+        window_chords, window_end, window_profile = pipeline.recognize_chord_window(y, SR, window, tuning, grid)
+        pipeline.merge_chord_windows(chords, window_chords, window_end)
+        profile += window_profile
+    return chords, profile
+
+def assert_same_chords(windowed, whole):
+    assert [c["chord"] for c in windowed] == [c["chord"] for c in whole]
+    for ours, theirs in zip(windowed, whole):
+        assert ours["startTime"] == pytest.approx(theirs["startTime"])
+        assert ours["endTime"] == pytest.approx(theirs["endTime"])
+
+def test_windowed_extraction_equals_a_single_pass():
+    y = synthetic_track(41.3, detune=0.3)
+    features = pipeline.SpectralFeatures(y, SR)
+    whole = pipeline.recognize_chords(features.chroma, pipeline.HOP_LENGTH, SR)
+    
+    # Window boundaries fall mid-chord, so segments have to be joined across them
+    windows = pipeline.plan_windows(len(y), 7.0, pipeline.WINDOW_CONTEXT_SECONDS)
+    tuning = blockstream.tuning_from_histogram(sum(pipeline.tuning_window(y, SR, w) for w in windows))
+    assert tuning == pytest.approx(features.tuning, abs=blockstream.TUNING_RESOLUTION)
+    
+    chords, profile = windowed_chords(y, windows, features.tuning)
+    assert_same_chords(chords, whole)
+    assert whole[-1]["endTime"] == chords[-1]["endTime"]
+    np.testing.assert_allclose(profile, features.tonal_profile, rtol=1e-4)
+    assert pipeline.key_from_chroma_profile(profile) == pipeline.estimate_key(features) == "C"
+
+def test_windowed_beat_synchronous_extraction_equals_a_single_pass():
+    y = synthetic_track(30.0)
+    features = pipeline.SpectralFeatures(y, SR)
+    grid = pipeline.chord_grid(list(np.arange(0.25, 30.0, 0.5)), SR, 2)
+    whole = pipeline.recognize_chords_on_grid(features.chroma, SR, grid)
+    
+    windows = pipeline.plan_windows(len(y), 7.0, pipeline.WINDOW_CONTEXT_SECONDS, grid=grid)
+    assert all(w["core_start"] // pipeline.HOP_LENGTH in grid for w in windows[1:])
+    chords, _ = windowed_chords(y, windows, features.tuning, grid)
+    assert_same_chords(chords, whole)
+
+def test_core_frames_tile_the_signal():
+    num_samples = 20 * SR + 77
+    windows = pipeline.plan_windows(num_samples, 3.0, pipeline.WINDOW_CONTEXT_SECONDS)
+    cores = [pipeline.core_frames(w, num_samples) for w in windows]
+    assert cores[0][0] == 0 and cores[-1][1] == 1 + num_samples // pipeline.HOP_LENGTH
+    assert all(before[1] == after[0] for before, after in zip(cores, cores[1:]))
@@ -0,0 +1,23 @@
+"""
+Analysis Worker Preload - PhinAccords
+Heavenkeys Ltd
+
+Imported once by the fork server the analysis workers are forked from (see
+PRELOAD_MODELS in main.py). Libraries and models load here a single time,
+and every worker forked afterwards shares them copy-on-write.
+"""
+
+import gc
+import time
+from loguru import logger
+
+started = time.perf_counter()
+try:
+    import pipeline
+    pipeline.load_models()
+    # Objects alive now are never collected, so collections in the workers leave their pages shared
+    gc.freeze()
+    logger.info(f"Preloaded models for the analysis workers in {time.perf_counter() - started:.2f}s")
+except Exception as e:
+    # The fork server must come up regardless; workers then load their own models
+    logger.error(f"Error preloading models, workers will load their own: {e}")
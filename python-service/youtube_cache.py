@@ -0,0 +1,211 @@
+"""
+YouTube Audio Cache - PhinAccords
+Heavenkeys Ltd
+
+Downloaded YouTube audio kept on disk by video ID in the codec YouTube
+serves it in (librosa falls back to ffmpeg for it, so nothing is re-encoded).
+Concurrent requests for the same video, from threads or worker processes,
+wait for one download, and the cache is trimmed least recently used first.
+"""
+
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import importlib
+import threading
+from contextlib import contextmanager
+from typing import Optional, Dict, Any
+from loguru import logger
+
+import metrics
+
+YOUTUBE_CACHE_DIR = os.getenv("YOUTUBE_CACHE_DIR", os.path.join("cache", "youtube"))
+YOUTUBE_CACHE_MAX_BYTES = int(os.getenv("YOUTUBE_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Fetcher class as "module:Class", e.g. a local fake extractor in tests
+YOUTUBE_FETCHER = os.getenv("YOUTUBE_FETCHER", "")
+# Files used this recently are never evicted, so a running analysis keeps its audio
+EVICTION_GRACE_SECONDS = 600
+
+YOUTUBE_ID_PATTERN = re.compile(
+    r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|embed/|shorts/|live/|v/)|youtu\.be/)([A-Za-z0-9_-]{11})"
+)
+
+def video_id(url: str) -> Optional[str]:
+    """Extract the canonical video ID from a YouTube URL, if present"""
+    match = YOUTUBE_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+def cache_key(url: str) -> str:
+    """Cache key for a URL: the video ID, or a hash of other URLs"""
+    vid = video_id(url)
+    if vid:
+        return f"youtube-{vid}"
+    return f"url-{hashlib.sha256(url.encode()).hexdigest()[:32]}"
+
+class YtDlpFetcher:
+    """Downloads the best audio-only stream with yt-dlp, as served"""
+    
+    def fetch(self, url: str, output_stem: str) -> tuple:
+        """
+        Download url's audio to output_stem plus the stream's own extension
+        Returns (audio_file_path, video_title)
+        """
+        import yt_dlp
+        
+        ydl_opts = {
+            'format': 'bestaudio/best',
+            'outtmpl': output_stem + '.%(ext)s',
+            'quiet': True,
+            'no_warnings': True,
+        }
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=True)
+            return ydl.prepare_filename(info), info.get('title', 'Unknown')
+
+def load_fetcher():
+    """Instantiate the fetcher named by YOUTUBE_FETCHER, or the yt-dlp one"""
+    if not YOUTUBE_FETCHER:
+        return YtDlpFetcher()
+    module_name, _, class_name = YOUTUBE_FETCHER.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+class YouTubeAudioCache:
+    """
+    Audio files by cache key with size-bounded LRU eviction
+    Each entry is the audio file plus a <key>.json sidecar naming it and the title
+    """
+    
+    def __init__(self, directory: str, max_bytes: int, fetcher=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fetcher = fetcher or load_fetcher()
+        os.makedirs(os.path.join(directory, ".locks"), exist_ok=True)
+    
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+    
+    @contextmanager
+    def _lock(self, key: str, blocking: bool = True):
+        """Per-key file lock shared by threads and processes; yields whether it was acquired"""
+        with open(os.path.join(self.directory, ".locks", f"{key}.lock"), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._meta_path(key)) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        
+        path = os.path.join(self.directory, meta["file"])
+        if not os.path.exists(path):
+            return None
+        return {"path": path, "title": meta["title"]}
+    
+    def get(self, url: str) -> tuple:
+        """
+        Local audio file and title for a URL, downloading it unless cached
+        Concurrent callers for the same video wait for a single download
+        Returns (audio_file_path, video_title)
+        """
+        key = cache_key(url)
+        entry = self._lookup(key)
+        downloaded = False
+        
+        if entry is None:
+            with self._lock(key):
+                # Another caller may have finished the download while we waited
+                entry = self._lookup(key)
+                if entry is None:
+                    entry = self._download(key, url)
+                    downloaded = True
+        else:
+            logger.info(f"YouTube audio cache hit: {key}")
+        
+        # Mark as recently used
+        try:
+            os.utime(entry["path"])
+        except FileNotFoundError:
+            # Evicted between the lookup and now
+            return self.get(url)
+        metrics.count_cache("youtube", hit=not downloaded)
+        if downloaded:
+            self.evict()
+        return entry["path"], entry["title"]
+    
+    @metrics.timed("youtube_download")
+    def _download(self, key: str, url: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        stem = os.path.join(self.directory, f".{key}.{os.getpid()}.{threading.get_ident()}")
+        try:
+            downloaded_path, title = self.fetcher.fetch(url, stem)
+            path = os.path.join(self.directory, key + os.path.splitext(downloaded_path)[1])
+            os.replace(downloaded_path, path)
+        finally:
+            # Partial files left by a failed download
+            prefix = os.path.basename(stem)
+            for name in os.listdir(self.directory):
+                if name.startswith(prefix):
+                    os.unlink(os.path.join(self.directory, name))
+        
+        tmp_meta = self._meta_path(key) + ".tmp"
+        with open(tmp_meta, "w") as f:
+            json.dump({"file": os.path.basename(path), "title": title, "url": url}, f)
+        os.replace(tmp_meta, self._meta_path(key))
+        
+        logger.info(
+            f"Downloaded {key} ({os.path.getsize(path) / 1e6:.1f} MB) "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+        return {"path": path, "title": title}
+    
+    def evict(self) -> None:
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        if not self.max_bytes:
+            return
+        
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-len(".json")]
+            entry = self._lookup(key)
+            if entry is None:
+                continue
+            stat = os.stat(entry["path"])
+            entries.append((stat.st_mtime, stat.st_size, key, entry["path"]))
+        
+        total = sum(size for _, size, _, _ in entries)
+        now = time.time()
+        for mtime, size, key, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if now - mtime < EVICTION_GRACE_SECONDS:
+                continue
+            with self._lock(key, blocking=False) as locked:
+                if not locked:
+                    continue
+                os.unlink(self._meta_path(key))
+                os.unlink(path)
+            total -= size
+            logger.info(f"Evicted {key} from the YouTube audio cache")
+
+_default_cache: Optional[YouTubeAudioCache] = None
+
+def default_cache() -> YouTubeAudioCache:
+    """The process-wide cache configured from the environment"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = YouTubeAudioCache(YOUTUBE_CACHE_DIR, YOUTUBE_CACHE_MAX_BYTES)
+    return _default_cache
@@ -0,0 +1,58 @@
+"""
+Shared Service Modules Check - PhinAccords
+Heavenkeys Ltd
+
+dechord-service and python-service deploy separately, each from its own
+directory, so the modules they share are kept as identical copies in both.
+Exits non-zero, printing a diff, if a copy differs from the other or is missing.
+
+Usage:
+    python scripts/check-shared-modules.py
+"""
+
+import os
+import sys
+import difflib
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVICES = ["dechord-service", "python-service"]
+SHARED_MODULES = [
+    "admission.py",
+    "chord_templates.py",
+    "chord_views.py",
+    "lazy_imports.py",
+    "metrics.py",
+    "singleflight.py",
+    "worker_preload.py",
+]
+
+def read_lines(path: str) -> list:
+    with open(path) as f:
+        return f.readlines()
+
+def main() -> int:
+    failures = 0
+    for module in SHARED_MODULES:
+        paths = [os.path.join(ROOT, service, module) for service in SERVICES]
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            for path in missing:
+                print(f"Missing shared module: {os.path.relpath(path, ROOT)}")
+            failures += 1
+            continue
+        
+        first, second = (read_lines(path) for path in paths)
+        if first != second:
+            sys.stdout.writelines(difflib.unified_diff(
+                first, second, *(os.path.join(service, module) for service in SERVICES)
+            ))
+            failures += 1
+    
+    if failures:
+        print(f"{failures} shared module(s) differ between {' and '.join(SERVICES)}; change both copies together")
+        return 1
+    print(f"{len(SHARED_MODULES)} shared modules identical in {' and '.join(SERVICES)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())